@@ -0,0 +1,425 @@
+"""Benchmarks of the allocation hot path.
+
+There are five levels:
+
+- domain: `cosmic.domain.batch.allocate` and `Product.allocate` on synthetic
+  batches and order lines;
+- events: `services.allocate` with an `EventSourcedUnitOfWork` on SQLite;
+- memory: `services.allocate` with an `InMemoryUnitOfWork`, journaled to a
+  temporary file;
+- services: `services.allocate` with a `SQLAlchemyUnitOfWork` on SQLite;
+- api: `POST /allocate/` on `make_api`, through an ASGI client, at several
+  concurrency levels.
+
+Each benchmark reports its throughput and its p50/p99 latencies. Results are
+written as JSON and can be compared against a stored baseline, in which case
+the exit code tells whether any benchmark regressed.
+
+Levels always run in the order above: once the ORM mappings are started, the
+domain classes are instrumented and slower to build, which would penalize the
+levels that do not use them.
+
+Run with `python -m benchmarks.allocation --output results.json`, and add
+`--baseline baseline.json` (with `--save-baseline` to create it). With
+`--breakdown`, the total time spent in each instrumented step is also printed.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Any, Callable, Iterable
+
+from cosmic import instrumentation
+from cosmic.domain.batch import Batch, BatchReference, allocate
+from cosmic.domain.order import SKU, OrderLine, OrderReference
+from cosmic.domain.product import Product
+
+LEVELS = ["domain", "events", "memory", "services", "api"]
+
+_mappings_started = False
+
+
+@dataclass
+class Result:
+    """Measurements of one benchmark."""
+
+    operations: int
+    throughput: float
+    p50_ms: float
+    p99_ms: float
+
+
+def summarize(latencies: list[float], elapsed: float) -> Result:
+    """Summarize latencies, in seconds, of operations that took `elapsed` seconds."""
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return Result(
+        operations=len(latencies),
+        throughput=len(latencies) / elapsed,
+        p50_ms=percentiles[49] * 1000,
+        p99_ms=percentiles[98] * 1000,
+    )
+
+
+def time_each(operation: Callable[[Any], object], items: Iterable[Any]) -> Result:
+    """Run an operation on each item, timing every call."""
+    latencies = []
+    start = time.perf_counter()
+
+    for item in items:
+        call_start = time.perf_counter()
+        operation(item)
+        latencies.append(time.perf_counter() - call_start)
+
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def make_batches(sku: SKU, count: int, quantity: int) -> list[Batch]:
+    """Make batches with random ETAs for a SKU."""
+    start = date(2020, 1, 1)
+    return [
+        Batch(
+            BatchReference(f"{sku}-batch-{i}"),
+            sku,
+            quantity,
+            start + timedelta(days=random.randrange(365)),
+        )
+        for i in range(count)
+    ]
+
+
+def make_lines(skus: list[SKU], count: int, max_quantity: int) -> list[OrderLine]:
+    """Make order lines, skewed towards the first SKUs."""
+    weights = [1 / (rank + 1) for rank in range(len(skus))]
+    return [
+        OrderLine(OrderReference(f"order-{i}"), sku, random.randint(1, max_quantity))
+        for i, sku in enumerate(random.choices(skus, weights, k=count))
+    ]
+
+
+def start_mappings() -> None:
+    """Start the SQLAlchemy mappings, once."""
+    global _mappings_started  # pylint: disable=global-statement
+
+    if not _mappings_started:
+        from cosmic.sqlalchemy.mappings import start_mappings as start
+
+        start()
+        _mappings_started = True
+
+
+def bench_domain(args: argparse.Namespace) -> dict[str, Result]:
+    """Benchmark the domain allocation functions."""
+    sku = SKU("DOMAIN-SKU")
+    lines = make_lines([sku], args.lines, args.max_quantity)
+    # Half of the batches start exhausted, as they would on a long-lived SKU.
+    quantity = args.lines * args.max_quantity // args.batches + 1
+
+    def fresh_batches() -> list[Batch]:
+        batches = make_batches(sku, args.batches, quantity)
+        for index, batch in enumerate(sorted(batches, key=lambda b: b.eta)):
+            if index < args.batches // 2:
+                batch.allocate(OrderLine(OrderReference(f"old-{index}"), sku, quantity))
+        return batches
+
+    batches = fresh_batches()
+    product = Product(sku, fresh_batches())
+
+    return {
+        "domain.allocate": time_each(lambda line: allocate(line, batches), lines),
+        "domain.Product.allocate": time_each(product.allocate, lines),
+    }
+
+
+def bench_services(args: argparse.Namespace) -> dict[str, Result]:
+    """Benchmark services.allocate with SQLAlchemy on in-memory SQLite."""
+    from cosmic.service_layer import services
+    from cosmic.sqlalchemy.database import Database
+    from cosmic.sqlalchemy.mappings import create_schema
+    from cosmic.sqlalchemy.unit_of_work import SQLAlchemyUnitOfWork
+
+    start_mappings()
+    database = Database.from_url("sqlite://")
+    create_schema(database.engine)
+
+    skus = [SKU(f"SERVICES-SKU-{i}") for i in range(args.skus)]
+    quantity = args.lines * args.max_quantity // args.batches + 1
+
+    def make_uow() -> SQLAlchemyUnitOfWork:
+        return SQLAlchemyUnitOfWork(database.sessions)
+
+    for sku in skus:
+        for batch in make_batches(sku, args.batches, quantity):
+            services.add_batch(
+                services.BatchCandidate(batch.reference, sku, quantity, batch.eta),
+                make_uow(),
+            )
+
+    lines = make_lines(skus, args.lines, args.max_quantity)
+
+    return {
+        "services.allocate": time_each(
+            lambda line: services.allocate(line, make_uow()), lines
+        )
+    }
+
+
+def bench_events(args: argparse.Namespace) -> dict[str, Result]:
+    """Benchmark services.allocate with event-sourced storage on in-memory SQLite."""
+    from cosmic.service_layer import services
+    from cosmic.sqlalchemy.database import Database
+    from cosmic.sqlalchemy.event_store import EventSourcedUnitOfWork
+    from cosmic.sqlalchemy.mappings import create_schema
+
+    database = Database.from_url("sqlite://")
+    create_schema(database.engine)
+
+    skus = [SKU(f"EVENTS-SKU-{i}") for i in range(args.skus)]
+    quantity = args.lines * args.max_quantity // args.batches + 1
+
+    def make_uow() -> EventSourcedUnitOfWork:
+        return EventSourcedUnitOfWork(database.sessions)
+
+    for sku in skus:
+        for batch in make_batches(sku, args.batches, quantity):
+            services.add_batch(
+                services.BatchCandidate(batch.reference, sku, quantity, batch.eta),
+                make_uow(),
+            )
+
+    lines = make_lines(skus, args.lines, args.max_quantity)
+
+    return {
+        "events.allocate": time_each(
+            lambda line: services.allocate(line, make_uow()), lines
+        )
+    }
+
+
+def bench_memory(args: argparse.Namespace) -> dict[str, Result]:
+    """Benchmark services.allocate with the in-memory Unit of Work."""
+    from cosmic.memory.repository import ProductStore
+    from cosmic.memory.unit_of_work import InMemoryUnitOfWork
+    from cosmic.service_layer import services
+
+    skus = [SKU(f"MEMORY-SKU-{i}") for i in range(args.skus)]
+    quantity = args.lines * args.max_quantity // args.batches + 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ProductStore.open(Path(directory) / "journal", args.journal_sync)
+
+        for sku in skus:
+            for batch in make_batches(sku, args.batches, quantity):
+                services.add_batch(
+                    services.BatchCandidate(batch.reference, sku, quantity, batch.eta),
+                    InMemoryUnitOfWork(store),
+                )
+
+        lines = make_lines(skus, args.lines, args.max_quantity)
+        result = time_each(
+            lambda line: services.allocate(line, InMemoryUnitOfWork(store)), lines
+        )
+        store.close()
+
+    return {"memory.allocate": result}
+
+
+def bench_api(args: argparse.Namespace) -> dict[str, Result]:
+    """Benchmark the allocation endpoint at several concurrency levels."""
+    from httpx import AsyncClient
+
+    from cosmic.http_api import make_api
+    from cosmic.messagebus import MessageBus
+    from cosmic.sqlalchemy.database import make_engine
+    from cosmic.sqlalchemy.mappings import create_schema
+
+    start_mappings()
+    results = {}
+
+    for concurrency in args.concurrency:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = make_engine(f"sqlite:///{directory}/api.db")
+            create_schema(engine)
+            app = make_api(
+                engine,
+                MessageBus(),
+                max_workers=concurrency,
+                allocation_shards=args.allocation_shards,
+            )
+
+            results[f"api.allocate.c{concurrency}"] = asyncio.run(
+                _run_api(
+                    args, AsyncClient(app=app, base_url="http://bench"), concurrency
+                )
+            )
+
+            asyncio.run(app.router.shutdown())
+            engine.dispose()
+
+    return results
+
+
+async def _run_api(args: argparse.Namespace, client: Any, concurrency: int) -> Result:
+    skus = [SKU(f"API-SKU-{i}") for i in range(args.skus)]
+    quantity = args.lines * args.max_quantity // args.batches + 1
+
+    async with client:
+        for sku in skus:
+            for batch in make_batches(sku, args.batches, quantity):
+                await client.post(
+                    "/add_batch/",
+                    json={
+                        "ref": batch.reference,
+                        "sku": sku,
+                        "qty": quantity,
+                        "eta": batch.eta.isoformat(),
+                    },
+                )
+
+        semaphore = asyncio.Semaphore(concurrency)
+        latencies: list[float] = []
+
+        async def post(line: OrderLine) -> None:
+            async with semaphore:
+                call_start = time.perf_counter()
+                response = await client.post(
+                    "/allocate/",
+                    json={"orderid": line.order, "sku": line.sku, "qty": line.quantity},
+                )
+                latencies.append(time.perf_counter() - call_start)
+                if response.status_code != 201:
+                    print(f"Allocation failed: {response.text}", file=sys.stderr)
+
+        lines = make_lines(skus, args.lines, args.max_quantity)
+        start = time.perf_counter()
+        await asyncio.gather(*(post(line) for line in lines))
+
+        return summarize(latencies, time.perf_counter() - start)
+
+
+BENCHMARKS: dict[str, Callable[[argparse.Namespace], dict[str, Result]]] = {
+    "domain": bench_domain,
+    "services": bench_services,
+    "events": bench_events,
+    "memory": bench_memory,
+    "api": bench_api,
+}
+
+
+def compare(
+    results: dict[str, dict[str, Any]],
+    baseline: dict[str, dict[str, Any]],
+    tolerance: float,
+) -> list[str]:
+    """Compare results against a baseline.
+
+    Returns:
+        A description of each benchmark whose throughput or p99 latency got
+        worse than the baseline by more than `tolerance`.
+    """
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        base = baseline[name]
+
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {result['throughput']:.1f}/s"
+                f" < baseline {base['throughput']:.1f}/s"
+            )
+
+        if result["p99_ms"] > base["p99_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: p99 {result['p99_ms']:.3f}ms"
+                f" > baseline {base['p99_ms']:.3f}ms"
+            )
+
+    return regressions
+
+
+def main() -> None:
+    """Run the allocation benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description="Benchmark the allocation path.")
+    parser.add_argument("--levels", nargs="+", choices=LEVELS, default=LEVELS)
+    parser.add_argument("--lines", type=int, default=2000)
+    parser.add_argument("--batches", type=int, default=200)
+    parser.add_argument("--skus", type=int, default=10)
+    parser.add_argument("--max-quantity", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument(
+        "--allocation-shards",
+        type=int,
+        help="Allocate through this many sharded workers on the api level.",
+    )
+    parser.add_argument(
+        "--no-journal-sync",
+        dest="journal_sync",
+        action="store_false",
+        help="Do not flush the journal to disk on every commit on the memory level.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Where to write the results.")
+    parser.add_argument("--baseline", type=Path, help="Results to compare with.")
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the baseline instead of comparing with it.",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative slowdown allowed before reporting a regression.",
+    )
+    parser.add_argument(
+        "--breakdown",
+        action="store_true",
+        help="Print the time spent in each instrumented step.",
+    )
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    if args.breakdown:
+        collector = instrumentation.InMemoryCollector()
+        instrumentation.set_collector(collector)
+
+    results = {
+        name: asdict(result)
+        for level in LEVELS
+        if level in args.levels
+        for name, result in BENCHMARKS[level](args).items()
+    }
+    report = json.dumps(results, indent=2)
+
+    print(report)
+
+    if args.breakdown:
+        for name, total in sorted(collector.totals().items()):
+            print(f"{name}: {total * 1000:.1f}ms", file=sys.stderr)
+
+    if args.output:
+        args.output.write_text(report)
+
+    if args.baseline and args.save_baseline:
+        args.baseline.write_text(report)
+    elif args.baseline:
+        regressions = compare(
+            results, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+"""Benchmark of the allocation schema queries, with and without indexes.
+
+Fills a database with synthetic products, batches, order lines and
+allocations, then runs the queries behind loading a Product and looking up
+allocations, showing their query plans and latencies before and after the
+indexes are created. By default it uses an in-memory SQLite database, but any
+SQLAlchemy URL pointing to an empty database (e.g. a local Postgres) can be
+given instead.
+
+Run with `python -m benchmarks.schema --rows 1000000`.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+from itertools import islice
+from typing import Any, Callable, Iterable, Iterator
+
+from sqlalchemy import create_engine, insert, text
+from sqlalchemy.engine import Connection, Engine
+
+from cosmic.sqlalchemy.mappings import (
+    allocations,
+    batches,
+    metadata,
+    order_lines,
+    products,
+)
+
+INSERT_CHUNK_SIZE = 10_000
+
+QUERIES: dict[str, tuple[str, Callable[["RowCounts"], dict[str, Any]]]] = {
+    "product batches": (
+        "SELECT * FROM batches WHERE sku = :sku",
+        lambda rows: {"sku": _sku(random.randrange(rows.products))},
+    ),
+    "batch by reference": (
+        "SELECT * FROM batches WHERE reference = :reference",
+        lambda rows: {"reference": _reference(random.randrange(rows.batches))},
+    ),
+    "allocated lines of a batch": (
+        "SELECT order_lines.* FROM order_lines"
+        " JOIN allocations ON allocations.orderline_id = order_lines.id"
+        " WHERE allocations.batch_id = :batch_id",
+        lambda rows: {"batch_id": random.randrange(rows.batches) + 1},
+    ),
+    "allocation of an order line": (
+        "SELECT batches.reference FROM order_lines"
+        " JOIN allocations ON allocations.orderline_id = order_lines.id"
+        " JOIN batches ON batches.id = allocations.batch_id"
+        ' WHERE order_lines."order" = :order AND order_lines.sku = :sku',
+        lambda rows: _order_line_params(random.randrange(rows.lines), rows),
+    ),
+}
+
+
+class RowCounts:
+    """How many rows of each kind are generated."""
+
+    def __init__(self, lines: int) -> None:
+        self.lines: int = lines
+        self.batches: int = max(lines // 10, 1)
+        self.products: int = max(lines // 100, 1)
+
+
+def _sku(index: int) -> str:
+    return f"SKU-{index}"
+
+
+def _reference(index: int) -> str:
+    return f"BATCH-{index}"
+
+
+def _order_line_params(index: int, rows: RowCounts) -> dict[str, str]:
+    return {"order": f"ORDER-{index}", "sku": _sku(index % rows.products)}
+
+
+def _chunked(items: Iterable[dict[str, Any]]) -> Iterator[list[dict[str, Any]]]:
+    iterator = iter(items)
+
+    while chunk := list(islice(iterator, INSERT_CHUNK_SIZE)):
+        yield chunk
+
+
+def populate(connection: Connection, rows: RowCounts) -> None:
+    """Insert synthetic data in the schema."""
+    start = date(2020, 1, 1)
+
+    data: list[tuple[Any, Iterable[dict[str, Any]]]] = [
+        (
+            products,
+            ({"sku": _sku(i), "version_number": 0} for i in range(rows.products)),
+        ),
+        (
+            batches,
+            (
+                {
+                    "id": i + 1,
+                    "reference": _reference(i),
+                    "sku": _sku(i % rows.products),
+                    "quantity": 1000,
+                    "eta": start + timedelta(days=i % 365),
+                }
+                for i in range(rows.batches)
+            ),
+        ),
+        (
+            order_lines,
+            (
+                {"id": i + 1, "quantity": 1, **_order_line_params(i, rows)}
+                for i in range(rows.lines)
+            ),
+        ),
+        (
+            allocations,
+            (
+                {"orderline_id": i + 1, "batch_id": i % rows.batches + 1}
+                for i in range(rows.lines)
+            ),
+        ),
+    ]
+
+    for table, values in data:
+        for chunk in _chunked(values):
+            connection.execute(insert(table), chunk)
+
+
+def explain(connection: Connection, query: str, params: dict[str, Any]) -> str:
+    """Get the query plan for a query."""
+    prefix = (
+        "EXPLAIN QUERY PLAN " if connection.dialect.name == "sqlite" else "EXPLAIN "
+    )
+    plan = connection.execute(text(prefix + query), params).all()
+    return "\n".join(f"    {' '.join(str(column) for column in row)}" for row in plan)
+
+
+def measure(
+    connection: Connection, rows: RowCounts, repetitions: int
+) -> dict[str, float]:
+    """Run every query with random parameters and get their mean latencies."""
+    latencies = {}
+
+    for name, (query, make_params) in QUERIES.items():
+        statement = text(query)
+        start = time.perf_counter()
+        for _ in range(repetitions):
+            connection.execute(statement, make_params(rows)).all()
+        latencies[name] = (time.perf_counter() - start) / repetitions
+
+        print(f"  {name}: {latencies[name] * 1000:.3f} ms")
+        print(explain(connection, query, make_params(rows)))
+
+    return latencies
+
+
+def run(engine: Engine, rows: RowCounts, repetitions: int) -> None:
+    """Run the benchmark."""
+    indexes = [index for table in metadata.sorted_tables for index in table.indexes]
+
+    metadata.create_all(engine)
+
+    with engine.begin() as connection:
+        for index in indexes:
+            index.drop(connection)
+
+        start = time.perf_counter()
+        populate(connection, rows)
+        print(
+            f"Inserted {rows.lines} order lines in {time.perf_counter() - start:.1f}s"
+        )
+
+    with engine.connect() as connection:
+        print("Without indexes:")
+        before = measure(connection, rows, repetitions)
+
+    with engine.begin() as connection:
+        for index in indexes:
+            index.create(connection)
+
+    with engine.connect() as connection:
+        print("With indexes:")
+        after = measure(connection, rows, repetitions)
+
+    print("Speedup:")
+    for name in QUERIES:
+        print(f"  {name}: {before[name] / after[name]:.1f}x")
+
+
+def main() -> None:
+    """Run the schema benchmark from the command line."""
+    parser = argparse.ArgumentParser(description="Benchmark the schema indexes.")
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repetitions", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    run(create_engine(args.database_url), RowCounts(args.rows), args.repetitions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Benchmark of the allocation simulator against the domain.
+
+Allocates the same synthetic forecast with `cosmic.simulation.simulate` and
+with `cosmic.domain.batch.allocate`, one line at a time, and reports the time
+each took. The domain is only run on a sample of the lines, as it takes far
+longer, and its time is scaled to the whole forecast.
+
+Run with `python -m benchmarks.simulation --lines 1000000`.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from cosmic.domain.batch import Batch, BatchReference, allocate
+from cosmic.domain.order import SKU, OrderLine, OrderReference
+from cosmic.simulation import simulate
+
+
+def main() -> None:
+    """Run the simulator benchmark from the command line."""
+    parser = argparse.ArgumentParser(description="Benchmark the simulator.")
+    parser.add_argument("--lines", type=int, default=1_000_000)
+    parser.add_argument("--batches", type=int, default=2000)
+    parser.add_argument("--skus", type=int, default=100)
+    parser.add_argument("--max-quantity", type=int, default=10)
+    parser.add_argument("--sample", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    skus = [f"SIMULATION-SKU-{i}" for i in range(args.skus)]
+    # Enough stock for about 90% of the forecast.
+    quantity = int(args.lines * args.max_quantity / 2 * 0.9 / args.batches)
+
+    batch_skus = [rng.choice(skus) for _ in range(args.batches)]
+    batch_etas = [
+        date(2010, 1, 1) + timedelta(days=rng.randint(0, 365))
+        for _ in range(args.batches)
+    ]
+    line_skus = [rng.choice(skus) for _ in range(args.lines)]
+    line_quantities = [rng.randint(1, args.max_quantity) for _ in range(args.lines)]
+
+    start = time.perf_counter()
+    result = simulate(
+        batch_skus,
+        [quantity] * args.batches,
+        batch_etas,
+        line_skus,
+        line_quantities,
+    )
+    simulated = time.perf_counter() - start
+    out_of_stock = int((result.batches < 0).sum())
+
+    batches = [
+        Batch(BatchReference(f"b{i}"), SKU(sku), quantity, eta)
+        for i, (sku, eta) in enumerate(zip(batch_skus, batch_etas))
+    ]
+    sample = min(args.sample, args.lines)
+    start = time.perf_counter()
+
+    for i in range(sample):
+        allocate(
+            OrderLine(OrderReference(f"o{i}"), SKU(line_skus[i]), line_quantities[i]),
+            batches,
+        )
+
+    scalar = (time.perf_counter() - start) * args.lines / sample
+
+    print(f"simulate: {simulated:.2f}s, {out_of_stock} lines out of stock")
+    print(f"allocate: {scalar:.2f}s (estimated from {sample} lines)")
+
+
+if __name__ == "__main__":
+    main()
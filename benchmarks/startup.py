@@ -0,0 +1,93 @@
+"""Benchmark of the time it takes to import the entry points of the package.
+
+Each module is imported in a new interpreter with `python -X importtime`, and
+the cumulative import time reported for the module is compared with its
+budget. Every module is measured a few times and the fastest run is kept, as
+the slower ones measure the machine more than the imports.
+
+Budgets are multiples of the time it takes to start a bare interpreter, with
+`python -I -S -c pass`, on the same machine, so they hold on machines slower
+or faster than the one they were set on. Site packages are left out of that
+baseline, as what they run at startup depends on the environment more than on
+the machine.
+
+Run with `python -m benchmarks.startup`; the exit code tells whether any
+module went over its budget. Budgets can still be scaled with `--scale`.
+"""
+import argparse
+import subprocess
+import sys
+import time
+
+# Cumulative import time allowed for each module, in bare interpreter startups.
+BUDGETS = {
+    "cosmic.domain.product": 4,
+    "cosmic.messagebus": 6,
+    "cosmic.service_layer.services": 7,
+    "cosmic.memory.unit_of_work": 9,
+    "cosmic.snapshot": 6,
+    "cosmic.http_api": 65,
+}
+
+
+def startup_time_ms() -> float:
+    """Time starting a bare interpreter that does nothing."""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-I", "-S", "-c", "pass"], check=True)
+    return (time.perf_counter() - start) * 1000
+
+
+def import_time_ms(module: str) -> float:
+    """Import a module in a new interpreter and get its cumulative import time."""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stderr
+
+    for line in output.splitlines():
+        _, cumulative, name = line.split("|")
+
+        if name.strip() == module:
+            return int(cumulative) / 1000
+
+    raise ValueError(f"{module} was not imported.")
+
+
+def main() -> None:
+    """Run the startup benchmark from the command line."""
+    parser = argparse.ArgumentParser(description="Benchmark import times.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="Factor to multiply the budgets by.",
+    )
+    args = parser.parse_args()
+
+    over_budget = []
+    # Starting is quick and noisy, so it is measured more often than imports.
+    baseline = min(startup_time_ms() for _ in range(args.runs * 4))
+    print(f"interpreter startup: {baseline:.1f}ms")
+
+    for module, budget in BUDGETS.items():
+        elapsed = min(import_time_ms(module) for _ in range(args.runs))
+        allowed = budget * baseline * args.scale
+        print(
+            f"{module}: {elapsed:.1f}ms, {elapsed / baseline:.1f} startups "
+            f"(budget {budget * args.scale:g}, {allowed:.0f}ms)"
+        )
+
+        if elapsed > allowed:
+            over_budget.append(module)
+
+    for module in over_budget:
+        print(f"OVER BUDGET {module}", file=sys.stderr)
+
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Benchmark of the memory and hashing cost of the domain value objects.
+
+Compares the events against plain dataclass equivalents, which is what they
+were before being made immutable and slotted, by the memory taken by each
+instance. `OrderLine` stays a plain dataclass, as SQLAlchemy maps it, and its
+memory and the time to hash lines, as done when building and querying the sets
+of allocated lines of batches, are reported for reference.
+
+Lines are measured unmapped, as SQLAlchemy adds its own state to each mapped
+instance.
+
+Run with `python -m benchmarks.value_objects --count 100000`.
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from cosmic.domain.events import OutOfStock
+from cosmic.domain.order import SKU, OrderLine, OrderReference
+
+
+@dataclass
+class PlainOutOfStock:
+    """An OutOfStock event as a plain dataclass."""
+
+    sku: SKU
+
+
+def bytes_per_instance(make: Callable[[int], Any], count: int) -> float:
+    """Measure the memory taken by each of `count` instances."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    instances = [make(i) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # The list holding the instances is not part of them.
+    return (after - before) / len(instances) - 8
+
+
+def hashing_seconds(lines: list[Any], rounds: int) -> float:
+    """Time building a set of lines and then looking every line up in it."""
+    start = time.perf_counter()
+
+    for _ in range(rounds):
+        allocated = set(lines)
+        for line in lines:
+            assert line in allocated
+
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    """Run the value object benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description="Benchmark the value objects.")
+    parser.add_argument("--count", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    # The strings are shared, as they would be by lines of the same order and SKU.
+    order, sku = OrderReference("order"), SKU("SKU")
+
+    memory = {
+        "OrderLine": bytes_per_instance(lambda i: OrderLine(order, sku, i), args.count),
+        "OutOfStock": bytes_per_instance(lambda _: OutOfStock(sku), args.count),
+        "PlainOutOfStock": bytes_per_instance(
+            lambda _: PlainOutOfStock(sku), args.count
+        ),
+    }
+
+    for name, size in memory.items():
+        print(f"{name}: {size:.0f} bytes per instance")
+
+    lines = [OrderLine(order, sku, i) for i in range(args.count)]
+    elapsed = hashing_seconds(lines, args.rounds)
+    per_line = elapsed / (args.count * args.rounds) * 1e9
+    print(f"OrderLine: {per_line:.0f}ns per line hashed twice")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 """Operations on product batches."""
+import os
 from dataclasses import dataclass, field
 from datetime import date
-from typing import NewType
+from typing import AbstractSet, Iterable, NewType
 
 from .order import SKU, OrderLine
 
@@ -10,10 +11,20 @@ class NotEnoughProductsOnBatch(Exception):
     """Happens when a batch doesn't have enough products to allocate an order line."""
 
 
+class InconsistentBatch(Exception):
+    """Signals that the allocated quantity of a batch does not match its lines."""
+
+
+# Whether batches check their running allocated total against their allocated
+# lines after every change. The check walks every line, so it is off unless
+# COSMIC_CHECK_BATCHES is set in the environment, or this is set to True.
+CHECK_CONSISTENCY = bool(os.environ.get("COSMIC_CHECK_BATCHES"))
+
+
 BatchReference = NewType("BatchReference", str)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class BatchCandidate:
     """Candidate values for a Batch."""
 
@@ -32,12 +43,21 @@ class Batch:
     quantity: int
     eta: date
     _allocated: set[OrderLine] = field(init=False, default_factory=set)
+    # A factory makes __init__ set the value, as mappers replace class defaults.
+    _allocated_quantity: int = field(init=False, default_factory=int)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Batch):
             return False
         return self.reference == other.reference
 
+    def __copy__(self) -> "Batch":
+        """Copy the batch, with its own set of allocated lines."""
+        batch = Batch(self.reference, self.sku, self.quantity, self.eta)
+        batch._allocated = set(self._allocated)
+        batch._allocated_quantity = self._allocated_quantity
+        return batch
+
     def can_allocate(self, order_line: OrderLine) -> bool:
         """Check if a batch can allocate a given order line.
 
@@ -61,6 +81,8 @@ class Batch:
         Raises:
             NotEnoughProductsOnBatch: if this batch does not contain enough products
                                       of the given type.
+            InconsistentBatch: if CHECK_CONSISTENCY is set and the allocated
+                               quantity does not match the allocated lines.
         """
         if not self.can_allocate(order_line):
             raise NotEnoughProductsOnBatch(
@@ -69,23 +91,69 @@ class Batch:
                 f"of type {self.sku}."
             )
 
-        self._allocated.add(order_line)
+        if order_line not in self._allocated:
+            self._allocated.add(order_line)
+            self._allocated_quantity += order_line.quantity
+
+        if CHECK_CONSISTENCY:
+            self._check_allocated_quantity()
 
     def deallocate(self, order_line: OrderLine) -> None:
         """Deallocate an order from a batch.
 
         Args:
             order_line: The order line to deallocate.
+
+        Raises:
+            InconsistentBatch: if CHECK_CONSISTENCY is set and the allocated
+                               quantity does not match the allocated lines.
         """
         try:
             self._allocated.remove(order_line)
         except KeyError:
             pass
+        else:
+            self._allocated_quantity -= order_line.quantity
+
+        if CHECK_CONSISTENCY:
+            self._check_allocated_quantity()
+
+    @property
+    def allocated_lines(self) -> AbstractSet[OrderLine]:
+        """Get the order lines allocated to this batch."""
+        return self._allocated
 
     def available(self) -> int:
         """Get the number of available products still remaining."""
-        allocated_total = sum(line.quantity for line in self._allocated)
-        return self.quantity - allocated_total
+        return self.quantity - self._allocated_quantity
+
+    def _check_allocated_quantity(self) -> None:
+        """Check the running allocated total against the allocated lines."""
+        allocated = sum(line.quantity for line in self._allocated)
+
+        if self._allocated_quantity != allocated:
+            raise InconsistentBatch(
+                f"Batch {self.reference} has {self._allocated_quantity} products "
+                f"allocated, but its lines add up to {allocated}."
+            )
+
+
+def batch_eta(batch: Batch) -> date:
+    """Get the ETA of a batch, to be used as a sorting key."""
+    return batch.eta
+
+
+def choose_batch(order_line: OrderLine, batches: Iterable[Batch]) -> Batch | None:
+    """Choose the first batch that can allocate an order line.
+
+    Args:
+        order_line: The order line to allocate.
+        batches: The candidate batches, already in order of preference.
+
+    Return:
+        The first batch which can allocate the line, if any.
+    """
+    return next((batch for batch in batches if batch.can_allocate(order_line)), None)
 
 
 def allocate(order_line: OrderLine, batches: list[Batch]) -> None | BatchReference:
@@ -98,10 +166,7 @@ def allocate(order_line: OrderLine, batches: list[Batch]) -> None | BatchReferen
     Return:
         The reference of the chosen batch.
     """
-    sorted_batches = sorted(batches, key=lambda b: b.eta)
-    good_batch = next(
-        (batch for batch in sorted_batches if batch.can_allocate(order_line)), None
-    )
+    good_batch = choose_batch(order_line, sorted(batches, key=batch_eta))
 
     if good_batch is None:
         return None
@@ -1,30 +1,63 @@
 """Events that can happen in the system."""
 from dataclasses import dataclass
+from datetime import date
 
-from .batch import BatchCandidate
-from .order import SKU, OrderCandidate
+from .batch import BatchCandidate, BatchReference
+from .order import SKU, OrderCandidate, OrderReference
 
 
 class Event:
     """Base class for all events."""
 
+    __slots__ = ()
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class OutOfStock(Event):
     """Signal that a given product is out of stock."""
 
     sku: SKU
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class BatchCreated(Event):
     """Signal that a batch creation has been requested."""
 
     candidate: BatchCandidate
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class AllocationRequired(Event):
     """Signal that an allocation has been required."""
 
     order_line: OrderCandidate
+
+
+@dataclass(frozen=True, slots=True)
+class BatchAdded(Event):
+    """Signal that a batch was added to a product."""
+
+    reference: BatchReference
+    sku: SKU
+    quantity: int
+    eta: date
+
+
+@dataclass(frozen=True, slots=True)
+class Allocated(Event):
+    """Signal that the line of an order was allocated to a batch."""
+
+    order: OrderReference
+    sku: SKU
+    quantity: int
+    batchref: BatchReference
+
+
+@dataclass(frozen=True, slots=True)
+class Deallocated(Event):
+    """Signal that the line of an order was deallocated from a batch."""
+
+    order: OrderReference
+    sku: SKU
+    quantity: int
+    batchref: BatchReference
@@ -6,7 +6,7 @@ SKU = NewType("SKU", str)
 OrderReference = NewType("OrderReference", str)
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class OrderCandidate:
     """The requested info of what may eventually be an order."""
 
@@ -15,7 +15,10 @@ class OrderCandidate:
     quantity: int
 
 
-# TODO: check if it is possible to operate with a frozen class.
+# Neither frozen nor slotted: SQLAlchemy sets its own attributes on mapped
+# instances and keeps their state in __dict__. Fields must not be changed once
+# set, as batches keep lines in sets by their hash, but that is not enforced:
+# overriding __setattr__ would add a Python call to every assignment.
 @dataclass(unsafe_hash=True)
 class OrderLine:
     """One line of an Order, with a product's SKU and a quantity."""
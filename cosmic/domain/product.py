@@ -1,20 +1,79 @@
 """Aggregate for Batches."""
+from bisect import insort
 from collections import deque
+from copy import copy
 from dataclasses import dataclass, field
+from typing import Callable
 
-from .batch import Batch, BatchReference, allocate
-from .events import Event, OutOfStock
-from .order import SKU, OrderLine
+from ..instrumentation import count, span
+from .batch import Batch, BatchReference, batch_eta, choose_batch
+from .events import Allocated, BatchAdded, Deallocated, Event, OutOfStock
+from .order import SKU, OrderLine, OrderReference
+
+# The events that record changes to a Product, which `Product.apply` replays.
+CHANGES = (BatchAdded, Allocated, Deallocated)
+
+# Finds the allocated line of an order and the batch holding it, if any.
+AllocationSource = Callable[[OrderReference], tuple[OrderLine, BatchReference] | None]
+
+
+class InvalidSku(Exception):
+    """Signals that an invalid SKU was requested."""
+
+
+class ConcurrentUpdate(Exception):
+    """Signals that a Product was changed by someone else since it was loaded."""
+
+
+class AlreadyAllocated(Exception):
+    """Signals that an order already has a different line allocated for a Product."""
 
 
 @dataclass
 class Product:
-    """Aggregate for Batches of products with the same SKU."""
+    """Aggregate for Batches of products with the same SKU.
+
+    Batches are kept ordered by ETA, so they should be added through
+    `add_batch` instead of being appended to `batches` directly.
+
+    Every change bumps `version_number`, which persistence uses to detect
+    concurrent updates to the same Product.
+
+    An order is expected to have a single line for a Product, which is what
+    deallocations look up. Lines are looked up in an index of every allocated
+    line, or through a source given to `look_up_allocations_with`, so Products
+    loaded from a database do not need every line to be loaded.
+    """
 
     sku: SKU
     batches: list[Batch]
     version_number: int = 0
     _events: deque[Event] = field(init=False, default_factory=deque)
+    # Built on first use, as Products loaded by the ORM do not run `__init__`.
+    _batches_in_stock: list[Batch] | None = field(
+        init=False, default=None, repr=False, compare=False
+    )
+    _allocations: dict[OrderReference, tuple[OrderLine, Batch]] | None = field(
+        init=False, default=None, repr=False, compare=False
+    )
+    _allocation_source: AllocationSource | None = field(
+        init=False, default=None, repr=False, compare=False
+    )
+    # The lines found through the source, or allocated or deallocated since.
+    _known_allocations: dict[
+        OrderReference, tuple[OrderLine, Batch] | None
+    ] | None = field(init=False, default=None, repr=False, compare=False)
+    # Copies share the batches of their original until they change them.
+    _original: "Product | None" = field(
+        init=False, default=None, repr=False, compare=False
+    )
+    _shared_batches: set[BatchReference] | None = field(
+        init=False, default=None, repr=False, compare=False
+    )
+    _replaced: bool = field(init=False, default=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.batches.sort(key=batch_eta)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, Product):
@@ -24,16 +83,283 @@ class Product:
     def __hash__(self) -> int:
         return hash(self.sku)
 
+    def __copy__(self) -> "Product":
+        """Copy the Product, which can then change independently.
+
+        The copy shares the batches of this Product, copying each of them only
+        when it first changes it, and looks allocated lines up in this Product,
+        which must not change anymore. Once the copy is committed in its place,
+        `replace_original` hands the index of this Product over to the copy.
+        """
+        product = Product(self.sku, list(self.batches), self.version_number)
+        product._original = self
+        product._shared_batches = {batch.reference for batch in self.batches}
+        product.look_up_allocations_with(self._allocation_for_copies)
+        return product
+
+    def replace_original(self) -> None:
+        """Take over from the Product this one was copied from, if any.
+
+        This should be called once the copy replaces its original, which then
+        hands its index of allocated lines over. Copies of the original still
+        in use fail with ConcurrentUpdate when they look allocated lines up.
+        """
+        if (original := self._original) is None:
+            return
+
+        originals = {batch.reference: batch for batch in original.batches}
+        copied = [
+            batch
+            for batch in self.batches
+            if originals.get(batch.reference, batch) is not batch
+        ]
+        index, known = original._allocations, self._known_allocations
+        original._replaced = True
+        original._allocations = None
+        self._original = None
+        self._shared_batches = None
+        self._allocation_source = None
+        self._known_allocations = None
+
+        if index is None or known is None:
+            return
+
+        for order, allocation in known.items():
+            if allocation is None:
+                index.pop(order, None)
+            else:
+                index[order] = allocation
+
+        for batch in copied:
+            for line in batch.allocated_lines:
+                index[line.order] = (line, batch)
+
+        self._allocations = index
+
+    def add_batch(self, batch: Batch) -> None:
+        """Add a batch to the product, keeping the batches ordered by ETA."""
+        self._add_batch(batch)
+        self.version_number += 1
+        self.events.append(
+            BatchAdded(batch.reference, self.sku, batch.quantity, batch.eta)
+        )
+
     def allocate(self, line: OrderLine) -> BatchReference | None:
-        """Try to allocate an OrderLine on a batch from our collection."""
-        result = allocate(line, self.batches)
+        """Try to allocate an OrderLine on a batch from our collection.
+
+        Allocating a line that is already allocated changes nothing and raises
+        no events, but still gives the batch it is allocated to.
+
+        Raises:
+            AlreadyAllocated: if another line of the order is allocated, which
+                should be reallocated instead.
+        """
+        with span("product.allocate"):
+            if (allocation := self._allocation(line.order)) is not None:
+                allocated, allocated_to = allocation
+
+                if allocated != line:
+                    raise AlreadyAllocated(
+                        f"Order {line.order} already has {allocated.quantity} "
+                        f"products of type {line.sku} allocated."
+                    )
 
-        if result is None:
-            self.events.append(OutOfStock(line.sku))
+                return allocated_to.reference
+
+            batch = choose_batch(line, self.batches_in_stock)
+
+            if batch is None:
+                count("product.out_of_stock")
+                self.events.append(OutOfStock(line.sku))
+                return None
+
+            self._allocate(line, batch)
+            self.version_number += 1
+            self.events.append(
+                Allocated(line.order, line.sku, line.quantity, batch.reference)
+            )
+            return batch.reference
+
+    def deallocate(self, order: OrderReference) -> OrderLine | None:
+        """Deallocate the line of an order from its batch.
+
+        Returns:
+            The deallocated line, or None if the order was not allocated.
+        """
+        if (allocation := self._allocation(order)) is None:
             return None
 
+        line, batch = allocation
+        self._deallocate(line, batch)
+        self.version_number += 1
+        self.events.append(
+            Deallocated(line.order, line.sku, line.quantity, batch.reference)
+        )
+        return line
+
+    def apply(self, event: Event) -> None:
+        """Replay a change recorded by an event this Product raised.
+
+        The Product ends up as it was right after raising the event, including
+        its version. No new events are raised.
+        """
+        match event:
+            case BatchAdded(reference, sku, quantity, eta):
+                self._add_batch(Batch(reference, sku, quantity, eta))
+            case Allocated(order, sku, quantity, batchref):
+                self._allocate(OrderLine(order, sku, quantity), self._batch(batchref))
+            case Deallocated(order, sku, quantity, batchref):
+                self._deallocate(OrderLine(order, sku, quantity), self._batch(batchref))
+            case _:
+                return
+
         self.version_number += 1
-        return result
+
+    def _add_batch(self, batch: Batch) -> None:
+        # The batches in stock are built before changing batches, here and below,
+        # or building them would already reflect the change.
+        in_stock = self.batches_in_stock
+        insort(self.batches, batch, key=batch_eta)
+
+        if batch.available() > 0:
+            insort(in_stock, batch, key=batch_eta)
+
+    def _allocate(self, line: OrderLine, batch: Batch) -> None:
+        in_stock = self.batches_in_stock
+        batch = self._own(batch)
+        batch.allocate(line)
+        self._index_allocation(line, batch)
+
+        if batch.available() <= 0:
+            in_stock.remove(batch)
+
+    def _deallocate(self, line: OrderLine, batch: Batch) -> None:
+        in_stock = self.batches_in_stock
+        batch = self._own(batch)
+        self._unindex_allocation(line.order)
+        was_exhausted = batch.available() <= 0
+        batch.deallocate(line)
+
+        if was_exhausted and batch.available() > 0:
+            insort(in_stock, batch, key=batch_eta)
+
+    def _own(self, batch: Batch) -> Batch:
+        # Copy a batch shared with the original before changing it, and use the
+        # copy wherever the shared batch was.
+        if self._shared_batches is None or batch.reference not in self._shared_batches:
+            return batch
+
+        self._shared_batches.remove(batch.reference)
+        owned = copy(batch)
+        self.batches[self.batches.index(batch)] = owned
+
+        if self._batches_in_stock is not None and batch in self._batches_in_stock:
+            self._batches_in_stock[self._batches_in_stock.index(batch)] = owned
+
+        if self._allocations is not None:
+            for line in owned.allocated_lines:
+                self._allocations[line.order] = (line, owned)
+
+        if self._known_allocations is not None:
+            for order, allocation in self._known_allocations.items():
+                if allocation is not None and allocation[1] is batch:
+                    self._known_allocations[order] = (allocation[0], owned)
+
+        return owned
+
+    def _batch(self, reference: BatchReference) -> Batch:
+        return next(batch for batch in self.batches if batch.reference == reference)
+
+    def allocation_for(self, order: OrderReference) -> BatchReference | None:
+        """Get the reference of the batch the line of an order is allocated to."""
+        allocation = self._allocation(order)
+        return None if allocation is None else allocation[1].reference
+
+    def look_up_allocations_with(self, source: AllocationSource) -> None:
+        """Find allocated lines through `source` instead of building the index.
+
+        The source must know every line allocated so far, as only the lines
+        allocated or deallocated from now on are remembered on top of it. This
+        does nothing if the index was already built, as it is kept up to date.
+        """
+        if self._allocations is None:
+            self._allocation_source = source
+            self._known_allocations = {}
+
+    @property
+    def batches_in_stock(self) -> list[Batch]:
+        """Get the batches which still have products available, ordered by ETA.
+
+        Exhausted batches are left out, so allocations do not have to walk past
+        every batch the product ever had.
+        """
+        if self._batches_in_stock is None:
+            self._batches_in_stock = [
+                batch for batch in self.batches if batch.available() > 0
+            ]
+
+        return self._batches_in_stock
+
+    def _allocation(self, order: OrderReference) -> tuple[OrderLine, Batch] | None:
+        source, known = self._allocation_source, self._known_allocations
+
+        if self._allocations is not None or source is None or known is None:
+            return self.allocations.get(order)
+
+        if order not in known:
+            found = source(order)
+            known[order] = None if found is None else (found[0], self._batch(found[1]))
+
+        return known[order]
+
+    def _allocation_for_copies(
+        self, order: OrderReference
+    ) -> tuple[OrderLine, BatchReference] | None:
+        # Checked before and after, as the index changes once replaced.
+        if not self._replaced:
+            allocation = self._allocation(order)
+
+            if not self._replaced:
+                return (
+                    None
+                    if allocation is None
+                    else (allocation[0], allocation[1].reference)
+                )
+
+        raise ConcurrentUpdate(f"Product {self.sku} was committed by someone else.")
+
+    def _index_allocation(self, line: OrderLine, batch: Batch) -> None:
+        # Replaying changes does not need the index, so it is only kept up to date
+        # once something built it, instead of loading every allocated line for it.
+        if self._allocations is not None:
+            self._allocations[line.order] = (line, batch)
+        elif self._known_allocations is not None:
+            self._known_allocations[line.order] = (line, batch)
+
+    def _unindex_allocation(self, order: OrderReference) -> None:
+        if self._allocations is not None:
+            del self._allocations[order]
+        elif self._known_allocations is not None:
+            self._known_allocations[order] = None
+
+    @property
+    def allocations(self) -> dict[OrderReference, tuple[OrderLine, Batch]]:
+        """Get the allocated line of each order and the batch holding it.
+
+        The index is built from the allocated lines of every batch on first use
+        and kept up to date afterwards. Any source of allocated lines is no
+        longer used then.
+        """
+        if self._allocations is None:
+            self._allocations = {
+                line.order: (line, batch)
+                for batch in self.batches
+                for line in batch.allocated_lines
+            }
+            self._allocation_source = None
+            self._known_allocations = None
+
+        return self._allocations
 
     @property
     def events(self) -> deque[Event]:
@@ -1,16 +1,37 @@
 """HTTP API using FastAPI."""
+import asyncio
+import codecs
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
 
-from fastapi import FastAPI, Response
+from fastapi import FastAPI, Request, Response
 from pydantic import BaseModel  # pylint: disable=no-name-in-module
 from sqlalchemy.engine import Engine
-from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 
 from .domain.order import SKU, OrderLine, OrderReference
+from .importer import FeedFormat, InvalidRow, parse_batches
 from .messagebus import MessageBus
+from .repository import ProductCache, SkuIndex
 from .service_layer import services
-from .service_layer.unit_of_work import TrackingUnitOfWork
-from .sqlalchemy.unit_of_work import SQLAlchemyUnitOfWork
+from .service_layer.sharding import ShardedAllocator
+from .service_layer.unit_of_work import TrackingUnitOfWork, UnitOfWork
+from .sqlalchemy import views
+from .sqlalchemy.bulk import BatchImporter, ImportResult
+from .sqlalchemy.database import make_session_factory
+from .sqlalchemy.mappings import batches_reference_index, violates
+from .sqlalchemy.outbox import OutboxUnitOfWork
+from .sqlalchemy.repository import SQLAlchemyProductRepository
+from .sqlalchemy.unit_of_work import SessionFactory, SQLAlchemyUnitOfWork
+
+T = TypeVar("T")
+
+FEED_FORMATS = {
+    "text/csv": FeedFormat.CSV,
+    "application/x-ndjson": FeedFormat.NDJSON,
+}
 
 
 class AllocateRequest(BaseModel):
@@ -33,6 +54,74 @@ class AllocateResponse(BaseModel):
     batchref: str
 
 
+class DeallocateRequest(BaseModel):
+    """Data for the deallocation request."""
+
+    orderid: str
+    sku: str
+
+
+class BulkAllocateRequest(BaseModel):
+    """Data for the bulk allocation request."""
+
+    lines: list[AllocateRequest]
+
+
+class LineAllocationResult(BaseModel):
+    """Data for the allocation result of one line in a bulk allocation."""
+
+    orderid: str
+    sku: str
+    batchref: str | None = None
+    message: str | None = None
+    conflict: bool = False
+
+
+class BulkAllocateResponse(BaseModel):
+    """Data for the bulk allocation response."""
+
+    results: list[LineAllocationResult]
+
+
+class OrderAllocation(BaseModel):
+    """Data for where the line of an order for a SKU is allocated."""
+
+    sku: str
+    qty: int
+    batchref: str
+
+
+class AllocationsResponse(BaseModel):
+    """Data for the allocations of an order."""
+
+    orderid: str
+    allocations: list[OrderAllocation]
+
+
+class BatchStock(BaseModel):
+    """Data for the stock of a batch."""
+
+    batchref: str
+    eta: str
+    qty: int
+    available: int
+
+
+class StockResponse(BaseModel):
+    """Data for the stock of a SKU."""
+
+    sku: str
+    available: int
+    batches: list[BatchStock]
+
+
+class BulkAddBatchResponse(BaseModel):
+    """Data for the bulk batch addition response."""
+
+    imported: int
+    skipped: int
+
+
 class AddBatchRequest(BaseModel):
     """Data for the allocation request."""
 
@@ -42,12 +131,90 @@ class AddBatchRequest(BaseModel):
     eta: str
 
 
-def make_api(engine: Engine, messagebus: MessageBus):
-    """Create the API."""
+def make_api(
+    engine: Engine,
+    messagebus: MessageBus,
+    max_workers: int | None = None,
+    use_outbox: bool = False,
+    product_cache: ProductCache | None = None,
+    session_factory: SessionFactory | None = None,
+    read_model: bool = False,
+    allocation_shards: int | None = None,
+    sku_index: SkuIndex | None = None,
+):
+    """Create the API.
+
+    Sessions come from `session_factory`, which should be shared with the other
+    users of `engine` (see `cosmic.sqlalchemy.database`). If None, one is made
+    for `engine` when the API is created.
+
+    With `read_model`, `GET /allocations/{orderid}` and `GET /stock/{sku}` are
+    served from the read model in `cosmic.sqlalchemy.views`, which is kept up
+    to date by handlers registered on `messagebus` (or on the relay's, when
+    using the outbox).
+
+    With a `sku_index`, the SKUs of the stored Products are loaded into it when
+    the API is created, and allocations of SKUs recently found not to exist
+    are rejected without querying the database.
+
+    With `allocation_shards`, `POST /allocate/` hands lines to a
+    `ShardedAllocator` with that many workers, so each Product is only changed
+    by the worker that owns its SKU.
+
+    The service layer blocks on database I/O, so it runs on a thread pool of at
+    most `max_workers` threads (the `ThreadPoolExecutor` default if None),
+    keeping the event loop free to serve other requests meanwhile.
+
+    With `use_outbox`, events are stored in the outbox instead of being handled
+    by `messagebus`, and an `OutboxRelay` worker is expected to dispatch them.
+
+    With a `product_cache`, recently used Products are reused between requests
+    as long as their version did not change.
+    """
     app = FastAPI()
+    executor = ThreadPoolExecutor(max_workers, thread_name_prefix="cosmic-api")
+    get_session = session_factory or make_session_factory(engine)
+
+    if read_model and not use_outbox:
+        views.register_handlers(messagebus, get_session)
+
+    if sku_index is not None:
+        with get_session() as session:
+            sku_index.add(SQLAlchemyProductRepository(session).skus())
 
-    def get_session() -> Session:
-        return Session(engine)
+    def make_uow() -> UnitOfWork:
+        uow = SQLAlchemyUnitOfWork(
+            get_session, product_cache=product_cache, sku_index=sku_index
+        )
+        if use_outbox:
+            return OutboxUnitOfWork(uow)
+        return TrackingUnitOfWork(uow, messagebus)
+
+    allocator = (
+        ShardedAllocator(make_uow, allocation_shards)
+        if allocation_shards is not None
+        else None
+    )
+
+    async def run_blocking(function: Callable[..., T], *args: object) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, partial(function, *args))
+
+    async def allocate(line: OrderLine) -> str:
+        if sku_index is not None:
+            sku_index.check(line.sku)
+        if allocator is None:
+            return await run_blocking(services.allocate, line, make_uow())
+        # Submitting blocks while the queue of the shard is full.
+        future = await run_blocking(allocator.submit, line)
+        return await asyncio.wrap_future(future)
+
+    @app.on_event("shutdown")
+    def shutdown_executor() -> None:
+        executor.shutdown()
+
+        if allocator is not None:
+            allocator.shutdown()
 
     @app.post("/allocate/", status_code=201)
     async def allocate_endpoint(
@@ -59,26 +226,240 @@ def make_api(engine: Engine, messagebus: MessageBus):
             data.qty,
         )
 
-        uow = TrackingUnitOfWork(SQLAlchemyUnitOfWork(get_session), messagebus)
+        try:
+            batch = await allocate(order_line)
+        except (
+            services.OutOfStock,
+            services.InvalidSku,
+            services.AlreadyAllocated,
+        ) as exc:
+            response.status_code = 400
+            return ErrorResponse(message=str(exc))
+        except services.ConcurrentUpdate as exc:
+            response.status_code = 409
+            return ErrorResponse(message=str(exc))
+
+        return AllocateResponse(batchref=batch)
+
+    @app.post("/deallocate/")
+    async def deallocate_endpoint(
+        data: DeallocateRequest, response: Response
+    ) -> AllocateResponse | ErrorResponse:
+        try:
+            batch = await run_blocking(
+                services.deallocate, data.orderid, data.sku, make_uow()
+            )
+        except (services.NotAllocated, services.InvalidSku) as exc:
+            response.status_code = 400
+            return ErrorResponse(message=str(exc))
+        except services.ConcurrentUpdate as exc:
+            response.status_code = 409
+            return ErrorResponse(message=str(exc))
+
+        return AllocateResponse(batchref=batch)
+
+    @app.post("/reallocate/", status_code=201)
+    async def reallocate_endpoint(
+        data: AllocateRequest, response: Response
+    ) -> AllocateResponse | ErrorResponse:
+        order_line = OrderLine(
+            OrderReference(data.orderid),
+            SKU(data.sku),
+            data.qty,
+        )
 
         try:
-            batch = services.allocate(order_line, uow)
-        except (services.OutOfStock, services.InvalidSku) as exc:
+            batch = await run_blocking(services.reallocate, order_line, make_uow())
+        except (
+            services.OutOfStock,
+            services.InvalidSku,
+            services.NotAllocated,
+        ) as exc:
             response.status_code = 400
             return ErrorResponse(message=str(exc))
+        except services.ConcurrentUpdate as exc:
+            response.status_code = 409
+            return ErrorResponse(message=str(exc))
 
         return AllocateResponse(batchref=batch)
 
+    @app.post("/allocate/bulk/")
+    async def allocate_bulk_endpoint(
+        data: BulkAllocateRequest, response: Response
+    ) -> BulkAllocateResponse:
+        order_lines = [
+            OrderLine(OrderReference(line.orderid), SKU(line.sku), line.qty)
+            for line in data.lines
+        ]
+
+        results = await run_blocking(services.allocate_many, order_lines, make_uow())
+
+        # Lines of other chunks may have been allocated, so every result is still
+        # reported, and the conflicting lines are marked for the client to retry.
+        if any(
+            isinstance(result.error, services.ConcurrentUpdate) for result in results
+        ):
+            response.status_code = 409
+
+        return BulkAllocateResponse(
+            results=[
+                LineAllocationResult(
+                    orderid=line.orderid,
+                    sku=line.sku,
+                    batchref=result.batchref,
+                    message=str(result.error) if result.error else None,
+                    conflict=isinstance(result.error, services.ConcurrentUpdate),
+                )
+                for line, result in zip(data.lines, results)
+            ]
+        )
+
+    importer = BatchImporter(
+        get_session,
+        None if use_outbox else messagebus,
+        use_outbox=use_outbox,
+        sku_index=sku_index,
+    )
+
+    @app.post("/add_batch/bulk/")
+    async def add_batch_bulk(
+        request: Request, response: Response
+    ) -> BulkAddBatchResponse | ErrorResponse:
+        content_type = request.headers.get("content-type", "").split(";")[0]
+
+        if (feed_format := FEED_FORMATS.get(content_type.strip())) is None:
+            response.status_code = 415
+            return ErrorResponse(
+                message=f"Expected one of {', '.join(FEED_FORMATS)} content."
+            )
+
+        result = ImportResult()
+
+        try:
+            async for lines in _line_blocks(
+                request.stream(),
+                importer.chunk_size,
+                keep_header=feed_format is FeedFormat.CSV,
+            ):
+                candidates = list(parse_batches(lines, feed_format))
+                result += await run_blocking(importer.import_chunk, candidates)
+        except InvalidRow as exc:
+            response.status_code = 400
+            return ErrorResponse(
+                message=f"{exc} ({result.imported} batches imported before it)"
+            )
+
+        return BulkAddBatchResponse(imported=result.imported, skipped=result.skipped)
+
     @app.post("/add_batch/", status_code=201)
-    async def add_batch(data: AddBatchRequest) -> str:
+    async def add_batch(
+        data: AddBatchRequest, response: Response
+    ) -> str | ErrorResponse:
         eta = datetime.fromisoformat(data.eta).date()
 
-        uow = TrackingUnitOfWork(SQLAlchemyUnitOfWork(get_session), messagebus)
+        try:
+            await run_blocking(
+                services.add_batch,
+                services.BatchCandidate(data.ref, data.sku, data.qty, eta),
+                make_uow(),
+            )
+        except IntegrityError as exc:
+            # Batch references are unique across every SKU, which only the
+            # database can check.
+            if not violates(exc, batches_reference_index):
+                raise
 
-        services.add_batch(
-            services.BatchCandidate(data.ref, data.sku, data.qty, eta), uow
-        )
+            response.status_code = 409
+            return ErrorResponse(message=f"Batch {data.ref} already exists")
 
         return "OK"
 
+    if read_model:
+        _add_read_model_endpoints(app, get_session, run_blocking)
+
     return app
+
+
+async def _line_blocks(
+    chunks: AsyncIterator[bytes], size: int, keep_header: bool
+) -> AsyncIterator[list[str]]:
+    """Split a stream of bytes into blocks of up to `size` lines.
+
+    With `keep_header`, the first line is repeated at the start of every block.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    header: list[str] = []
+    block: list[str] = []
+    pending = ""
+
+    async for chunk in chunks:
+        *lines, pending = (pending + decoder.decode(chunk)).split("\n")
+
+        for line in lines:
+            if keep_header and not header:
+                header = [line]
+                continue
+
+            block.append(line)
+
+            if len(block) >= size:
+                yield header + block
+                block = []
+
+    if pending := pending + decoder.decode(b"", final=True):
+        block.append(pending)
+
+    if block:
+        yield header + block
+
+
+def _add_read_model_endpoints(
+    app: FastAPI,
+    get_session: SessionFactory,
+    run_blocking: Callable[..., Awaitable],
+) -> None:
+    @app.get("/allocations/{orderid}")
+    async def allocations_endpoint(
+        orderid: str, response: Response
+    ) -> AllocationsResponse | ErrorResponse:
+        allocations = await run_blocking(views.allocations, get_session, orderid)
+
+        if not allocations:
+            response.status_code = 404
+            return ErrorResponse(message=f"No allocations for order {orderid}")
+
+        return AllocationsResponse(
+            orderid=orderid,
+            allocations=[
+                OrderAllocation(
+                    sku=allocation.sku,
+                    qty=allocation.quantity,
+                    batchref=allocation.batchref,
+                )
+                for allocation in allocations
+            ],
+        )
+
+    @app.get("/stock/{sku}")
+    async def stock_endpoint(
+        sku: str, response: Response
+    ) -> StockResponse | ErrorResponse:
+        batches = await run_blocking(views.stock, get_session, sku)
+
+        if not batches:
+            response.status_code = 404
+            return ErrorResponse(message=f"No stock for sku {sku}")
+
+        return StockResponse(
+            sku=sku,
+            available=sum(batch.available for batch in batches),
+            batches=[
+                BatchStock(
+                    batchref=batch.batchref,
+                    eta=batch.eta.isoformat(),
+                    qty=batch.quantity,
+                    available=batch.available,
+                )
+                for batch in batches
+            ],
+        )
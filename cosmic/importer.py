@@ -0,0 +1,117 @@
+"""Streaming import of batches from CSV or NDJSON feeds.
+
+Both formats have the fields of `POST /add_batch/`: `ref`, `sku`, `qty` and
+`eta` (an ISO date). CSV files start with a header naming the columns, and
+NDJSON files have one JSON object per line. Rows are parsed lazily, so files
+of any size are imported in constant memory.
+
+Run with `cosmic-import-batches DATABASE_URL FILE`, using `-` to read from the
+standard input.
+"""
+import argparse
+import csv
+import json
+import logging
+import sys
+from datetime import datetime
+from enum import Enum
+from typing import Any, Iterable, Iterator, TextIO
+
+from .domain.batch import BatchCandidate
+
+logger = logging.getLogger(__name__)
+
+
+class FeedFormat(Enum):
+    """The formats batches can be imported from."""
+
+    CSV = "csv"
+    NDJSON = "ndjson"
+
+
+class InvalidRow(Exception):
+    """Signals that a row of a feed does not describe a batch."""
+
+
+def parse_batches(
+    lines: Iterable[str], feed_format: FeedFormat
+) -> Iterator[BatchCandidate]:
+    """Parse batches from the lines of a feed, as they are read.
+
+    Raises:
+        InvalidRow: when a row is missing fields or has invalid values.
+    """
+    match feed_format:
+        case FeedFormat.CSV:
+            rows: Iterable[dict[str, Any]] = csv.DictReader(lines)
+        case FeedFormat.NDJSON:
+            rows = (json.loads(line) for line in lines if line.strip())
+
+    for row in rows:
+        yield _to_candidate(row)
+
+
+def _to_candidate(row: dict[str, Any]) -> BatchCandidate:
+    try:
+        return BatchCandidate(
+            str(row["ref"]),
+            str(row["sku"]),
+            int(row["qty"]),
+            datetime.fromisoformat(row["eta"]).date(),
+        )
+    except (KeyError, TypeError, ValueError) as exc:
+        raise InvalidRow(f"Invalid batch {row}: {exc!r}") from exc
+
+
+def _open_feed(path: str) -> TextIO:
+    # Feeds exported by spreadsheets often start with a byte order mark, which
+    # would otherwise end up in the name of the first CSV column.
+    return open(path, newline="", encoding="utf-8-sig")
+
+
+def main() -> None:
+    """Import batches from a file into a database."""
+    from .sqlalchemy.bulk import IMPORT_CHUNK_SIZE, BatchImporter
+    from .sqlalchemy.database import Database
+
+    parser = argparse.ArgumentParser(description="Import batches from a feed.")
+    parser.add_argument("database_url", help="SQLAlchemy URL of the database.")
+    parser.add_argument("file", help="The feed to import, or - for the standard input.")
+    parser.add_argument(
+        "--format",
+        choices=[feed_format.value for feed_format in FeedFormat],
+        help="The format of the feed, guessed from its extension if not given.",
+    )
+    parser.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    parser.add_argument(
+        "--outbox",
+        action="store_true",
+        help="Store BatchAdded events in the outbox for the relay to dispatch.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    feed_format = FeedFormat(
+        args.format
+        or ("ndjson" if args.file.endswith((".ndjson", ".jsonl")) else "csv")
+    )
+
+    database = Database.from_url(args.database_url)
+    importer = BatchImporter(
+        database.sessions, use_outbox=args.outbox, chunk_size=args.chunk_size
+    )
+
+    try:
+        with sys.stdin if args.file == "-" else _open_feed(args.file) as feed:
+            result = importer.import_batches(parse_batches(feed, feed_format))
+    except InvalidRow as exc:
+        sys.exit(str(exc))
+    finally:
+        database.dispose()
+
+    logger.info("Imported %d batches, skipped %d.", result.imported, result.skipped)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Instrumentation hooks for the hot path.
+
+Instrumented code measures its steps with `span` and counts things with
+`count`. Both do next to nothing until a `Collector` is registered with
+`set_collector`, so the hooks can stay in place in production.
+"""
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from threading import Lock
+from time import perf_counter
+from typing import Any, ContextManager, Iterator, Protocol
+
+
+class Collector(Protocol):
+    """Receives the measurements of instrumented code."""
+
+    def start_span(self, name: str) -> ContextManager[object]:
+        """Measure the code that runs inside the returned context."""
+
+    def count(self, name: str, amount: int) -> None:
+        """Add to a counter."""
+
+
+_collector: Collector | None = None
+_no_span = nullcontext()
+
+
+def set_collector(collector: Collector | None) -> None:
+    """Register the collector to send measurements to, or None to stop."""
+    global _collector  # pylint: disable=global-statement
+    _collector = collector
+
+
+def span(name: str) -> ContextManager[object]:
+    """Measure the code that runs inside the returned context."""
+    collector = _collector
+
+    if collector is None:
+        return _no_span
+
+    return collector.start_span(name)
+
+
+def count(name: str, amount: int = 1) -> None:
+    """Add to a counter."""
+    collector = _collector
+
+    if collector is not None:
+        collector.count(name, amount)
+
+
+@dataclass(frozen=True)
+class SpanRecord:
+    """A finished span."""
+
+    name: str
+    parent: str | None
+    duration: float
+
+
+_current_span: ContextVar[str | None] = ContextVar("current_span", default=None)
+
+
+@dataclass
+class InMemoryCollector:
+    """A collector that keeps every measurement in memory, for tests and benchmarks."""
+
+    spans: list[SpanRecord] = field(default_factory=list)
+    counters: Counter[str] = field(default_factory=Counter)
+    _lock: Lock = field(init=False, default_factory=Lock)
+
+    @contextmanager
+    def start_span(self, name: str) -> Iterator[None]:
+        """Time the code inside the context, recording the enclosing span."""
+        parent = _current_span.get()
+        token = _current_span.set(name)
+        start = perf_counter()
+
+        try:
+            yield
+        finally:
+            duration = perf_counter() - start
+            _current_span.reset(token)
+
+            with self._lock:
+                self.spans.append(SpanRecord(name, parent, duration))
+
+    def count(self, name: str, amount: int) -> None:
+        """Add to a counter."""
+        with self._lock:
+            self.counters[name] += amount
+
+    def durations(self, name: str) -> list[float]:
+        """Get the durations of every span with a given name."""
+        return [record.duration for record in self.spans if record.name == name]
+
+    def totals(self) -> dict[str, float]:
+        """Get the total time spent in each kind of span."""
+        totals: dict[str, float] = {}
+
+        for record in self.spans:
+            totals[record.name] = totals.get(record.name, 0.0) + record.duration
+
+        return totals
+
+
+@dataclass
+class OpenTelemetryCollector:
+    """A collector that reports to OpenTelemetry.
+
+    Spans go to `tracer` and counters to `meter`, if given, both being the
+    objects from the `opentelemetry-api` package.
+    """
+
+    tracer: Any
+    meter: Any = None
+    _counters: dict[str, Any] = field(init=False, default_factory=dict)
+
+    def start_span(self, name: str) -> ContextManager[object]:
+        """Start a span that is current while the context is active."""
+        return self.tracer.start_as_current_span(name)
+
+    def count(self, name: str, amount: int) -> None:
+        """Add to an OpenTelemetry counter."""
+        if self.meter is None:
+            return
+
+        if (counter := self._counters.get(name)) is None:
+            counter = self._counters[name] = self.meter.create_counter(name)
+
+        counter.add(amount)
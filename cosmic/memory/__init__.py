@@ -0,0 +1 @@
+"""In-memory persistence, for a single process that owns all the state."""
@@ -0,0 +1,108 @@
+"""Append-only journal of the changes committed to Products."""
+import json
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import IO, Iterator
+
+from ..domain.events import Event
+from ..domain.product import CHANGES, Product
+from ..serialization import event_from_dict, event_name, event_to_dict
+
+
+class CorruptJournal(Exception):
+    """Signals that a journal holds a complete commit that cannot be read."""
+
+
+@dataclass(frozen=True)
+class JournalEntry:
+    """The changes committed to a Product, and the version they led to."""
+
+    sku: str
+    version_number: int
+    events: list[Event]
+
+
+@dataclass
+class Journal:
+    """A file with one line per commit, holding the changes it made.
+
+    With `sync`, every commit is flushed to disk before being acknowledged, so
+    it survives crashes of the machine and not only of the process. A commit
+    torn by a crash is dropped when the journal is read.
+    """
+
+    path: Path
+    sync: bool = True
+    _file: IO[str] | None = field(init=False, default=None)
+
+    def append(self, products: list[Product]) -> None:
+        """Record the changes raised by Products as a single commit."""
+        entries = [
+            {
+                "sku": product.sku,
+                "version_number": product.version_number,
+                "events": [
+                    {"type": event_name(event), "payload": event_to_dict(event)}
+                    for event in product.events
+                    if isinstance(event, CHANGES)
+                ],
+            }
+            for product in products
+        ]
+
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+
+        self._file.write(json.dumps(entries) + "\n")
+        self._file.flush()
+
+        if self.sync:
+            os.fsync(self._file.fileno())
+
+    def read(self) -> Iterator[JournalEntry]:
+        """Read every committed change, oldest first.
+
+        A torn commit at the end of the journal is cut off, so new commits are
+        not appended after it. Commits are only torn while being written, so
+        their line is the last one and has no line break.
+
+        Raises:
+            CorruptJournal: if a commit with a line break cannot be read, as
+                cutting it off would lose every commit after it.
+        """
+        if not self.path.exists():
+            return
+
+        with open(self.path, "rb+") as file:
+            good_size = 0
+
+            for number, line in enumerate(file, 1):
+                if not line.endswith(b"\n"):
+                    file.truncate(good_size)
+                    return
+
+                try:
+                    entries = json.loads(line)
+                except ValueError as exc:
+                    raise CorruptJournal(
+                        f"Commit {number} of {self.path} cannot be read."
+                    ) from exc
+
+                good_size += len(line)
+
+                for entry in entries:
+                    yield JournalEntry(
+                        entry["sku"],
+                        entry["version_number"],
+                        [
+                            event_from_dict(event["type"], event["payload"])
+                            for event in entry["events"]
+                        ],
+                    )
+
+    def close(self) -> None:
+        """Close the journal file."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,156 @@
+"""Repository of Products kept in memory."""
+from copy import copy
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Lock
+
+from ..domain.order import SKU
+from ..domain.product import ConcurrentUpdate, Product
+from ..instrumentation import count, span
+from ..snapshot import Snapshot
+from .journal import Journal
+
+
+@dataclass
+class ProductStore:
+    """The committed Products of a process.
+
+    Committed Products are never changed: units of work change copies of them,
+    which share their batches until changing them and replace them once
+    committed. With a `journal`, commits are recorded
+    in it before they are made visible, and `open` rebuilds the store from it.
+
+    Products should start without batches and be changed only through their
+    methods, as the journal records the events raised by those.
+
+    With a `snapshot`, Products not in the store are built from it when first
+    requested, so a process can start from an exported state without loading
+    it all. A journal must then always be replayed over the same snapshot.
+    """
+
+    journal: Journal | None = None
+    snapshot: Snapshot | None = None
+    _products: dict[str, Product] = field(init=False, default_factory=dict)
+    _lock: Lock = field(init=False, default_factory=Lock)
+
+    @classmethod
+    def open(
+        cls, path: Path | str, sync: bool = True, snapshot: Snapshot | None = None
+    ) -> "ProductStore":
+        """Open a store backed by a journal, replaying the changes it recorded.
+
+        Raises:
+            CorruptJournal: if a commit in the journal cannot be read.
+        """
+        store = cls(Journal(Path(path), sync), snapshot)
+
+        for entry in store.journal.read():  # type: ignore[union-attr]
+            if (product := store.get(entry.sku)) is None:
+                product = store._products[entry.sku] = Product(SKU(entry.sku), [])
+            elif entry.version_number <= product.version_number:
+                # Already part of the snapshot.
+                continue
+
+            for event in entry.events:
+                product.apply(event)
+
+            product.version_number = entry.version_number
+
+        return store
+
+    def get(self, sku: str) -> Product | None:
+        """Get the committed Product of a SKU, which must not be changed."""
+        if (product := self._products.get(sku)) is not None or self.snapshot is None:
+            return product
+
+        if (product := self.snapshot.product(sku)) is None:
+            return None
+
+        return self._products.setdefault(sku, product)
+
+    def commit(self, changes: list[tuple[Product, int | None]]) -> None:
+        """Replace Products by their changed copies.
+
+        Each copy comes with the version of the Product it was copied from, or
+        None for new Products.
+
+        Raises:
+            ConcurrentUpdate: if any of the Products was committed by someone
+                else since it was copied, or created if it is new. Nothing is
+                committed then.
+        """
+        with self._lock:
+            for product, base_version in changes:
+                current = self.get(product.sku)
+                current_version = None if current is None else current.version_number
+
+                if current_version != base_version:
+                    count("uow.conflicts")
+                    raise ConcurrentUpdate(
+                        f"Product {product.sku} is at version {current_version}, "
+                        f"expected {base_version}."
+                    )
+
+            if self.journal is not None:
+                self.journal.append([product for product, _ in changes])
+
+            for product, _ in changes:
+                product.replace_original()
+                self._products[product.sku] = product
+
+    def close(self) -> None:
+        """Close the journal, if any."""
+        if self.journal is not None:
+            self.journal.close()
+
+
+@dataclass
+class InMemoryProductRepository:
+    """A ProductRepository that hands out copies of the Products in a store.
+
+    Products are copied the first time they are requested, so changes are
+    only seen by others once committed to the store.
+    """
+
+    store: ProductStore
+    _working: dict[str, Product] = field(init=False, default_factory=dict)
+    _base_versions: dict[str, int | None] = field(init=False, default_factory=dict)
+
+    def add(self, product: Product) -> None:
+        """Add a new Product to the repository."""
+        self._working[product.sku] = product
+        self._base_versions.setdefault(product.sku, None)
+
+    def get(self, sku: str) -> Product | None:
+        """Get a copy of a Product, or the copy already in use."""
+        with span("repository.get"):
+            if (product := self._working.get(sku)) is not None:
+                return product
+
+            if (committed := self.store.get(sku)) is None:
+                return None
+
+            product = copy(committed)
+            self._working[sku] = product
+            self._base_versions[sku] = committed.version_number
+            return product
+
+    def get_version(self, sku: str) -> int | None:
+        """Get the version number of a Product by its sku."""
+        if (product := self._working.get(sku)) is None:
+            product = self.store.get(sku)
+
+        return None if product is None else product.version_number
+
+    def changes(self) -> list[tuple[Product, int | None]]:
+        """Get the new or changed Products, with the versions they started at."""
+        return [
+            (product, base_version)
+            for sku, product in self._working.items()
+            if (base_version := self._base_versions[sku]) != product.version_number
+        ]
+
+    def clear(self) -> None:
+        """Forget the Products in use, so they are copied again when requested."""
+        self._working.clear()
+        self._base_versions.clear()
@@ -0,0 +1,35 @@
+"""A Unit of Work implementation based on a ProductStore."""
+from dataclasses import dataclass, field
+
+from ..instrumentation import span
+from ..service_layer.unit_of_work import UnitOfWork
+from .repository import InMemoryProductRepository, ProductStore
+
+
+@dataclass
+class InMemoryUnitOfWork(UnitOfWork):
+    """A Unit of Work that changes copies of the Products in a store.
+
+    Committing checks that none of the changed Products was committed by
+    someone else in the meantime, like version checks do in a database, and
+    replaces them in the store. Rolling back just drops the copies.
+
+    Products got before a commit should not be changed after it, but got again.
+    """
+
+    store: ProductStore
+    products: InMemoryProductRepository = field(init=False)
+
+    def __enter__(self) -> "InMemoryUnitOfWork":
+        self.products = InMemoryProductRepository(self.store)
+        return self
+
+    def commit(self) -> None:
+        with span("uow.commit"):
+            self.store.commit(self.products.changes())
+
+        self.products.clear()
+
+    def rollback(self) -> None:
+        with span("uow.rollback"):
+            self.products.clear()
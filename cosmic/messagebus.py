@@ -1,34 +1,254 @@
-"""Basic MessageBus implementation."""
+"""Basic MessageBus implementation.
+
+`asyncio` and the e-mail backend are only imported once needed, so processes
+that only handle events with plain functions do not pay for importing them.
+"""
+import inspect
+import logging
 from dataclasses import dataclass, field
-from typing import Callable, DefaultDict, Type, TypeVar
+from queue import Queue
+from threading import Condition, Lock, Thread
+from typing import TYPE_CHECKING, Awaitable, Callable, DefaultDict, Type, TypeVar
 
-from . import email
 from .domain.events import Event, OutOfStock
+from .instrumentation import count, span
+
+if TYPE_CHECKING:
+    import asyncio
 
 TEvent = TypeVar("TEvent", bound=Event)
-Handler = Callable[[TEvent], None]
+Handler = Callable[[TEvent], None | Awaitable[None]]
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
 class MessageBus:
-    """A message bus implementation."""
+    """A message bus implementation.
+
+    Handlers may be plain functions or coroutine functions. `handle` runs the
+    handlers of an event one after the other, in the calling thread.
+    `handle_async` runs them concurrently, at most `max_concurrency` at a time,
+    with plain functions running on threads so blocking I/O overlaps as well.
+
+    Timeouts only apply in `handle_async`: there, each handler may take up to
+    its timeout, or `handler_timeout` if it has none, before being given up on
+    with a `TimeoutError`. `handle` waits for every handler to finish.
+
+    Events are handled one after the other: the handlers of an event have all
+    finished when `handle` or `handle_async` returns.
+    """
 
     handlers: DefaultDict[Type[Event], list[Handler[Event]]] = field(
         default_factory=lambda: DefaultDict(list)
     )
+    max_concurrency: int = 10
+    handler_timeout: float | None = None
+    _timeouts: dict[tuple[Type[Event], int], float] = field(
+        init=False, default_factory=dict
+    )
 
     def handle(self, event: Event) -> None:
-        """Handle an incoming event."""
-        for handler in self.handlers[type(event)]:
-            handler(event)
+        """Handle an incoming event, running its handlers one after the other.
+
+        Coroutine functions are each run to completion on a new event loop, so
+        this must not be called from a running loop if the event has any.
+        """
+        with span("messagebus.handle"):
+            for handler in self.handlers[type(event)]:
+                _call(handler, event)
+
+    async def handle_async(self, event: Event) -> None:
+        """Handle an incoming event, running its handlers concurrently.
+
+        Every handler runs even if others fail. Afterwards, the first failure
+        is raised and the others are logged.
+        """
+        import asyncio
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        results = await asyncio.gather(
+            *(
+                self._run_handler(handler, event, semaphore)
+                for handler in self.handlers[type(event)]
+            ),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+
+        for error in errors[1:]:
+            logger.error("Handler failed for %r.", event, exc_info=error)
+
+        if errors:
+            raise errors[0]
 
-    def add_handler(self, event: Type[TEvent], handler: Handler[TEvent]) -> None:
-        """Add an event handler."""
+    def add_handler(
+        self,
+        event: Type[TEvent],
+        handler: Handler[TEvent],
+        timeout: float | None = None,
+    ) -> None:
+        """Add an event handler, optionally with its own timeout in seconds.
+
+        The timeout only applies when the event is handled by `handle_async`.
+        """
         self.handlers[event].append(handler)  # type: ignore
 
+        if timeout is not None:
+            self._timeouts[(event, id(handler))] = timeout
+
+    async def _run_handler(
+        self, handler: Handler[Event], event: Event, semaphore: "asyncio.Semaphore"
+    ) -> None:
+        import asyncio
+
+        timeout = self._timeouts.get((type(event), id(handler)), self.handler_timeout)
+
+        async with semaphore:
+            if _is_async(handler):
+                await asyncio.wait_for(handler(event), timeout)  # type: ignore
+            else:
+                # A thread cannot be interrupted, it is only given up on.
+                await asyncio.wait_for(asyncio.to_thread(handler, event), timeout)
+
+
+def _call(handler: Handler[Event], event: Event) -> None:
+    if _is_async(handler):
+        import asyncio
+
+        asyncio.run(handler(event))  # type: ignore
+    else:
+        handler(event)
+
+
+def _is_async(handler: Handler[Event]) -> bool:
+    return inspect.iscoroutinefunction(handler) or inspect.iscoroutinefunction(
+        getattr(handler, "__call__", None)
+    )
+
+
+class MessageBusClosed(Exception):
+    """Signals that an event was sent to a message bus that was shut down."""
+
+
+@dataclass
+class QueuedMessageBus(MessageBus):
+    """A message bus that handles events on a pool of worker threads.
+
+    `handle` only puts the event on a queue and returns, so callers do not wait
+    for the handlers. When `max_queue_size` events are already waiting, it
+    blocks for up to `put_timeout` seconds (forever if None) before raising
+    `queue.Full`, which keeps slow handlers from piling up unbounded work.
+
+    A failing handler is logged and does not keep the other handlers of the
+    event from running. With more than one worker, events may be handled out of
+    order.
+    """
+
+    workers: int = 4
+    max_queue_size: int = 1000
+    put_timeout: float | None = None
+    _queue: "Queue[Event | None]" = field(init=False)
+    _threads: list[Thread] = field(init=False)
+    _closed: bool = field(init=False, default=False)
+    _lock: Lock = field(init=False, default_factory=Lock)
+    # The events being put on the queue, which shutting down waits for.
+    _puts: int = field(init=False, default=0)
+    _puts_done: Condition = field(init=False)
+
+    def __post_init__(self) -> None:
+        self._queue = Queue(self.max_queue_size)
+        self._puts_done = Condition(self._lock)
+        self._threads = [
+            Thread(target=self._work, name=f"messagebus-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self) -> "QueuedMessageBus":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.shutdown()
+
+    def handle(self, event: Event) -> None:
+        """Queue an incoming event to be handled by the workers.
+
+        Raises:
+            MessageBusClosed: if the bus was already shut down.
+            queue.Full: if the queue stayed full for `put_timeout` seconds.
+        """
+        # The put itself happens outside the lock, so producers waiting for room
+        # on the queue do not hold each other up. Shutting down waits for it, so
+        # no event is queued after the workers were told to stop.
+        with self._lock:
+            if self._closed:
+                raise MessageBusClosed(f"Cannot handle {event}, the bus is shut down.")
+
+            self._puts += 1
+
+        try:
+            self._queue.put(event, timeout=self.put_timeout)
+        finally:
+            with self._lock:
+                self._puts -= 1
+                self._puts_done.notify_all()
+
+    def flush(self) -> None:
+        """Wait until every queued event has been handled."""
+        self._queue.join()
+
+    def shutdown(self, drain: bool = True) -> None:
+        """Stop the workers, after handling the queued events if `drain` is set.
+
+        Events that are not drained are discarded.
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # The workers keep running meanwhile, so the puts find room.
+            self._puts_done.wait_for(lambda: self._puts == 0)
+
+            if not drain:
+                self._discard_queued()
+
+        for _ in self._threads:
+            self._queue.put(None)
+
+        for thread in self._threads:
+            thread.join()
+
+    def _discard_queued(self) -> None:
+        while not self._queue.empty():
+            self._queue.get_nowait()
+            self._queue.task_done()
+
+    def _work(self) -> None:
+        while (event := self._queue.get()) is not None:
+            try:
+                self._dispatch(event)
+            finally:
+                self._queue.task_done()
+
+        self._queue.task_done()
+
+    def _dispatch(self, event: Event) -> None:
+        with span("messagebus.handle"):
+            for handler in self.handlers[type(event)]:
+                try:
+                    _call(handler, event)
+                except Exception:  # pylint: disable=broad-except
+                    count("messagebus.handler_failures")
+                    logger.exception("Handler %r failed for %r.", handler, event)
+
 
 def send_out_of_stock_notification(event: OutOfStock) -> None:
     """Send a notification when an OutOfStock event happens."""
+    from . import email
+
     email.send_mail(
         "stock@made.com",
         f"Out of stock for {event.sku}",
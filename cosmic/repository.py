@@ -1,8 +1,12 @@
 """Repository abstractions."""
+import time
+from collections import OrderedDict
 from dataclasses import dataclass, field
-from typing import Protocol, Set
+from threading import Lock
+from typing import Callable, Iterable, Protocol, Set
 
-from .domain.product import Product
+from .domain.product import InvalidSku, Product
+from .instrumentation import count
 
 
 class ProductRepository(Protocol):
@@ -15,6 +19,13 @@ class ProductRepository(Protocol):
         """Get a Product by its sku."""
 
 
+class VersionedProductRepository(ProductRepository, Protocol):
+    """A repository that can tell the version of a Product without loading it."""
+
+    def get_version(self, sku: str) -> int | None:
+        """Get the version number of a Product by its sku."""
+
+
 @dataclass
 class TrackingProductRepository:
     """A ProductRepository capable of tracking its objects."""
@@ -35,3 +46,209 @@ class TrackingProductRepository:
             self.seen.add(product)
 
         return product
+
+
+@dataclass
+class ProductCache:
+    """A size-limited LRU cache of Products, shared between repositories.
+
+    Products are taken out of the cache while a repository uses them and put
+    back once their changes are committed, so a cached Product is never used
+    by two units of work at the same time.
+    """
+
+    max_size: int = 1024
+    hits: int = 0
+    misses: int = 0
+    stale: int = 0
+    _products: OrderedDict[str, Product] = field(
+        init=False, default_factory=OrderedDict
+    )
+    _lock: Lock = field(init=False, default_factory=Lock)
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def take(self, sku: str) -> Product | None:
+        """Take a Product out of the cache, if it is there."""
+        with self._lock:
+            return self._products.pop(sku, None)
+
+    def put(self, product: Product) -> None:
+        """Put a Product in the cache, evicting the least recently used ones."""
+        with self._lock:
+            self._products[product.sku] = product
+            self._products.move_to_end(product.sku)
+
+            while len(self._products) > self.max_size:
+                self._products.popitem(last=False)
+
+    def record(self, hit: bool, stale: bool = False) -> None:
+        """Record the outcome of a lookup."""
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.stale += stale
+
+
+@dataclass
+class CachingProductRepository:
+    """A ProductRepository that reuses Products from a ProductCache.
+
+    A cached Product is only reused when its version matches the stored one,
+    which is much cheaper to check than loading the Product again.
+    """
+
+    wrapped: VersionedProductRepository
+    cache: ProductCache
+    _taken: Set[Product] = field(init=False, default_factory=set)
+    _committed: dict[Product, int] = field(init=False, default_factory=dict)
+
+    def add(self, product: Product) -> None:
+        """Add a Product to the repository."""
+        self.wrapped.add(product)
+        self._taken.add(product)
+
+    def get(self, sku: str) -> Product | None:
+        """Get a product from the cache, or from the repository if not fresh."""
+        cached = self.cache.take(sku)
+
+        if (
+            cached is not None
+            and self.wrapped.get_version(sku) == cached.version_number
+        ):
+            self.cache.record(hit=True)
+            self.wrapped.add(cached)
+            product: Product | None = cached
+        else:
+            self.cache.record(hit=False, stale=cached is not None)
+            product = self.wrapped.get(sku)
+
+        if product is not None:
+            self._taken.add(product)
+
+        return product
+
+    def mark_committed(self) -> None:
+        """Record that the current state of the Products was committed."""
+        self._committed = {product: product.version_number for product in self._taken}
+
+    def release(self) -> None:
+        """Put the Products back in the cache, if not changed since committed."""
+        for product, version_number in self._committed.items():
+            if product.version_number == version_number:
+                self.cache.put(product)
+
+        self.discard()
+
+    def discard(self) -> None:
+        """Forget about the Products taken, without caching them."""
+        self._taken.clear()
+        self._committed.clear()
+
+
+@dataclass
+class SkuIndex:
+    """The SKUs known to exist, and a TTL cache of the SKUs known not to.
+
+    SKUs that exist are expected to be loaded with `add` at startup and are
+    kept up to date as Products are added through this process, so they are
+    never looked up in the database to be found missing.
+
+    Other processes may add SKUs as well, so a SKU that is not known is only
+    remembered as missing for `ttl` seconds after it was looked up and not
+    found, which keeps bursts of requests for unknown SKUs from reaching the
+    database. At most `max_missing` missing SKUs are remembered, the oldest
+    being forgotten first.
+    """
+
+    ttl: float = 30.0
+    max_missing: int = 10_000
+    clock: Callable[[], float] = time.monotonic
+    _known: Set[str] = field(init=False, default_factory=set)
+    _missing: OrderedDict[str, float] = field(init=False, default_factory=OrderedDict)
+    _lock: Lock = field(init=False, default_factory=Lock)
+
+    def add(self, skus: Iterable[str]) -> None:
+        """Record that SKUs exist, so they are no longer missing."""
+        with self._lock:
+            for sku in skus:
+                self._known.add(sku)
+                self._missing.pop(sku, None)
+
+    def mark_missing(self, sku: str) -> None:
+        """Record that a SKU was not found, unless it is known to exist."""
+        with self._lock:
+            if sku in self._known:
+                return
+
+            self._missing[sku] = self.clock() + self.ttl
+            self._missing.move_to_end(sku)
+
+            while len(self._missing) > self.max_missing:
+                self._missing.popitem(last=False)
+
+    def is_missing(self, sku: str) -> bool:
+        """Check whether a SKU was recently found not to exist."""
+        # Known SKUs are only ever added, so they are checked without the lock.
+        if sku in self._known:
+            return False
+
+        with self._lock:
+            expiry = self._missing.get(sku)
+
+            if expiry is None:
+                return False
+
+            if expiry <= self.clock():
+                del self._missing[sku]
+                return False
+
+            return True
+
+    def check(self, sku: str) -> None:
+        """Check that a SKU is not known to be missing.
+
+        Raises:
+            InvalidSku: if the SKU was recently found not to exist.
+        """
+        if self.is_missing(sku):
+            count("sku_index.missing_hits")
+            raise InvalidSku(f"Invalid sku {sku}")
+
+
+@dataclass
+class SkuCheckingProductRepository:
+    """A ProductRepository that does not look up SKUs known to be missing."""
+
+    wrapped: VersionedProductRepository
+    index: SkuIndex
+
+    def add(self, product: Product) -> None:
+        """Add a Product to the repository, recording its SKU."""
+        self.wrapped.add(product)
+        self.index.add([product.sku])
+
+    def get(self, sku: str) -> Product | None:
+        """Get a Product, unless its SKU is known to be missing."""
+        if self.index.is_missing(sku):
+            count("sku_index.missing_hits")
+            return None
+
+        product = self.wrapped.get(sku)
+
+        if product is None:
+            self.index.mark_missing(sku)
+        else:
+            self.index.add([sku])
+
+        return product
+
+    def get_version(self, sku: str) -> int | None:
+        """Get the version of a Product, unless its SKU is known to be missing."""
+        if self.index.is_missing(sku):
+            return None
+
+        return self.wrapped.get_version(sku)
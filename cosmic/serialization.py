@@ -0,0 +1,83 @@
+"""Conversion of events to and from JSON-compatible data."""
+from dataclasses import asdict, fields, is_dataclass
+from datetime import date
+from functools import cache
+from typing import Any, Type, get_type_hints
+
+from .domain.events import Event
+
+
+def event_name(event: Event) -> str:
+    """Get the name an event is stored under."""
+    return type(event).__name__
+
+
+def event_to_dict(event: Event) -> dict[str, Any]:
+    """Convert an event to a JSON-compatible dictionary."""
+    # Every event is a dataclass, but `Event` itself is not one.
+    data: Any = event
+    return _encode(asdict(data))
+
+
+def event_from_dict(name: str, data: dict[str, Any]) -> Event:
+    """Rebuild an event from its name and the output of `event_to_dict`.
+
+    Raises:
+        KeyError: if there is no event with the given name.
+    """
+    try:
+        type_ = _event_types()[name]
+    except KeyError:
+        # The event may have been defined after the types were first listed.
+        _event_types.cache_clear()
+        type_ = _event_types()[name]
+
+    return _decode(type_, data)
+
+
+@cache
+def _event_types() -> dict[str, Type[Event]]:
+    types: dict[str, Type[Event]] = {}
+    pending = [Event]
+
+    while pending:
+        for subclass in pending.pop().__subclasses__():
+            # Subclasses are listed in definition order, so a class replaced by
+            # another of the same name, as `dataclass(slots=True)` does, is
+            # overridden by its replacement.
+            types[subclass.__name__] = subclass
+            pending.append(subclass)
+
+    return types
+
+
+def _encode(value: Any) -> Any:
+    match value:
+        case dict():
+            return {key: _encode(item) for key, item in value.items()}
+        case date():
+            return value.isoformat()
+        case _:
+            return value
+
+
+@cache
+def _type_hints(type_: type[Any]) -> dict[str, Any]:
+    return get_type_hints(type_)
+
+
+def _decode(type_: Any, value: Any) -> Any:
+    if isinstance(type_, type) and is_dataclass(type_):
+        hints = _type_hints(type_)
+        return type_(
+            **{
+                field.name: _decode(hints[field.name], value[field.name])
+                for field in fields(type_)
+                if field.init
+            }
+        )
+
+    if type_ is date:
+        return date.fromisoformat(value)
+
+    return value
@@ -1,27 +1,81 @@
 """The service layer."""
-from typing import Iterable
+import random
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from functools import partial
+from itertools import islice
+from typing import Callable, Iterable, Iterator, TypeVar
 
 from ..domain.batch import Batch, BatchCandidate, BatchReference
-from ..domain.order import SKU, OrderLine
-from ..domain.product import Product
+from ..domain.order import SKU, OrderLine, OrderReference
+from ..domain.product import AlreadyAllocated, ConcurrentUpdate, InvalidSku, Product
 from .unit_of_work import UnitOfWork
 
+T = TypeVar("T")
 
-class InvalidSku(Exception):
-    """Signals that an invalid SKU was requested."""
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.005
+BULK_CHUNK_SIZE = 1000
 
 
 class OutOfStock(Exception):
     """Signals that a requested SKU is out of stock."""
 
 
+class NotAllocated(Exception):
+    """Signals that an order has no allocated line for a requested SKU."""
+
+
+@dataclass
+class AllocationResult:
+    """The outcome of allocating one order line among many."""
+
+    line: OrderLine
+    batchref: str | None = None
+    error: InvalidSku | OutOfStock | AlreadyAllocated | ConcurrentUpdate | None = None
+
+
 def is_valid_sku(sku, batches: Iterable[Batch]) -> bool:
     """Check that an SKU exists in the recorded batches."""
-    return sku in {b.sku for b in batches}
+    return any(batch.sku == sku for batch in batches)
+
+
+def retry_on_conflict(
+    operation: Callable[[], T], max_attempts: int = MAX_ATTEMPTS
+) -> T:
+    """Run an operation, retrying it if it conflicts with a concurrent update.
+
+    Retries wait for a random time of up to `RETRY_BASE_DELAY * 2 ** attempt`
+    seconds, so workers that collided do not just collide again.
+
+    Raises:
+        ConcurrentUpdate: if the last attempt still conflicted.
+    """
+    attempt = 1
 
+    while True:
+        try:
+            return operation()
+        except ConcurrentUpdate:
+            if attempt >= max_attempts:
+                raise
 
-def allocate(line: OrderLine, uow: UnitOfWork) -> str:
-    """Validate input, perform the allocation and persist state."""
+        time.sleep(random.uniform(0, RETRY_BASE_DELAY * 2**attempt))
+        attempt += 1
+
+
+def allocate(line: OrderLine, uow: UnitOfWork, max_attempts: int = MAX_ATTEMPTS) -> str:
+    """Validate input, perform the allocation and persist state.
+
+    Allocations that conflict with a concurrent update are retried. An order
+    with another line allocated for the SKU raises AlreadyAllocated, as its
+    line should be reallocated instead.
+    """
+    return retry_on_conflict(partial(_allocate, line, uow), max_attempts)
+
+
+def _allocate(line: OrderLine, uow: UnitOfWork) -> str:
     with uow:
         product = uow.products.get(line.sku)
 
@@ -37,8 +91,155 @@ def allocate(line: OrderLine, uow: UnitOfWork) -> str:
     return batchref
 
 
-def add_batch(candidate: BatchCandidate, uow: UnitOfWork) -> None:
-    """Add a new batch to the repository."""
+def deallocate(
+    order: str, sku: str, uow: UnitOfWork, max_attempts: int = MAX_ATTEMPTS
+) -> str:
+    """Deallocate the line of an order for a SKU and persist state.
+
+    Deallocations that conflict with a concurrent update are retried.
+
+    Returns:
+        The reference of the batch the line was allocated to.
+    """
+    return retry_on_conflict(
+        partial(_deallocate, OrderReference(order), sku, uow), max_attempts
+    )
+
+
+def _deallocate(order: OrderReference, sku: str, uow: UnitOfWork) -> str:
+    with uow:
+        product = _get_product(sku, uow)
+        batchref = _deallocate_from(product, order)
+        uow.commit()
+
+    return batchref
+
+
+def reallocate(
+    line: OrderLine, uow: UnitOfWork, max_attempts: int = MAX_ATTEMPTS
+) -> str:
+    """Replace the allocated line of an order with a new one, and persist state.
+
+    The order must already have a line allocated for the SKU. If the new line
+    cannot be allocated, the old one stays allocated. Reallocations that
+    conflict with a concurrent update are retried.
+
+    Returns:
+        The reference of the batch the new line was allocated to.
+    """
+    return retry_on_conflict(partial(_reallocate, line, uow), max_attempts)
+
+
+def _reallocate(line: OrderLine, uow: UnitOfWork) -> str:
+    with uow:
+        product = _get_product(line.sku, uow)
+        _deallocate_from(product, line.order)
+
+        if (batchref := product.allocate(line)) is None:
+            raise OutOfStock(f"Out of stock for sku {line.sku}")
+
+        uow.commit()
+
+    return batchref
+
+
+def _get_product(sku: str, uow: UnitOfWork) -> Product:
+    product = uow.products.get(sku)
+
+    if product is None:
+        raise InvalidSku(f"Invalid sku {sku}")
+
+    return product
+
+
+def _deallocate_from(product: Product, order: OrderReference) -> str:
+    batchref = product.allocation_for(order)
+
+    if batchref is None:
+        raise NotAllocated(f"Order {order} has no allocation for sku {product.sku}")
+
+    product.deallocate(order)
+    return batchref
+
+
+def allocate_many(
+    lines: Iterable[OrderLine],
+    uow: UnitOfWork,
+    chunk_size: int = BULK_CHUNK_SIZE,
+    max_attempts: int = MAX_ATTEMPTS,
+) -> list[AllocationResult]:
+    """Allocate many order lines, committing once per chunk of lines.
+
+    Inside a chunk, lines are grouped by SKU so each Product is loaded only
+    once. Failures are reported per line instead of being raised, and results
+    are in the same order as the lines. Chunks that conflict with a concurrent
+    update are retried as a whole. If the last attempt still conflicts, none of
+    the lines of the chunk are allocated, each of them gets the ConcurrentUpdate
+    as its error, and the following chunks are still allocated.
+    """
+    results: list[AllocationResult] = []
+
+    for chunk in _chunked(lines, chunk_size):
+        try:
+            results.extend(
+                retry_on_conflict(partial(_allocate_chunk, chunk, uow), max_attempts)
+            )
+        except ConcurrentUpdate as exc:
+            results.extend(AllocationResult(line, error=exc) for line in chunk)
+
+    return results
+
+
+def _allocate_chunk(lines: list[OrderLine], uow: UnitOfWork) -> list[AllocationResult]:
+    results = [AllocationResult(line) for line in lines]
+    results_by_sku: defaultdict[str, list[AllocationResult]] = defaultdict(list)
+
+    for result in results:
+        results_by_sku[result.line.sku].append(result)
+
+    with uow:
+        for sku, sku_results in results_by_sku.items():
+            product = uow.products.get(sku)
+
+            for result in sku_results:
+                if product is None:
+                    result.error = InvalidSku(f"Invalid sku {sku}")
+                    continue
+
+                try:
+                    batchref = product.allocate(result.line)
+                except AlreadyAllocated as exc:
+                    result.error = exc
+                    continue
+
+                if batchref is None:
+                    result.error = OutOfStock(f"Out of stock for sku {sku}")
+                else:
+                    result.batchref = batchref
+
+        uow.commit()
+
+    return results
+
+
+def _chunked(items: Iterable[T], size: int) -> Iterator[list[T]]:
+    iterator = iter(items)
+
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def add_batch(
+    candidate: BatchCandidate, uow: UnitOfWork, max_attempts: int = MAX_ATTEMPTS
+) -> None:
+    """Add a new batch to the repository.
+
+    Additions that conflict with a concurrent update are retried.
+    """
+    retry_on_conflict(partial(_add_batch, candidate, uow), max_attempts)
+
+
+def _add_batch(candidate: BatchCandidate, uow: UnitOfWork) -> None:
     with uow:
         product = uow.products.get(candidate.sku)
 
@@ -53,5 +254,5 @@ def add_batch(candidate: BatchCandidate, uow: UnitOfWork) -> None:
             product = Product(new_batch.sku, [])
             uow.products.add(product)
 
-        product.batches.append(new_batch)
+        product.add_batch(new_batch)
         uow.commit()
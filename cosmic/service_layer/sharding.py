@@ -0,0 +1,156 @@
+"""Allocation on workers that each own a shard of the SKUs."""
+import logging
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from queue import Queue
+from threading import Lock, Thread
+from typing import Callable
+from zlib import crc32
+
+from ..domain.events import AllocationRequired
+from ..domain.order import SKU, OrderLine, OrderReference
+from . import services
+from .unit_of_work import UnitOfWork
+
+logger = logging.getLogger(__name__)
+
+_Request = tuple[OrderLine, "Future[str]"]
+
+
+class AllocatorClosed(Exception):
+    """Signals that an allocation was submitted to an allocator that was shut down."""
+
+
+def shard_of(sku: str, shards: int) -> int:
+    """Get the shard a SKU belongs to.
+
+    This is stable between processes, unlike `hash`, so processes can split
+    SKUs between them the same way.
+    """
+    return crc32(sku.encode()) % shards
+
+
+@dataclass
+class ShardedAllocator:
+    """Allocates order lines on a fixed set of workers, routed by SKU.
+
+    Each worker owns the SKUs of its shard, so a Product is only ever changed by
+    a single worker and allocations to it no longer conflict with each other.
+    Workers allocate the lines queued for them in groups of up to `batch_size`,
+    committing once per group.
+
+    Lines of different SKUs are allocated in parallel, and the lines of a SKU
+    in the order they were submitted.
+    """
+
+    make_uow: Callable[[], UnitOfWork]
+    shards: int = 4
+    batch_size: int = 100
+    max_queue_size: int = 1000
+    _queues: "list[Queue[_Request | None]]" = field(init=False)
+    _threads: list[Thread] = field(init=False)
+    _closed: bool = field(init=False, default=False)
+    _lock: Lock = field(init=False, default_factory=Lock)
+
+    def __post_init__(self) -> None:
+        self._queues = [Queue(self.max_queue_size) for _ in range(self.shards)]
+        self._threads = [
+            Thread(target=self._work, args=(queue,), name=f"allocator-{i}", daemon=True)
+            for i, queue in enumerate(self._queues)
+        ]
+
+        for thread in self._threads:
+            thread.start()
+
+    def __enter__(self) -> "ShardedAllocator":
+        return self
+
+    def __exit__(self, *_: object) -> None:
+        self.shutdown()
+
+    def submit(self, line: OrderLine) -> "Future[str]":
+        """Queue a line to be allocated by the worker that owns its SKU.
+
+        Returns:
+            A future with the reference of the batch the line is allocated to,
+            or with the exception `services.allocate` would have raised.
+
+        Raises:
+            AllocatorClosed: if the allocator was already shut down.
+        """
+        future: "Future[str]" = Future()
+
+        # Checked and queued under the lock, so no line is queued after the
+        # sentinel that stops its worker.
+        with self._lock:
+            if self._closed:
+                raise AllocatorClosed(
+                    f"Cannot allocate {line}, the allocator is shut down."
+                )
+
+            self._queues[shard_of(line.sku, self.shards)].put((line, future))
+
+        return future
+
+    def handle(self, event: AllocationRequired) -> None:
+        """Allocate the line of an AllocationRequired event, as a MessageBus handler.
+
+        Failures are logged, as nobody waits for the result.
+        """
+        candidate = event.order_line
+        line = OrderLine(
+            OrderReference(candidate.order), SKU(candidate.sku), candidate.quantity
+        )
+        self.submit(line).add_done_callback(_log_failure)
+
+    def shutdown(self) -> None:
+        """Stop the workers after allocating the queued lines."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+            for queue in self._queues:
+                queue.put(None)
+
+        for thread in self._threads:
+            thread.join()
+
+    def _work(self, queue: "Queue[_Request | None]") -> None:
+        running = True
+
+        while running:
+            requests = []
+
+            # Block for the first request, then take whatever else is waiting.
+            while (request := queue.get()) is not None:
+                if request[1].set_running_or_notify_cancel():
+                    requests.append(request)
+                if len(requests) >= self.batch_size or queue.empty():
+                    break
+            else:
+                running = False
+
+            if requests:
+                self._allocate(requests)
+
+    def _allocate(self, requests: list[_Request]) -> None:
+        try:
+            results = services.allocate_many(
+                [line for line, _ in requests], self.make_uow()
+            )
+        except Exception as exc:  # pylint: disable=broad-except
+            for _, future in requests:
+                future.set_exception(exc)
+            return
+
+        for (_, future), result in zip(requests, results):
+            if result.error is not None:
+                future.set_exception(result.error)
+            else:
+                future.set_result(str(result.batchref))
+
+
+def _log_failure(future: "Future[str]") -> None:
+    if (exc := future.exception()) is not None:
+        logger.error("Allocation failed: %s", exc)
@@ -30,10 +30,27 @@ class UnitOfWork(ABC):
 
 
 @dataclass
-class TrackingUnitOfWork(UnitOfWork):
-    """A unit of work that uses a tracking repository."""
+class UnitOfWorkWrapper(UnitOfWork):
+    """A unit of work that adds behaviour on top of another one."""
 
     wrapped: UnitOfWork
+
+    def __exit__(
+        self, exc_type: Type[BaseException] | None, _: object, _2: object
+    ) -> None:
+        self.wrapped.__exit__(exc_type, _, _2)
+
+    def commit(self) -> None:
+        self.wrapped.commit()
+
+    def rollback(self) -> None:
+        self.wrapped.rollback()
+
+
+@dataclass
+class TrackingUnitOfWork(UnitOfWorkWrapper):
+    """A unit of work that uses a tracking repository."""
+
     messagebus: MessageBus
     products: TrackingProductRepository = field(init=False)
 
@@ -51,6 +68,3 @@ class TrackingUnitOfWork(UnitOfWork):
     def commit(self) -> None:
         self.wrapped.commit()
         self._publish()
-
-    def rollback(self) -> None:
-        self.wrapped.rollback()
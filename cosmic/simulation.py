@@ -0,0 +1,201 @@
+"""Vectorised simulation of allocations, for capacity planning.
+
+`simulate` allocates a forecast of order lines to batches with the semantics of
+`cosmic.domain.batch.allocate`: each line, in order, goes to the earliest batch
+of its SKU with enough available products, and lines no batch can take are out
+of stock. Batches with the same ETA are tried in the order they are given.
+
+Instead of walking the batches for every line, the lines of each SKU are
+offered to its batches one batch at a time, in ETA order. A line that does not
+fit a batch is offered to the next one, exactly as it would be by `allocate`,
+so each batch takes, in order, every remaining line that still fits it. Runs
+of lines that fit are found with cumulative sums, so the work is done by NumPy
+over whole arrays instead of by Python per line.
+
+Lines are expected to be distinct: the domain allocates a line equal to one it
+already holds only once.
+
+NumPy is an optional dependency, installed with the `simulation` extra.
+
+Run with `cosmic-simulate-allocations BATCHES LINES`, where BATCHES is a CSV
+file like those of `cosmic-import-batches` and LINES a CSV file with `orderid`,
+`sku` and `qty` columns. The allocation of each line is written as CSV to the
+standard output, with an empty `batchref` for lines out of stock.
+"""
+import argparse
+import csv
+import logging
+import sys
+from dataclasses import dataclass
+from typing import Any, Sequence
+
+import numpy as np
+import numpy.typing as npt
+
+logger = logging.getLogger(__name__)
+
+OUT_OF_STOCK = -1
+
+# How many lines are looked at in each step of the search for lines that fit.
+WINDOW_SIZE = 1024
+
+IntArray = npt.NDArray[np.int64]
+
+
+@dataclass(frozen=True)
+class SimulationResult:
+    """The outcome of allocating a forecast of order lines."""
+
+    batches: IntArray
+    """The position of the batch each line is allocated to, or OUT_OF_STOCK."""
+
+    available: IntArray
+    """The products still available in each batch afterwards."""
+
+
+def simulate(
+    batch_skus: npt.ArrayLike,
+    batch_available: npt.ArrayLike,
+    batch_etas: Sequence[Any] | npt.ArrayLike,
+    line_skus: npt.ArrayLike,
+    line_quantities: npt.ArrayLike,
+) -> SimulationResult:
+    """Allocate order lines, in order, to the earliest batches that fit them.
+
+    Args:
+        batch_skus: The SKU of each batch.
+        batch_available: The products available in each batch.
+        batch_etas: The ETA of each batch, as any values ordered like dates.
+        line_skus: The SKU of each order line.
+        line_quantities: The quantity of each order line.
+
+    Returns:
+        Where each line is allocated and what is left of each batch, with
+        batches and lines in the positions they were given.
+    """
+    available = np.array(batch_available, dtype=np.int64)
+    quantities = np.asarray(line_quantities, dtype=np.int64)
+    allocated = np.full(len(quantities), OUT_OF_STOCK, dtype=np.int64)
+
+    skus, codes = np.unique(
+        np.concatenate([np.asarray(batch_skus), np.asarray(line_skus)]),
+        return_inverse=True,
+    )
+    batch_codes = codes[: len(available)]
+    line_codes = codes[len(available) :]
+
+    # Batches grouped by SKU and ordered by ETA, keeping the given order on ties.
+    by_eta = np.argsort(np.asarray(batch_etas), kind="stable")
+    batch_order = by_eta[np.argsort(batch_codes[by_eta], kind="stable")]
+    line_order = np.argsort(line_codes, kind="stable")
+
+    batch_bounds = np.searchsorted(batch_codes[batch_order], np.arange(len(skus) + 1))
+    line_bounds = np.searchsorted(line_codes[line_order], np.arange(len(skus) + 1))
+
+    for sku in range(len(skus)):
+        _allocate_sku(
+            batch_order[batch_bounds[sku] : batch_bounds[sku + 1]],
+            line_order[line_bounds[sku] : line_bounds[sku + 1]],
+            available,
+            quantities,
+            allocated,
+        )
+
+    return SimulationResult(allocated, available)
+
+
+def _allocate_sku(
+    batches: IntArray,
+    lines: IntArray,
+    available: IntArray,
+    quantities: IntArray,
+    allocated: IntArray,
+) -> None:
+    pending = lines
+
+    for batch in batches:
+        if not pending.size:
+            return
+
+        taken = _fill(quantities[pending], available[batch])
+
+        if taken.any():
+            allocated[pending[taken]] = batch
+            available[batch] -= quantities[pending[taken]].sum()
+            pending = pending[~taken]
+
+
+def _fill(quantities: IntArray, capacity: int) -> npt.NDArray[np.bool_]:
+    """Find which lines a batch takes when they are offered to it in order."""
+    taken = np.zeros(len(quantities), dtype=np.bool_)
+
+    if not quantities.size:
+        return taken
+
+    # Once the batch has less than the smallest line left, nothing else fits.
+    smallest_after = np.minimum.accumulate(quantities[::-1])[::-1]
+    position = 0
+
+    while position < len(quantities) and capacity >= smallest_after[position]:
+        window = quantities[position : position + WINDOW_SIZE]
+        fitting = np.flatnonzero(window <= capacity)
+
+        if not fitting.size:
+            position += len(window)
+            continue
+
+        start = position + fitting[0]
+        totals = np.cumsum(quantities[start : start + WINDOW_SIZE])
+        # The first line fits, so at least one line is taken.
+        count = int(np.searchsorted(totals, capacity, side="right"))
+        taken[start : start + count] = True
+        capacity -= int(totals[count - 1])
+        position = start + count
+
+    return taken
+
+
+def main() -> None:
+    """Simulate the allocation of a forecast of order lines."""
+    from .importer import FeedFormat, InvalidRow, parse_batches
+
+    parser = argparse.ArgumentParser(description="Simulate allocations.")
+    parser.add_argument("batches", help="CSV file with the batches.")
+    parser.add_argument("lines", help="CSV file with the order lines.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    try:
+        with open(args.batches, newline="", encoding="utf-8-sig") as feed:
+            batches = list(parse_batches(feed, FeedFormat.CSV))
+    except InvalidRow as exc:
+        sys.exit(str(exc))
+
+    with open(args.lines, newline="", encoding="utf-8-sig") as feed:
+        lines: list[dict[str, Any]] = list(csv.DictReader(feed))
+
+    result = simulate(
+        [batch.sku for batch in batches],
+        [batch.quantity for batch in batches],
+        [batch.eta for batch in batches],
+        [line["sku"] for line in lines],
+        [int(line["qty"]) for line in lines],
+    )
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["orderid", "sku", "qty", "batchref"])
+
+    for line, batch in zip(lines, result.batches.tolist()):
+        batchref = batches[batch].reference if batch != OUT_OF_STOCK else ""
+        writer.writerow([line["orderid"], line["sku"], line["qty"], batchref])
+
+    logger.info(
+        "Allocated %d lines, %d out of stock.",
+        np.count_nonzero(result.batches != OUT_OF_STOCK),
+        np.count_nonzero(result.batches == OUT_OF_STOCK),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+"""Columnar snapshots of the state of Products, loaded with `mmap`.
+
+A snapshot is a directory with a `manifest.json` and one file per column, each
+an array of fixed-width integers in the byte order of the machine that wrote
+it:
+
+- `products.version`, `products.batches`: the version of each Product, and the
+  offset of its first batch in the batch columns;
+- `batches.quantity`, `batches.eta`, `batches.allocated`,
+  `batches.allocations`: the quantity, ETA (as a date ordinal) and allocated
+  total of each batch, and the offset of its first allocation;
+- `allocations.quantity`: the quantity of each allocated line.
+
+Offset columns have an extra entry at the end, so the rows of item `i` are
+those between its offset and the one of item `i + 1`. SKUs, batch references
+and orders are stored as a column of fixed-width offsets into a file with the
+encoded strings, so they are not padded to the longest one.
+
+Products are sorted by SKU and their batches by ETA, so a Product is found by
+a binary search over the mapped SKUs. Opening a snapshot only maps its files,
+and a Product is only built from the columns when it is requested.
+"""
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+from array import array
+from bisect import bisect_left
+from contextlib import ExitStack
+from dataclasses import dataclass, field
+from datetime import date
+from pathlib import Path
+from typing import BinaryIO, Iterable, Literal, Sequence, overload
+
+from .domain.batch import Batch, BatchReference
+from .domain.order import SKU, OrderLine, OrderReference
+from .domain.product import Product
+
+FORMAT_VERSION = 1
+
+_Typecode = Literal["B", "i", "q"]
+
+_INTEGER_COLUMNS: dict[str, _Typecode] = {
+    "products.version": "q",
+    "products.batches": "q",
+    "batches.quantity": "q",
+    "batches.eta": "i",
+    "batches.allocated": "q",
+    "batches.allocations": "q",
+    "allocations.quantity": "q",
+}
+_STRING_COLUMNS = ["products.sku", "batches.reference", "allocations.order"]
+
+
+class ReadOnlyRepository(Exception):
+    """Signals an attempt to change a repository that can only be read."""
+
+
+class InvalidSnapshot(Exception):
+    """Signals that a directory does not hold a snapshot this code can read."""
+
+
+def write_snapshot(directory: Path | str, products: Iterable[Product]) -> int:
+    """Write the state of Products to a snapshot directory.
+
+    Products are written as they are read, so they can be streamed from
+    storage, but must come sorted by SKU.
+
+    The snapshot is written to a temporary directory next to the given one,
+    which is renamed to it once complete. Existing snapshots are never
+    overwritten, as processes mapping them would crash when their files were
+    truncated.
+
+    Returns:
+        The number of Products written.
+
+    Raises:
+        FileExistsError: if the directory exists and is not empty.
+        ValueError: if the Products are not sorted by SKU.
+    """
+    directory = Path(directory)
+
+    if directory.exists() and any(directory.iterdir()):
+        raise FileExistsError(f"{directory} already holds a snapshot.")
+
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    temporary = Path(
+        tempfile.mkdtemp(prefix=f".{directory.name}.", dir=directory.parent)
+    )
+    # Temporary directories are private, but snapshots are read by other workers.
+    temporary.chmod(0o755)
+
+    try:
+        count = _write_columns(temporary, products)
+        # Renaming onto an empty directory replaces it, but not onto a full one.
+        os.replace(temporary, directory)
+    except BaseException:
+        shutil.rmtree(temporary, ignore_errors=True)
+        raise
+
+    return count
+
+
+def _write_columns(directory: Path, products: Iterable[Product]) -> int:
+    with ExitStack() as stack:
+        writer = _ColumnWriter(
+            {
+                name: stack.enter_context(open(directory / name, "wb"))
+                for name in _column_files()
+            }
+        )
+        count = 0
+        batch_count = 0
+        allocation_count = 0
+        last_sku: str | None = None
+
+        for product in products:
+            if last_sku is not None and product.sku <= last_sku:
+                raise ValueError(f"Product {product.sku} is out of order.")
+            last_sku = product.sku
+
+            writer.string("products.sku", product.sku)
+            writer.integers("products.version", product.version_number)
+            writer.integers("products.batches", batch_count)
+
+            for batch in product.batches:
+                lines = batch.allocated_lines
+                writer.string("batches.reference", batch.reference)
+                writer.integers("batches.quantity", batch.quantity)
+                writer.integers("batches.eta", batch.eta.toordinal())
+                writer.integers("batches.allocated", batch.quantity - batch.available())
+                writer.integers("batches.allocations", allocation_count)
+
+                for line in lines:
+                    writer.string("allocations.order", line.order)
+                    writer.integers("allocations.quantity", line.quantity)
+
+                allocation_count += len(lines)
+                batch_count += 1
+
+            count += 1
+            writer.flush()
+
+        writer.integers("products.batches", batch_count)
+        writer.integers("batches.allocations", allocation_count)
+        writer.close()
+
+    manifest = {
+        "format": FORMAT_VERSION,
+        "byteorder": sys.byteorder,
+        "products": count,
+        "batches": batch_count,
+        "allocations": allocation_count,
+        "columns": _INTEGER_COLUMNS,
+    }
+    (directory / "manifest.json").write_text(json.dumps(manifest, indent=2))
+
+    return count
+
+
+def _column_files() -> list[str]:
+    return [
+        *_INTEGER_COLUMNS,
+        *(f"{name}.offsets" for name in _STRING_COLUMNS),
+        *(f"{name}.data" for name in _STRING_COLUMNS),
+    ]
+
+
+@dataclass
+class _ColumnWriter:
+    files: dict[str, BinaryIO]
+    _integers: dict[str, array] = field(init=False)
+    _string_offsets: dict[str, array] = field(init=False)
+    _string_data: dict[str, bytearray] = field(init=False)
+    _string_sizes: dict[str, int] = field(
+        init=False, default_factory=lambda: dict.fromkeys(_STRING_COLUMNS, 0)
+    )
+
+    def __post_init__(self) -> None:
+        self._integers = {
+            name: array(typecode) for name, typecode in _INTEGER_COLUMNS.items()
+        }
+        self._string_offsets = {name: array("q") for name in _STRING_COLUMNS}
+        self._string_data = {name: bytearray() for name in _STRING_COLUMNS}
+
+    def integers(self, name: str, value: int) -> None:
+        self._integers[name].append(value)
+
+    def string(self, name: str, value: str) -> None:
+        encoded = value.encode()
+        self._string_offsets[name].append(self._string_sizes[name])
+        self._string_data[name] += encoded
+        self._string_sizes[name] += len(encoded)
+
+    def flush(self) -> None:
+        for name, values in self._integers.items():
+            values.tofile(self.files[name])
+            del values[:]
+
+        for name, offsets in self._string_offsets.items():
+            offsets.tofile(self.files[f"{name}.offsets"])
+            del offsets[:]
+            self.files[f"{name}.data"].write(self._string_data[name])
+            self._string_data[name].clear()
+
+    def close(self) -> None:
+        for name, size in self._string_sizes.items():
+            self._string_offsets[name].append(size)
+
+        self.flush()
+
+
+class _Strings(Sequence[str]):
+    """A column of strings, decoded as they are read."""
+
+    def __init__(self, offsets: memoryview, data: memoryview) -> None:
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @overload
+    def __getitem__(self, index: int) -> str:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> Sequence[str]:
+        ...
+
+    def __getitem__(self, index: int | slice) -> str | Sequence[str]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+
+        return str(self._data[self._offsets[index] : self._offsets[index + 1]], "utf-8")
+
+
+@dataclass
+class Snapshot:
+    """A snapshot mapped into memory, from which Products are built on demand.
+
+    The mapped files are shared by every process mapping them, and pages are
+    only read from disk when a Product using them is built.
+    """
+
+    directory: Path
+    _maps: list[mmap.mmap] = field(init=False, default_factory=list)
+    _views: list[memoryview] = field(init=False, default_factory=list)
+    _integers: dict[str, memoryview] = field(init=False, default_factory=dict)
+    _strings: dict[str, _Strings] = field(init=False, default_factory=dict)
+
+    @classmethod
+    def open(cls, directory: Path | str) -> "Snapshot":
+        """Map a snapshot written by `write_snapshot`.
+
+        Raises:
+            InvalidSnapshot: if the snapshot is of an unknown format or its
+                columns are not those of this machine.
+        """
+        snapshot = cls(Path(directory))
+        manifest = json.loads((snapshot.directory / "manifest.json").read_text())
+
+        if (
+            manifest["format"] != FORMAT_VERSION
+            or manifest["byteorder"] != sys.byteorder
+            or manifest["columns"] != _INTEGER_COLUMNS
+        ):
+            raise InvalidSnapshot(f"Cannot read the snapshot in {directory}.")
+
+        for name, typecode in _INTEGER_COLUMNS.items():
+            snapshot._integers[name] = snapshot._map(name, typecode)
+
+        for name in _STRING_COLUMNS:
+            snapshot._strings[name] = _Strings(
+                snapshot._map(f"{name}.offsets", "q"), snapshot._map(f"{name}.data")
+            )
+
+        return snapshot
+
+    def _map(self, name: str, typecode: _Typecode = "B") -> memoryview:
+        with open(self.directory / name, "rb") as file:
+            # Empty files cannot be mapped, and have nothing to read anyway.
+            if not file.seek(0, 2):
+                return memoryview(b"").cast(typecode)
+
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self._maps.append(mapped)
+        self._views.append(memoryview(mapped))
+        self._views.append(self._views[-1].cast(typecode))
+        return self._views[-1]
+
+    def __len__(self) -> int:
+        return len(self._strings["products.sku"])
+
+    def close(self) -> None:
+        """Unmap the files of the snapshot.
+
+        Products already built stay valid, as they do not refer to the files.
+        """
+        self._integers.clear()
+        self._strings.clear()
+
+        # Views must be released before what they view, and maps after them.
+        for view in reversed(self._views):
+            view.release()
+
+        for mapped in self._maps:
+            mapped.close()
+
+        self._views.clear()
+        self._maps.clear()
+
+    def _position(self, sku: str) -> int | None:
+        skus = self._strings["products.sku"]
+        position = bisect_left(skus, sku)
+
+        if position == len(skus) or skus[position] != sku:
+            return None
+
+        return position
+
+    def skus(self) -> Sequence[str]:
+        """Get the SKUs of the Products in the snapshot, in order."""
+        return self._strings["products.sku"]
+
+    def version(self, sku: str) -> int | None:
+        """Get the version number of a Product without building it."""
+        if (position := self._position(sku)) is None:
+            return None
+
+        return self._integers["products.version"][position]
+
+    def product(self, sku: str) -> Product | None:
+        """Build a Product from the snapshot, if it is there."""
+        if (position := self._position(sku)) is None:
+            return None
+
+        offsets = self._integers["products.batches"]
+        batches = [
+            self._batch(SKU(sku), index)
+            for index in range(offsets[position], offsets[position + 1])
+        ]
+
+        return Product(SKU(sku), batches, self._integers["products.version"][position])
+
+    def _batch(self, sku: SKU, index: int) -> Batch:
+        orders = self._strings["allocations.order"]
+        quantities = self._integers["allocations.quantity"]
+        offsets = self._integers["batches.allocations"]
+
+        batch = Batch(
+            BatchReference(self._strings["batches.reference"][index]),
+            sku,
+            self._integers["batches.quantity"][index],
+            date.fromordinal(self._integers["batches.eta"][index]),
+        )
+        # pylint: disable=protected-access
+        batch._allocated = {
+            OrderLine(OrderReference(orders[i]), sku, quantities[i])
+            for i in range(offsets[index], offsets[index + 1])
+        }
+        batch._allocated_quantity = self._integers["batches.allocated"][index]
+        return batch
+
+
+@dataclass
+class SnapshotProductRepository:
+    """A read-only ProductRepository over a Snapshot.
+
+    Every `get` builds a new Product, so changes to it are never seen by others.
+    """
+
+    snapshot: Snapshot
+
+    def add(self, product: Product) -> None:
+        """Refuse to add a Product, as snapshots cannot be changed.
+
+        Raises:
+            ReadOnlyRepository: always.
+        """
+        raise ReadOnlyRepository(f"Cannot add {product.sku} to a snapshot.")
+
+    def get(self, sku: str) -> Product | None:
+        """Build a Product from the snapshot."""
+        return self.snapshot.product(sku)
+
+    def get_version(self, sku: str) -> int | None:
+        """Get the version number of a Product without building it."""
+        return self.snapshot.version(sku)
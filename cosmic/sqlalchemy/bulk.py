@@ -0,0 +1,177 @@
+"""Bulk import of batches with SQLAlchemy Core."""
+from collections import defaultdict
+from dataclasses import dataclass
+from itertools import islice
+from typing import Iterable, Iterator
+
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.orm import Session
+
+from ..domain.batch import BatchCandidate, BatchReference
+from ..domain.events import BatchAdded, Event
+from ..domain.order import SKU
+from ..messagebus import MessageBus
+from ..repository import SkuIndex
+from ..serialization import event_name, event_to_dict
+from .mappings import batches, outbox, products
+from .unit_of_work import SessionFactory
+
+IMPORT_CHUNK_SIZE = 1000
+
+
+@dataclass
+class ImportResult:
+    """How many batches an import added, and how many already existed."""
+
+    imported: int = 0
+    skipped: int = 0
+
+    def __iadd__(self, other: "ImportResult") -> "ImportResult":
+        self.imported += other.imported
+        self.skipped += other.skipped
+        return self
+
+
+@dataclass
+class BatchImporter:
+    """Adds many batches without loading their Products.
+
+    Batches are inserted in chunks of `chunk_size`, one transaction each, with
+    a few statements per chunk instead of a few per batch. Batches whose
+    reference already exists are skipped, so an interrupted import can be run
+    again. The versions of the Products that got new batches are bumped once
+    per batch, so units of work that loaded them concurrently fail their
+    version check and cached copies are reloaded.
+
+    The BatchAdded events of each chunk are handled by `messagebus` after it
+    is committed or, with `use_outbox`, stored in the outbox with it. The SKUs
+    of the chunk are recorded in `sku_index`, if given.
+    """
+
+    session_factory: SessionFactory
+    messagebus: MessageBus | None = None
+    use_outbox: bool = False
+    chunk_size: int = IMPORT_CHUNK_SIZE
+    sku_index: SkuIndex | None = None
+
+    def import_batches(self, candidates: Iterable[BatchCandidate]) -> ImportResult:
+        """Import batches, consuming only a chunk of them at a time."""
+        result = ImportResult()
+
+        for chunk in _chunked(candidates, self.chunk_size):
+            result += self.import_chunk(chunk)
+
+        return result
+
+    def import_chunk(self, candidates: list[BatchCandidate]) -> ImportResult:
+        """Import a chunk of batches in a single transaction."""
+        with self.session_factory() as session, session.begin():
+            new = _new_candidates(session, candidates)
+            events: list[Event] = [
+                BatchAdded(
+                    BatchReference(candidate.reference),
+                    SKU(candidate.sku),
+                    candidate.quantity,
+                    candidate.eta,
+                )
+                for candidate in new
+            ]
+
+            if new:
+                _insert_batches(session, new)
+
+            if events and self.use_outbox:
+                session.execute(
+                    insert(outbox),
+                    [
+                        {
+                            "event_type": event_name(event),
+                            "payload": event_to_dict(event),
+                        }
+                        for event in events
+                    ],
+                )
+
+        if self.sku_index is not None:
+            self.sku_index.add({candidate.sku for candidate in new})
+
+        if self.messagebus is not None and not self.use_outbox:
+            for event in events:
+                self.messagebus.handle(event)
+
+        return ImportResult(imported=len(new), skipped=len(candidates) - len(new))
+
+
+def _new_candidates(
+    session: Session, candidates: list[BatchCandidate]
+) -> list[BatchCandidate]:
+    references = {candidate.reference for candidate in candidates}
+    existing = set(
+        session.execute(
+            select(batches.c.reference).where(batches.c.reference.in_(references))
+        ).scalars()
+    )
+    new = []
+
+    for candidate in candidates:
+        if candidate.reference not in existing:
+            existing.add(candidate.reference)
+            new.append(candidate)
+
+    return new
+
+
+def _insert_batches(session: Session, candidates: list[BatchCandidate]) -> None:
+    by_sku: defaultdict[str, list[BatchCandidate]] = defaultdict(list)
+
+    for candidate in candidates:
+        by_sku[candidate.sku].append(candidate)
+
+    skus = list(by_sku)
+    existing_skus = set(
+        session.execute(
+            select(products.c.sku).where(products.c.sku.in_(skus))
+        ).scalars()
+    )
+    new_skus = [sku for sku in skus if sku not in existing_skus]
+
+    if new_skus:
+        session.execute(
+            insert(products), [{"sku": sku, "version_number": 0} for sku in new_skus]
+        )
+
+    # Every change bumps the version once, as adding batches one by one would.
+    session.execute(
+        update(products)
+        .where(products.c.sku == bindparam("product_sku"))
+        .values(version_number=products.c.version_number + bindparam("added")),
+        [
+            {"product_sku": sku, "added": len(sku_candidates)}
+            for sku, sku_candidates in by_sku.items()
+        ],
+    )
+    # An executemany reuses one compiled statement, where a multi-row VALUES
+    # would be compiled again for every chunk.
+    session.execute(
+        insert(batches),
+        [
+            {
+                "reference": candidate.reference,
+                "sku": candidate.sku,
+                "quantity": candidate.quantity,
+                "eta": candidate.eta,
+                "allocated_quantity": 0,
+            }
+            for sku_candidates in by_sku.values()
+            for candidate in sku_candidates
+        ],
+    )
+
+
+def _chunked(
+    items: Iterable[BatchCandidate], size: int
+) -> Iterator[list[BatchCandidate]]:
+    iterator = iter(items)
+
+    while chunk := list(islice(iterator, size)):
+        yield chunk
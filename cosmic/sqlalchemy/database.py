@@ -0,0 +1,137 @@
+"""Engine and session factories shared by the API and the background workers.
+
+Every process should create its engine once, with `make_engine`, and build its
+sessions from a single `make_session_factory`. The engine owns the connection
+pool and the compiled statement cache, so creating one per request (or per
+worker loop) throws both away. For example:
+
+    database = Database.from_url(url)
+    app = make_api(database.engine, messagebus, session_factory=database.sessions)
+    relay = OutboxRelay(database.sessions, messagebus)
+"""
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool, StaticPool
+
+
+@dataclass(frozen=True)
+class PoolSettings:
+    """Connection pool and statement cache settings for an engine."""
+
+    size: int = 10
+    """Connections kept open in the pool."""
+    max_overflow: int = 20
+    """Connections opened beyond `size` under load, closed once returned."""
+    timeout: float = 30
+    """Seconds to wait for a connection when the pool is exhausted."""
+    recycle: int = 1800
+    """Seconds after which a connection is replaced, before servers drop it."""
+    pre_ping: bool = True
+    """Check connections when they are taken from the pool."""
+    statement_cache_size: int = 500
+    """Compiled statements kept by the engine, see `query_cache_size`."""
+    sqlite_begin_immediate: bool = False
+    """Begin transactions on SQLite database files with `BEGIN IMMEDIATE`."""
+
+
+def make_engine(url: str, settings: PoolSettings = PoolSettings()) -> Engine:
+    """Create an engine with a connection pool tuned for the service.
+
+    SQLite gets a `QueuePool` shared between threads for files, and a
+    `StaticPool` for in-memory databases (which only live as long as their
+    connection). Transactions on files begin with `BEGIN IMMEDIATE` if
+    `sqlite_begin_immediate` is set. In-memory databases never do, as every
+    session shares their single connection, which can only be in one
+    transaction at a time.
+    """
+    parsed = make_url(url)
+
+    if parsed.get_backend_name() != "sqlite":
+        return create_engine(url, **_pool_arguments(settings))
+
+    if parsed.database in (None, "", ":memory:"):
+        engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+            query_cache_size=settings.statement_cache_size,
+        )
+    else:
+        engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": settings.timeout},
+            poolclass=QueuePool,
+            **_pool_arguments(settings),
+        )
+
+        if settings.sqlite_begin_immediate:
+            begin_sqlite_transactions_immediately(engine)
+
+    return engine
+
+
+def _pool_arguments(settings: PoolSettings) -> dict[str, Any]:
+    return {
+        "pool_size": settings.size,
+        "max_overflow": settings.max_overflow,
+        "pool_timeout": settings.timeout,
+        "pool_recycle": settings.recycle,
+        "pool_pre_ping": settings.pre_ping,
+        "query_cache_size": settings.statement_cache_size,
+    }
+
+
+def begin_sqlite_transactions_immediately(engine: Engine) -> None:
+    """Make a SQLite engine begin real transactions, with `BEGIN IMMEDIATE`.
+
+    pysqlite only begins transactions before writing, so an aggregate read by
+    several queries could mix states from different commits. Beginning
+    immediately also serializes writers instead of failing on lock upgrades,
+    at the cost of readers taking the write lock as well.
+    """
+
+    @event.listens_for(engine, "connect")
+    def disable_pysqlite_transactions(dbapi_connection: Any, _: Any) -> None:
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def begin_immediate(connection: Any) -> None:
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def make_session_factory(
+    engine: Engine, expire_on_commit: bool = True
+) -> "sessionmaker[Session]":
+    """Create the session factory for an engine.
+
+    Without `expire_on_commit`, objects keep their loaded state after a commit
+    instead of reloading it on the next access.
+    """
+    return sessionmaker(engine, expire_on_commit=expire_on_commit)
+
+
+@dataclass
+class Database:
+    """An engine and its session factory, to be created once per process."""
+
+    engine: Engine
+    sessions: "sessionmaker[Session]"
+
+    @classmethod
+    def from_url(
+        cls,
+        url: str,
+        settings: PoolSettings = PoolSettings(),
+        expire_on_commit: bool = True,
+    ) -> "Database":
+        """Create the engine and the session factory for a database URL."""
+        engine = make_engine(url, settings)
+        return cls(engine, make_session_factory(engine, expire_on_commit))
+
+    def dispose(self) -> None:
+        """Close every pooled connection."""
+        self.engine.dispose()
@@ -0,0 +1,256 @@
+"""Event-sourced storage of Products.
+
+Instead of the rows of the `products`, `batches`, `order_lines` and
+`allocations` tables, a Product is stored as the events that changed it, one
+row of `product_events` each, numbered by the version they led to. Changes are
+only ever appended, and the unique version numbers detect concurrent updates.
+
+Every `snapshot_every` versions, the whole state of the Product is written to
+`product_snapshots`, so loading a Product reads its snapshot and replays only
+the events after it.
+
+Products should start without batches and be changed only through their
+methods, as the events they raise are all that is stored. The ORM mappings of
+`start_mappings` are not needed, and processes that only use this storage
+should not start them, as mapped classes are slower to build.
+"""
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Type
+
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..domain.batch import Batch, BatchReference
+from ..domain.events import Event
+from ..domain.order import SKU, OrderLine, OrderReference
+from ..domain.product import CHANGES, ConcurrentUpdate, Product
+from ..instrumentation import count, span
+from ..serialization import event_from_dict, event_name, event_to_dict
+from ..service_layer.unit_of_work import UnitOfWork
+from .mappings import product_events, product_snapshots
+from .unit_of_work import SessionFactory
+
+SNAPSHOT_EVERY = 25
+
+
+class UntrackedChanges(Exception):
+    """Signals that a Product changed without raising the events recording it."""
+
+
+def snapshot_of(product: Product) -> dict[str, Any]:
+    """Get the state of a Product as JSON-compatible data."""
+    return {
+        "batches": [
+            {
+                "reference": batch.reference,
+                "quantity": batch.quantity,
+                "eta": batch.eta.isoformat(),
+                "allocations": [
+                    [line.order, line.quantity] for line in batch.allocated_lines
+                ],
+            }
+            for batch in product.batches
+        ]
+    }
+
+
+def product_from_snapshot(
+    sku: str, version_number: int, state: dict[str, Any]
+) -> Product:
+    """Rebuild a Product from the output of `snapshot_of`."""
+    batches = []
+
+    for data in state["batches"]:
+        batch = Batch(
+            BatchReference(data["reference"]),
+            SKU(sku),
+            data["quantity"],
+            date.fromisoformat(data["eta"]),
+        )
+        batch._allocated = {
+            OrderLine(OrderReference(order), SKU(sku), quantity)
+            for order, quantity in data["allocations"]
+        }
+        batch._allocated_quantity = sum(quantity for _, quantity in data["allocations"])
+        batches.append(batch)
+
+    return Product(SKU(sku), batches, version_number)
+
+
+@dataclass
+class EventSourcedProductRepository:
+    """A ProductRepository that stores Products as the events that changed them.
+
+    Changes are written by `save`, as part of the transaction of `session`.
+    """
+
+    session: Session
+    snapshot_every: int = SNAPSHOT_EVERY
+    _products: dict[str, Product] = field(init=False, default_factory=dict)
+    _saved_versions: dict[str, int] = field(init=False, default_factory=dict)
+
+    def add(self, product: Product) -> None:
+        """Add a new Product to the repository."""
+        self._products[product.sku] = product
+        self._saved_versions[product.sku] = 0
+
+    def get(self, sku: str) -> Product | None:
+        """Load a Product from its latest snapshot and the events after it."""
+        with span("repository.get"):
+            if (product := self._products.get(sku)) is not None:
+                return product
+
+            snapshot = self.session.execute(
+                select(
+                    product_snapshots.c.version_number, product_snapshots.c.state
+                ).where(product_snapshots.c.sku == sku)
+            ).one_or_none()
+
+            since = 0 if snapshot is None else snapshot.version_number
+            events = [
+                event_from_dict(row.event_type, row.payload)
+                for row in self.session.execute(
+                    select(product_events.c.event_type, product_events.c.payload)
+                    .where(
+                        product_events.c.sku == sku,
+                        product_events.c.version_number > since,
+                    )
+                    .order_by(product_events.c.version_number)
+                )
+            ]
+
+            if snapshot is None and not events:
+                return None
+
+            if snapshot is None:
+                product = Product(SKU(sku), [])
+            else:
+                product = product_from_snapshot(sku, since, snapshot.state)
+
+            for event in events:
+                product.apply(event)
+
+            self._products[sku] = product
+            self._saved_versions[sku] = product.version_number
+            return product
+
+    def get_version(self, sku: str) -> int | None:
+        """Get the version number of a Product without loading it."""
+        return self.session.execute(
+            select(func.max(product_events.c.version_number)).where(
+                product_events.c.sku == sku
+            )
+        ).scalar()
+
+    def save(self) -> None:
+        """Append the changes made to Products since they were loaded or saved.
+
+        Raises:
+            UntrackedChanges: if a Product changed without raising an event for
+                every change, so its changes cannot be stored.
+        """
+        rows: list[dict[str, Any]] = []
+        snapshots: list[Product] = []
+
+        for sku, product in self._products.items():
+            saved_version = self._saved_versions[sku]
+
+            if product.version_number == saved_version:
+                continue
+
+            rows.extend(
+                {
+                    "sku": sku,
+                    "version_number": version_number,
+                    "event_type": event_name(event),
+                    "payload": event_to_dict(event),
+                }
+                for version_number, event in enumerate(
+                    _unsaved_changes(product, saved_version), saved_version + 1
+                )
+            )
+
+            if (
+                product.version_number // self.snapshot_every
+                > saved_version // self.snapshot_every
+            ):
+                snapshots.append(product)
+
+            self._saved_versions[sku] = product.version_number
+
+        if rows:
+            self.session.execute(insert(product_events), rows)
+
+        for product in snapshots:
+            self._write_snapshot(product)
+
+    def _write_snapshot(self, product: Product) -> None:
+        values = {
+            "version_number": product.version_number,
+            "state": snapshot_of(product),
+        }
+        updated = self.session.execute(
+            update(product_snapshots)
+            .where(product_snapshots.c.sku == product.sku)
+            .values(**values)
+        )
+
+        if updated.rowcount == 0:
+            self.session.execute(
+                insert(product_snapshots).values(sku=product.sku, **values)
+            )
+
+
+def _unsaved_changes(product: Product, saved_version: int) -> list[Event]:
+    # Every change raises one event and bumps the version once, so the changes
+    # since the saved version are the last events that record changes.
+    changes: list[Event] = [
+        event for event in product.events if isinstance(event, CHANGES)
+    ]
+    unsaved = product.version_number - saved_version
+
+    if len(changes) < unsaved:
+        raise UntrackedChanges(f"Product {product.sku} has untracked changes.")
+
+    return changes[len(changes) - unsaved :]
+
+
+@dataclass
+class EventSourcedUnitOfWork(UnitOfWork):
+    """A Unit of Work that stores Products as events, in an SQLAlchemy session."""
+
+    session_factory: SessionFactory
+    snapshot_every: int = SNAPSHOT_EVERY
+    session: Session = field(init=False)
+    products: EventSourcedProductRepository = field(init=False)
+
+    def __enter__(self) -> "EventSourcedUnitOfWork":
+        with span("uow.enter"):
+            self.session = self.session_factory()
+            self.products = EventSourcedProductRepository(
+                self.session, self.snapshot_every
+            )
+
+        return self
+
+    def __exit__(
+        self, exc_type: Type[BaseException] | None, _: object, _2: object
+    ) -> None:
+        super().__exit__(exc_type, _, _2)
+        self.session.close()
+
+    def commit(self) -> None:
+        try:
+            with span("uow.commit"):
+                self.products.save()
+                self.session.commit()
+        except IntegrityError as exc:
+            self.session.rollback()
+            count("uow.conflicts")
+            raise ConcurrentUpdate(str(exc)) from exc
+
+    def rollback(self) -> None:
+        with span("uow.rollback"):
+            self.session.rollback()
@@ -0,0 +1,97 @@
+"""Export of the Products in a database to a snapshot.
+
+Run with `cosmic-export-snapshot DATABASE_URL DIRECTORY`, then start workers
+from the snapshot with `cosmic.snapshot.Snapshot.open(DIRECTORY)`.
+"""
+import argparse
+import logging
+import sys
+from typing import Iterator
+
+from sqlalchemy import collate
+
+from ..domain.product import Product
+from .repository import LoadStrategy, loader_options
+from .unit_of_work import SessionFactory
+
+logger = logging.getLogger(__name__)
+
+EXPORT_CHUNK_SIZE = 100
+
+# Collations that compare strings by code point, as Python and snapshots do, for
+# the databases whose name for it is not "C".
+CODE_POINT_COLLATIONS = {"sqlite": "BINARY", "mysql": "utf8mb4_bin"}
+
+
+def iter_products(
+    session_factory: SessionFactory,
+    load_strategy: LoadStrategy = LoadStrategy.SELECTIN,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> Iterator[Product]:
+    """Load every Product, sorted by SKU, a chunk of them at a time.
+
+    Each chunk is loaded in its own session, which is closed before the next,
+    so only a chunk of Products is held at a time.
+
+    SKUs are compared by code point rather than with the collation of the
+    database, which may order them differently than snapshots expect.
+    """
+    last_sku: str | None = None
+
+    while True:
+        with session_factory() as session:
+            dialect = session.get_bind().dialect.name
+            sku = collate(
+                Product.sku, CODE_POINT_COLLATIONS.get(dialect, "C")  # type: ignore[misc]
+            )
+            query = (
+                session.query(Product)
+                .options(*loader_options(load_strategy))
+                .order_by(sku)
+            )
+
+            if last_sku is not None:
+                query = query.filter(sku > last_sku)
+
+            chunk = query.limit(chunk_size).all()
+
+            yield from chunk
+
+        if len(chunk) < chunk_size:
+            return
+
+        last_sku = chunk[-1].sku
+
+
+def main() -> None:
+    """Export the Products in a database to a snapshot directory."""
+    from ..snapshot import write_snapshot
+    from .database import Database
+    from .mappings import start_mappings
+
+    parser = argparse.ArgumentParser(description="Export Products to a snapshot.")
+    parser.add_argument("database_url", help="SQLAlchemy URL of the database.")
+    parser.add_argument("directory", help="Where to write the snapshot.")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    start_mappings()
+
+    database = Database.from_url(args.database_url)
+
+    try:
+        count = write_snapshot(
+            args.directory,
+            iter_products(database.sessions, chunk_size=args.chunk_size),
+        )
+    except FileExistsError as exc:
+        sys.exit(str(exc))
+    finally:
+        database.dispose()
+
+    logger.info("Exported %d products to %s.", count, args.directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,20 @@
 """SQLAlchemy mappings for our data."""
-from sqlalchemy import Column, Date, ForeignKey, Integer, MetaData, String, Table
+from sqlalchemy import (
+    JSON,
+    Column,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    PrimaryKeyConstraint,
+    String,
+    Table,
+    func,
+)
 from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import registry, relationship
 
 from ..domain.batch import Batch
@@ -10,6 +24,9 @@ from ..domain.product import Product
 map_registry = registry()
 metadata = MetaData()
 
+# Batch references are unique across every SKU.
+batches_reference_index = Index("ix_batches_reference", "reference", unique=True)
+
 batches = Table(
     "batches",
     metadata,
@@ -18,6 +35,9 @@ batches = Table(
     Column("sku", ForeignKey("products.sku")),
     Column("quantity", Integer, nullable=False),
     Column("eta", Date, nullable=False),
+    Column("allocated_quantity", Integer, nullable=False, server_default="0"),
+    batches_reference_index,
+    Index("ix_batches_sku", "sku"),
 )
 
 order_lines = Table(
@@ -27,6 +47,7 @@ order_lines = Table(
     Column("order", String(255)),
     Column("sku", String(255)),
     Column("quantity", Integer, nullable=False),
+    Index("ix_order_lines_order_sku", "order", "sku"),
 )
 
 allocations = Table(
@@ -35,13 +56,75 @@ allocations = Table(
     Column("id", Integer, primary_key=True, autoincrement=True),
     Column("orderline_id", ForeignKey("order_lines.id")),
     Column("batch_id", ForeignKey("batches.id")),
+    # An order line can only be allocated to a single batch.
+    Index("ix_allocations_orderline_id", "orderline_id", unique=True),
+    Index("ix_allocations_batch_id", "batch_id"),
 )
 
 products = Table(
     "products",
     metadata,
+    Column("sku", String(255)),
+    Column("version_number", Integer, nullable=False),
+    # Named like databases name it by default, to tell it apart in errors.
+    PrimaryKeyConstraint("sku", name="products_pkey"),
+)
+
+outbox = Table(
+    "outbox",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("event_type", String(255), nullable=False),
+    Column("payload", JSON, nullable=False),
+    Column("created_at", DateTime, nullable=False, server_default=func.now()),
+    # Failed dispatches, up to the maximum after which an event is left alone.
+    Column("attempts", Integer, nullable=False, server_default="0"),
+)
+
+# Event-sourced storage of Products, used by `cosmic.sqlalchemy.event_store`.
+
+product_events = Table(
+    "product_events",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("sku", String(255), nullable=False),
+    Column("version_number", Integer, nullable=False),
+    Column("event_type", String(255), nullable=False),
+    Column("payload", JSON, nullable=False),
+    # Units of work appending the same version of a Product conflict.
+    Index("ix_product_events_sku_version_number", "sku", "version_number", unique=True),
+)
+
+product_snapshots = Table(
+    "product_snapshots",
+    metadata,
     Column("sku", String(255), primary_key=True),
-    Column("version_number", Integer),
+    Column("version_number", Integer, nullable=False),
+    Column("state", JSON, nullable=False),
+)
+
+# Read model, kept up to date from domain events by `cosmic.sqlalchemy.views`.
+
+allocations_view = Table(
+    "allocations_view",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("orderid", String(255), nullable=False),
+    Column("sku", String(255), nullable=False),
+    Column("quantity", Integer, nullable=False),
+    Column("batchref", String(255), nullable=False),
+    Index("ix_allocations_view_orderid_sku", "orderid", "sku", unique=True),
+)
+
+stock_view = Table(
+    "stock_view",
+    metadata,
+    Column("batchref", String(255), primary_key=True),
+    Column("sku", String(255), nullable=False),
+    Column("eta", Date, nullable=False),
+    Column("quantity", Integer, nullable=False),
+    Column("allocated", Integer, nullable=False, server_default="0"),
+    Index("ix_stock_view_sku", "sku"),
 )
 
 
@@ -54,18 +137,37 @@ def start_mappings():
         properties={
             "_allocated": relationship(
                 lines_mapper, secondary=allocations, collection_class=set
-            )
+            ),
+            "_allocated_quantity": batches.c.allocated_quantity,
         },
     )
     map_registry.map_imperatively(
         Product,
         products,
+        # The domain bumps the version itself, SQLAlchemy only checks it.
+        version_id_col=products.c.version_number,
+        version_id_generator=False,
         properties={
-            "batches": relationship(batches_mapper),
+            "batches": relationship(
+                batches_mapper, order_by=[batches.c.eta, batches.c.id]
+            ),
         },
     )
 
 
+def violates(error: IntegrityError, constraint: Index | PrimaryKeyConstraint) -> bool:
+    """Check whether an IntegrityError was raised by a unique constraint.
+
+    Most databases name the constraint in their messages, while SQLite names
+    the columns it covers.
+    """
+    message = str(error.orig)
+    columns = ", ".join(
+        f"{column.table.name}.{column.name}" for column in constraint.columns
+    )
+    return f'"{constraint.name}"' in message or message.endswith(f": {columns}")
+
+
 def create_schema(engine: Engine) -> None:
     """Initialize SQLAlchemy with our schema."""
     metadata.create_all(engine)
@@ -0,0 +1,182 @@
+"""Transactional outbox for domain events.
+
+Events are stored in the `outbox` table in the same transaction as the changes
+that raised them, and an `OutboxRelay` worker later dispatches them through a
+`MessageBus`. Events survive crashes between the commit and their dispatch, and
+handlers run outside of the request that raised them.
+
+Delivery is at least once, so handlers should be idempotent: an event whose
+dispatch fails stays in the outbox and is retried by later runs, without
+holding back the events after it. Once it failed `max_attempts` times, it is
+left in the outbox as a dead letter, to be looked into and removed by hand.
+"""
+import argparse
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from ..domain.events import Event, OutOfStock
+from ..instrumentation import count
+from ..messagebus import MessageBus, send_out_of_stock_notification
+from ..repository import TrackingProductRepository
+from ..serialization import event_from_dict, event_name, event_to_dict
+from ..service_layer.unit_of_work import UnitOfWork, UnitOfWorkWrapper
+from . import views
+from .database import Database
+from .mappings import outbox
+from .unit_of_work import SessionFactory, SQLAlchemyUnitOfWork
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class OutboxUnitOfWork(UnitOfWorkWrapper):
+    """A unit of work that stores the events raised by Products in the outbox."""
+
+    wrapped: SQLAlchemyUnitOfWork
+    products: TrackingProductRepository = field(init=False)
+
+    def __enter__(self) -> "UnitOfWork":
+        self.wrapped.__enter__()
+        self.products = TrackingProductRepository(self.wrapped.products)
+        return self
+
+    def commit(self) -> None:
+        rows = [
+            {"event_type": event_name(event), "payload": event_to_dict(event)}
+            for product in self.products.seen
+            for event in _pop_all(product.events)
+        ]
+
+        if rows:
+            self.wrapped.session.execute(insert(outbox), rows)
+
+        self.wrapped.commit()
+
+
+def _pop_all(events: deque[Event]) -> Iterator[Event]:
+    while events:
+        yield events.popleft()
+
+
+@dataclass
+class OutboxRelay:
+    """Dispatches the events stored in the outbox through a MessageBus."""
+
+    session_factory: SessionFactory
+    messagebus: MessageBus
+    batch_size: int = 100
+    max_attempts: int = 5
+
+    def run_once(self) -> int:
+        """Dispatch one batch of events, oldest first.
+
+        Events are dispatched one by one. Those dispatched are removed from the
+        outbox, and the failures of the others are counted and logged.
+
+        Returns:
+            How many events were taken from the outbox, whether their dispatch
+            succeeded or not.
+        """
+        with self.session_factory() as session, session.begin():
+            rows = session.execute(
+                select(
+                    outbox.c.id,
+                    outbox.c.event_type,
+                    outbox.c.payload,
+                    outbox.c.attempts,
+                )
+                .where(outbox.c.attempts < self.max_attempts)
+                .order_by(outbox.c.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            dispatched = []
+
+            for row in rows:
+                try:
+                    self.messagebus.handle(event_from_dict(row.event_type, row.payload))
+                except Exception:  # pylint: disable=broad-except
+                    self._record_failure(session, row.id, row.attempts + 1)
+                else:
+                    dispatched.append(row.id)
+
+            if dispatched:
+                session.execute(delete(outbox).where(outbox.c.id.in_(dispatched)))
+
+        return len(rows)
+
+    def _record_failure(self, session: Session, event_id: int, attempts: int) -> None:
+        logger.exception(
+            "Failed to dispatch event %s from the outbox (attempt %s of %s).",
+            event_id,
+            attempts,
+            self.max_attempts,
+        )
+        session.execute(
+            update(outbox).where(outbox.c.id == event_id).values(attempts=attempts)
+        )
+
+        if attempts >= self.max_attempts:
+            count("outbox.dead_letters")
+
+    def run(
+        self, poll_interval: float = 1.0, stop: threading.Event | None = None
+    ) -> None:
+        """Keep dispatching events until `stop` is set.
+
+        The outbox is polled every `poll_interval` seconds while it is empty,
+        and drained without waiting otherwise.
+        """
+        stop = stop or threading.Event()
+
+        while not stop.is_set():
+            try:
+                dispatched = self.run_once()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Failed to dispatch events from the outbox.")
+                dispatched = 0
+
+            if dispatched < self.batch_size:
+                stop.wait(poll_interval)
+
+
+def main() -> None:
+    """Run an outbox relay worker."""
+    parser = argparse.ArgumentParser(
+        description="Dispatch the events stored in the outbox."
+    )
+    parser.add_argument("database_url", help="SQLAlchemy URL of the database.")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--poll-interval", type=float, default=1.0)
+    parser.add_argument("--max-attempts", type=int, default=5)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    database = Database.from_url(args.database_url)
+
+    messagebus = MessageBus()
+    messagebus.add_handler(OutOfStock, send_out_of_stock_notification)
+
+    views.register_handlers(messagebus, database.sessions)
+
+    relay = OutboxRelay(
+        database.sessions, messagebus, args.batch_size, args.max_attempts
+    )
+
+    try:
+        relay.run(args.poll_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        database.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,131 @@
 """A Repository implementation using SQLAlchemy."""
 from dataclasses import dataclass
+from enum import Enum
+from functools import partial
 
+from sqlalchemy import select
 from sqlalchemy.exc import NoResultFound
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Load, Session, joinedload, selectinload
 
+from ..domain.batch import Batch, BatchReference
+from ..domain.order import OrderLine, OrderReference
 from ..domain.product import Product
+from ..instrumentation import span
+from .mappings import order_lines, products
+
+
+class LoadStrategy(Enum):
+    """How a Product aggregate and its children are loaded from the database."""
+
+    LAZY = "lazy"
+    """Load batches and allocated lines on first access, one query each time."""
+
+    SELECTIN = "selectin"
+    """Load batches and their allocated lines with one extra query for each."""
+
+    JOINED = "joined"
+    """Load the whole aggregate in a single joined query."""
+
+    COUNTERS = "counters"
+    """Load batches eagerly, but allocated lines only when a batch touches them.
+
+    Allocations only need the running allocated quantity of each batch, so only
+    the lines of the batch that is allocated to end up being loaded.
+    """
+
+
+def loader_options(strategy: LoadStrategy) -> list[Load]:
+    """Get the query options that implement a loading strategy."""
+    match strategy:
+        case LoadStrategy.LAZY:
+            return []
+        case LoadStrategy.SELECTIN:
+            batches = selectinload(Product.batches)  # type: ignore[misc]
+            return [batches.selectinload(Batch._allocated)]
+        case LoadStrategy.JOINED:
+            batches = joinedload(Product.batches)  # type: ignore[misc]
+            return [batches.joinedload(Batch._allocated)]
+        case LoadStrategy.COUNTERS:
+            return [selectinload(Product.batches)]  # type: ignore[misc]
 
 
 @dataclass
 class SQLAlchemyProductRepository:
-    """A SQLAlchemy-based Repository."""
+    """A SQLAlchemy-based Repository.
+
+    Products look up the allocated line of an order through `find_allocated_line`
+    instead of indexing the lines of every batch.
+    """
 
     session: Session
+    load_strategy: LoadStrategy = LoadStrategy.SELECTIN
 
     def add(self, product: Product) -> None:
         """Add a batch to the repository."""
         self.session.add(product)
+        product.look_up_allocations_with(
+            partial(self.find_allocated_line, sku=product.sku)
+        )
 
     def get(self, sku: str) -> Product | None:
         """Add a batch to the repository."""
-        try:
-            return self.session.query(Product).filter_by(sku=sku).one()
-        except NoResultFound:
-            return None
+        with span("repository.get"):
+            try:
+                product = (
+                    self.session.query(Product)
+                    .options(*loader_options(self.load_strategy))
+                    .filter_by(sku=sku)
+                    .one()
+                )
+            except NoResultFound:
+                return None
+
+            product.look_up_allocations_with(
+                partial(self.find_allocated_line, sku=product.sku)
+            )
+            return product
+
+    def get_version(self, sku: str) -> int | None:
+        """Get the version number of a Product without loading it."""
+        return (
+            self.session.query(Product.version_number)  # type: ignore
+            .filter_by(sku=sku)
+            .scalar()
+        )
+
+    def skus(self) -> list[str]:
+        """Get the SKU of every Product, e.g. to load a SkuIndex at startup."""
+        return list(self.session.execute(select(products.c.sku)).scalars())
+
+    def find_allocation(self, order: OrderReference, sku: str) -> BatchReference | None:
+        """Get the batch the line of an order is allocated to, without loading it.
+
+        This goes through the indexes of the allocations and order lines tables,
+        so it is cheap even for Products with many allocations.
+        """
+        return (
+            self.session.query(Batch.reference)  # type: ignore
+            .join(Batch._allocated)  # pylint: disable=protected-access
+            .filter(order_lines.c.order == order, order_lines.c.sku == sku)
+            .limit(1)
+            .scalar()
+        )
+
+    def find_allocated_line(
+        self, order: OrderReference, sku: str
+    ) -> tuple[OrderLine, BatchReference] | None:
+        """Get the allocated line of an order and its batch, without loading them all.
+
+        Like `find_allocation`, this goes through indexes. Changes that were not
+        flushed yet are not seen, as Products remember those themselves.
+        """
+        with self.session.no_autoflush:
+            found = (
+                self.session.query(OrderLine, Batch.reference)  # type: ignore
+                .select_from(Batch)
+                .join(Batch._allocated)  # pylint: disable=protected-access
+                .filter(order_lines.c.order == order, order_lines.c.sku == sku)
+                .first()
+            )
+
+        return None if found is None else (found[0], found[1])
@@ -2,25 +2,65 @@
 from dataclasses import dataclass, field
 from typing import Callable, Type
 
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.exc import StaleDataError
 
+from ..domain.product import ConcurrentUpdate
+from ..instrumentation import count, span
+from ..repository import (
+    CachingProductRepository,
+    ProductCache,
+    SkuCheckingProductRepository,
+    SkuIndex,
+)
 from ..service_layer.unit_of_work import UnitOfWork
-from .repository import SQLAlchemyProductRepository
+from .mappings import products, violates
+from .repository import LoadStrategy, SQLAlchemyProductRepository
 
 SessionFactory = Callable[[], Session]
 
 
 @dataclass
 class SQLAlchemyUnitOfWork(UnitOfWork):
-    """A Unit of Work implementation based on an SQLAlchemy session."""
+    """A Unit of Work implementation based on an SQLAlchemy session.
+
+    With a `product_cache`, committed Products are kept in it when the unit of
+    work ends, and sessions do not expire them on commit so they can be reused.
+
+    With a `sku_index`, SKUs recently found not to exist are not looked up in
+    the database again.
+    """
 
     session_factory: SessionFactory
+    load_strategy: LoadStrategy = LoadStrategy.SELECTIN
+    product_cache: ProductCache | None = None
+    sku_index: SkuIndex | None = None
     session: Session = field(init=False)
-    products: SQLAlchemyProductRepository = field(init=False)
+    products: (
+        SQLAlchemyProductRepository
+        | SkuCheckingProductRepository
+        | CachingProductRepository
+    ) = field(init=False)
 
     def __enter__(self) -> "SQLAlchemyUnitOfWork":
-        self.session = self.session_factory()
-        self.products = SQLAlchemyProductRepository(self.session)
+        with span("uow.enter"):
+            self.session = self.session_factory()
+            self.products = SQLAlchemyProductRepository(
+                self.session, self.load_strategy
+            )
+
+            if self.sku_index is not None:
+                self.products = SkuCheckingProductRepository(
+                    self.products, self.sku_index
+                )
+
+            if self.product_cache is not None:
+                self.session.expire_on_commit = False
+                self.products = CachingProductRepository(
+                    self.products, self.product_cache
+                )
+
         return self
 
     def __exit__(
@@ -29,8 +69,33 @@ class SQLAlchemyUnitOfWork(UnitOfWork):
         super().__exit__(exc_type, _, _2)
         self.session.close()
 
+        if isinstance(self.products, CachingProductRepository):
+            self.products.release()
+
     def commit(self) -> None:
-        self.session.commit()
+        try:
+            with span("uow.commit"):
+                self.session.commit()
+        except StaleDataError as exc:
+            count("uow.conflicts")
+            raise ConcurrentUpdate(str(exc)) from exc
+        except IntegrityError as exc:
+            # Another unit of work added a Product with the same SKU first.
+            if not violates(exc, products.primary_key):
+                raise
+
+            count("uow.conflicts")
+            raise ConcurrentUpdate(str(exc)) from exc
+
+        if isinstance(self.products, CachingProductRepository):
+            self.products.mark_committed()
 
     def rollback(self) -> None:
-        self.session.rollback()
+        # Rolling back expires the Products, so they cannot be cached.
+        if self.session.in_transaction() and isinstance(
+            self.products, CachingProductRepository
+        ):
+            self.products.discard()
+
+        with span("uow.rollback"):
+            self.session.rollback()
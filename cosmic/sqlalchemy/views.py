@@ -0,0 +1,182 @@
+"""Read model of allocations and stock levels.
+
+The `allocations_view` and `stock_view` tables are denormalized copies of the
+state of Products, updated by MessageBus handlers as domain events are
+handled. Queries on them are single-table lookups by an indexed column and
+never load Product aggregates, so reads do not compete with allocations.
+
+The views are eventually consistent: they lag behind the aggregates by however
+long events take to be handled. Events of the same Product must be handled in
+the order they were raised, so a QueuedMessageBus should have a single worker
+when it updates the views.
+"""
+from dataclasses import dataclass
+from datetime import date
+
+from sqlalchemy import delete, insert, select, update
+
+from ..domain.events import Allocated, BatchAdded, Deallocated
+from ..messagebus import MessageBus
+from .mappings import allocations_view, stock_view
+from .unit_of_work import SessionFactory
+
+
+@dataclass(frozen=True)
+class AllocationView:
+    """Where the line of an order for a SKU is allocated."""
+
+    sku: str
+    quantity: int
+    batchref: str
+
+
+@dataclass(frozen=True)
+class BatchStockView:
+    """The stock of a batch."""
+
+    batchref: str
+    eta: date
+    quantity: int
+    available: int
+
+
+@dataclass
+class ViewUpdater:
+    """MessageBus handlers that update the read model, one transaction each.
+
+    Events may be delivered more than once, e.g. by an outbox relay retrying a
+    batch of events, so handling the same event again changes nothing.
+    """
+
+    session_factory: SessionFactory
+
+    def batch_added(self, event: BatchAdded) -> None:
+        """Record the stock of a new batch, unless it is already recorded."""
+        with self.session_factory() as session, session.begin():
+            recorded = session.execute(
+                select(stock_view.c.batchref).where(
+                    stock_view.c.batchref == event.reference
+                )
+            ).first()
+
+            if recorded is not None:
+                return
+
+            session.execute(
+                insert(stock_view).values(
+                    batchref=event.reference,
+                    sku=event.sku,
+                    eta=event.eta,
+                    quantity=event.quantity,
+                    allocated=0,
+                )
+            )
+
+    def allocated(self, event: Allocated) -> None:
+        """Record an allocation and take it from the stock of its batch.
+
+        An allocation already recorded for the order and SKU is replaced, so
+        handling the same event again leaves the views as they were.
+        """
+        with self.session_factory() as session, session.begin():
+            line = (allocations_view.c.orderid == event.order) & (
+                allocations_view.c.sku == event.sku
+            )
+            previous = session.execute(
+                select(allocations_view.c.quantity, allocations_view.c.batchref).where(
+                    line
+                )
+            ).one_or_none()
+
+            if previous is None:
+                session.execute(
+                    insert(allocations_view).values(
+                        orderid=event.order,
+                        sku=event.sku,
+                        quantity=event.quantity,
+                        batchref=event.batchref,
+                    )
+                )
+            else:
+                session.execute(
+                    update(allocations_view)
+                    .where(line)
+                    .values(quantity=event.quantity, batchref=event.batchref)
+                )
+                session.execute(
+                    update(stock_view)
+                    .where(stock_view.c.batchref == previous.batchref)
+                    .values(allocated=stock_view.c.allocated - previous.quantity)
+                )
+
+            session.execute(
+                update(stock_view)
+                .where(stock_view.c.batchref == event.batchref)
+                .values(allocated=stock_view.c.allocated + event.quantity)
+            )
+
+    def deallocated(self, event: Deallocated) -> None:
+        """Remove an allocation and give it back to the stock of its batch.
+
+        The stock is only given back if the allocation was still recorded.
+        """
+        with self.session_factory() as session, session.begin():
+            removed = session.execute(
+                delete(allocations_view).where(
+                    allocations_view.c.orderid == event.order,
+                    allocations_view.c.sku == event.sku,
+                )
+            )
+
+            if not removed.rowcount:
+                return
+
+            session.execute(
+                update(stock_view)
+                .where(stock_view.c.batchref == event.batchref)
+                .values(allocated=stock_view.c.allocated - event.quantity)
+            )
+
+
+def register_handlers(messagebus: MessageBus, session_factory: SessionFactory) -> None:
+    """Keep the read model up to date with the events handled by a MessageBus."""
+    updater = ViewUpdater(session_factory)
+    messagebus.add_handler(BatchAdded, updater.batch_added)
+    messagebus.add_handler(Allocated, updater.allocated)
+    messagebus.add_handler(Deallocated, updater.deallocated)
+
+
+def allocations(session_factory: SessionFactory, orderid: str) -> list[AllocationView]:
+    """Get where each line of an order is allocated."""
+    with session_factory() as session:
+        rows = session.execute(
+            select(
+                allocations_view.c.sku,
+                allocations_view.c.quantity,
+                allocations_view.c.batchref,
+            )
+            .where(allocations_view.c.orderid == orderid)
+            .order_by(allocations_view.c.sku)
+        )
+        return [AllocationView(row.sku, row.quantity, row.batchref) for row in rows]
+
+
+def stock(session_factory: SessionFactory, sku: str) -> list[BatchStockView]:
+    """Get the stock of each batch of a SKU, ordered by ETA."""
+    with session_factory() as session:
+        rows = session.execute(
+            select(
+                stock_view.c.batchref,
+                stock_view.c.eta,
+                stock_view.c.quantity,
+                stock_view.c.allocated,
+            )
+            .where(stock_view.c.sku == sku)
+            .order_by(stock_view.c.eta, stock_view.c.batchref)
+        )
+        return [
+            BatchStockView(
+                row.batchref, row.eta, row.quantity, row.quantity - row.allocated
+            )
+            for row in rows
+        ]
@@ -8,6 +8,12 @@ from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 
 
+@pytest.fixture(autouse=True)
+def check_batches(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check the allocated quantity of batches after every change."""
+    monkeypatch.setattr("cosmic.domain.batch.CHECK_CONSISTENCY", True)
+
+
 @pytest.fixture(scope="session")
 def start_mappings() -> None:
     """Start database mappings."""
@@ -20,10 +26,16 @@ def start_mappings() -> None:
 def test_db_engine(start_mappings: None) -> Engine:
     """Get a working SQLAlchemy Session."""
     from sqlalchemy import create_engine
+    from sqlalchemy.pool import StaticPool
 
     from cosmic.sqlalchemy.mappings import create_schema
 
-    engine = create_engine("sqlite://")
+    # The in-memory database must be visible from the API's worker threads.
+    engine = create_engine(
+        "sqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
     create_schema(engine)
 
     return engine
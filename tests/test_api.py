@@ -1,6 +1,8 @@
 """End-to-end API tests."""
 # pylint: disable=redefined-outer-name
+import threading
 from dataclasses import dataclass, field
+from datetime import date
 from typing import AsyncIterator
 
 import pytest
@@ -18,9 +20,11 @@ class FakeOutOfStockHandler:
     """Fake handler for OutOfStock events."""
 
     events_registered: list[OutOfStock] = field(default_factory=list)
+    threads: list[threading.Thread] = field(default_factory=list)
 
     def __call__(self, event: OutOfStock) -> None:
         self.events_registered.append(event)
+        self.threads.append(threading.current_thread())
 
 
 @dataclass
@@ -143,3 +147,299 @@ async def test_400_message_for_invalid_sku(api: APITestTools):
 
     assert response.status_code == 400
     assert response.json()["message"] == f"Invalid sku {unknown_sku}"
+
+
+@pytest.mark.asyncio
+async def test_409_message_for_duplicate_batch(api: APITestTools):
+    """HTTP API should refuse a batch with the reference of an existing one."""
+    response = await post_to_add_batch(api, "BATCH1", "PRODUCT1", 10, "2011-01-01")
+    assert response.status_code == 201
+
+    response = await post_to_add_batch(api, "BATCH1", "PRODUCT2", 10, "2011-01-01")
+    assert response.status_code == 409
+    assert response.json()["message"] == "Batch BATCH1 already exists"
+
+
+@pytest.mark.asyncio
+async def test_services_run_off_the_event_loop_thread(api: APITestTools):
+    """HTTP API should not run the blocking service layer on the event loop."""
+    sku = SKU("PRODUCT1")
+
+    response = await post_to_add_batch(api, "BATCH1", sku, 10, "2011-01-01")
+    assert response.status_code == 201
+
+    data = {"orderid": "ORDER1", "sku": sku, "qty": 20}
+    response = await api.client.post(f"{api.url}/allocate/", json=data)
+    assert response.status_code == 400
+
+    assert api.out_of_stock_handler.threads
+    assert threading.current_thread() not in api.out_of_stock_handler.threads
+
+
+@pytest.mark.asyncio
+async def test_bulk_allocation_returns_results_per_line(api: APITestTools):
+    """HTTP API should allocate many lines at once and report on each of them."""
+    sku, unknown_sku = "PRODUCT1", "PRODUCT2"
+
+    response = await post_to_add_batch(api, "BATCH1", sku, 10, "2011-01-01")
+    assert response.status_code == 201
+
+    data = {
+        "lines": [
+            {"orderid": "ORDER1", "sku": sku, "qty": 8},
+            {"orderid": "ORDER2", "sku": sku, "qty": 8},
+            {"orderid": "ORDER3", "sku": unknown_sku, "qty": 1},
+        ]
+    }
+
+    response = await api.client.post(f"{api.url}/allocate/bulk/", json=data)
+
+    assert response.status_code == 200
+    assert response.json()["results"] == [
+        {
+            "orderid": "ORDER1",
+            "sku": sku,
+            "batchref": "BATCH1",
+            "message": None,
+            "conflict": False,
+        },
+        {
+            "orderid": "ORDER2",
+            "sku": sku,
+            "batchref": None,
+            "message": f"Out of stock for sku {sku}",
+            "conflict": False,
+        },
+        {
+            "orderid": "ORDER3",
+            "sku": unknown_sku,
+            "batchref": None,
+            "message": f"Invalid sku {unknown_sku}",
+            "conflict": False,
+        },
+    ]
+    assert api.out_of_stock_handler.events_registered == [OutOfStock(SKU(sku))]
+
+
+@pytest.mark.asyncio
+async def test_orders_can_be_reallocated_and_deallocated(api: APITestTools):
+    """HTTP API should move orders between batches and cancel their allocations."""
+    sku = "PRODUCT1"
+
+    await post_to_add_batch(api, "BATCH1", sku, 10, "2011-01-01")
+    await post_to_add_batch(api, "BATCH2", sku, 20, "2011-01-02")
+
+    data = {"orderid": "ORDER1", "sku": sku, "qty": 5}
+    response = await api.client.post(f"{api.url}/allocate/", json=data)
+    assert response.json()["batchref"] == "BATCH1"
+
+    data = {"orderid": "ORDER1", "sku": sku, "qty": 15}
+    response = await api.client.post(f"{api.url}/reallocate/", json=data)
+    assert response.status_code == 201
+    assert response.json()["batchref"] == "BATCH2"
+
+    data = {"orderid": "ORDER1", "sku": sku}
+    response = await api.client.post(f"{api.url}/deallocate/", json=data)
+    assert response.status_code == 200
+    assert response.json()["batchref"] == "BATCH2"
+
+    response = await api.client.post(f"{api.url}/deallocate/", json=data)
+    assert response.status_code == 400
+    assert response.json()["message"] == f"Order ORDER1 has no allocation for sku {sku}"
+
+
+@pytest.mark.asyncio
+async def test_read_model_serves_allocations_and_stock(test_db_engine: Engine):
+    """HTTP API should answer queries from the read model."""
+    from cosmic.http_api import make_api
+
+    app = make_api(test_db_engine, MessageBus(), read_model=True)
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        response = await client.get("/allocations/ORDER1")
+        assert response.status_code == 404
+
+        await client.post(
+            "/add_batch/",
+            json={"ref": "BATCH1", "sku": "PRODUCT1", "qty": 10, "eta": "2011-01-01"},
+        )
+        await client.post(
+            "/allocate/", json={"orderid": "ORDER1", "sku": "PRODUCT1", "qty": 3}
+        )
+
+        response = await client.get("/allocations/ORDER1")
+        assert response.status_code == 200
+        assert response.json() == {
+            "orderid": "ORDER1",
+            "allocations": [{"sku": "PRODUCT1", "qty": 3, "batchref": "BATCH1"}],
+        }
+
+        response = await client.get("/stock/PRODUCT1")
+        assert response.status_code == 200
+        assert response.json() == {
+            "sku": "PRODUCT1",
+            "available": 7,
+            "batches": [
+                {"batchref": "BATCH1", "eta": "2011-01-01", "qty": 10, "available": 7}
+            ],
+        }
+
+
+@pytest.mark.asyncio
+async def test_repeated_allocation_with_the_read_model(test_db_engine: Engine):
+    """HTTP API should allocate the same line twice as if it was once, and no other."""
+    from cosmic.http_api import make_api
+
+    app = make_api(test_db_engine, MessageBus(), read_model=True)
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        await client.post(
+            "/add_batch/",
+            json={"ref": "BATCH1", "sku": "PRODUCT1", "qty": 10, "eta": "2011-01-01"},
+        )
+        data = {"orderid": "ORDER1", "sku": "PRODUCT1", "qty": 3}
+
+        for _ in range(2):
+            response = await client.post("/allocate/", json=data)
+            assert response.status_code == 201
+            assert response.json()["batchref"] == "BATCH1"
+
+        response = await client.post("/allocate/", json={**data, "qty": 5})
+        assert response.status_code == 400
+        assert response.json()["message"].startswith("Order ORDER1 already has 3")
+
+        response = await client.get("/stock/PRODUCT1")
+        assert response.json()["available"] == 7
+
+
+@pytest.mark.asyncio
+async def test_sharded_allocation(test_db_engine: Engine):
+    """HTTP API should allocate through sharded workers when asked to."""
+    from cosmic.http_api import make_api
+
+    app = make_api(test_db_engine, MessageBus(), allocation_shards=2)
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        await client.post(
+            "/add_batch/",
+            json={"ref": "BATCH1", "sku": "PRODUCT1", "qty": 10, "eta": "2011-01-01"},
+        )
+
+        data = {"orderid": "ORDER1", "sku": "PRODUCT1", "qty": 3}
+        response = await client.post("/allocate/", json=data)
+        assert response.status_code == 201
+        assert response.json()["batchref"] == "BATCH1"
+
+        data = {"orderid": "ORDER2", "sku": "PRODUCT1", "qty": 30}
+        response = await client.post("/allocate/", json=data)
+        assert response.status_code == 400
+
+    await app.router.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_sku_index_is_loaded_at_startup(test_db_engine: Engine):
+    """HTTP API should load the stored SKUs into its index and reject missing ones."""
+    from cosmic.http_api import make_api
+    from cosmic.repository import SkuIndex
+    from cosmic.service_layer import services
+    from cosmic.sqlalchemy.database import make_session_factory
+    from cosmic.sqlalchemy.unit_of_work import SQLAlchemyUnitOfWork
+
+    services.add_batch(
+        services.BatchCandidate("BATCH1", "PRODUCT1", 10, date(2011, 1, 1)),
+        SQLAlchemyUnitOfWork(make_session_factory(test_db_engine)),
+    )
+    index = SkuIndex()
+    app = make_api(test_db_engine, MessageBus(), sku_index=index)
+    index.mark_missing("PRODUCT1")
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        data = {"orderid": "ORDER1", "sku": "PRODUCT1", "qty": 3}
+        response = await client.post("/allocate/", json=data)
+        assert response.status_code == 201
+
+        for _ in range(2):
+            data = {"orderid": "ORDER1", "sku": "NOPE", "qty": 3}
+            response = await client.post("/allocate/", json=data)
+            assert response.status_code == 400
+            assert response.json()["message"] == "Invalid sku NOPE"
+
+        assert index.is_missing("NOPE")
+
+
+@pytest.mark.asyncio
+async def test_batches_are_imported_from_streamed_feeds(api: APITestTools):
+    """HTTP API should import the batches of a CSV or NDJSON upload."""
+
+    async def feed() -> AsyncIterator[bytes]:
+        # Chunks do not have to end at line boundaries.
+        yield b"ref,sku,qty,eta\nBATCH1,PRODUCT1,10,2011-01-01\nBATCH2,PRO"
+        yield b"DUCT1,10,2011-01-02\n"
+
+    url = f"{api.url}/add_batch/bulk/"
+    response = await api.client.post(
+        url, content=feed(), headers={"content-type": "text/csv"}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"imported": 2, "skipped": 0}
+
+    response = await api.client.post(
+        url,
+        content=b'{"ref": "BATCH2", "sku": "PRODUCT1", "qty": 10, "eta": "2011-01-02"}',
+        headers={"content-type": "application/x-ndjson"},
+    )
+    assert response.json() == {"imported": 0, "skipped": 1}
+
+    response = await api.client.post(
+        url, content=b"ref,sku\nBATCH3,PRODUCT1", headers={"content-type": "text/csv"}
+    )
+    assert response.status_code == 400
+
+    response = await api.client.post(url, content=b"{}")
+    assert response.status_code == 415
+
+    # Spreadsheets often start CSV exports with a byte order mark.
+    response = await api.client.post(
+        url,
+        content="\ufeffref,sku,qty,eta\nBATCH3,PRODUCT1,10,2011-01-03\n".encode(),
+        headers={"content-type": "text/csv"},
+    )
+    assert response.json() == {"imported": 1, "skipped": 0}
+
+    data = {"orderid": "ORDER1", "sku": "PRODUCT1", "qty": 5}
+    response = await api.client.post(f"{api.url}/allocate/", json=data)
+    assert response.json()["batchref"] == "BATCH1"
+
+
+@pytest.mark.asyncio
+async def test_outbox_moves_event_handling_out_of_requests(
+    test_db_engine: Engine,
+) -> None:
+    """With an outbox, events should only be handled by the outbox relay."""
+    from sqlalchemy.orm import Session
+
+    from cosmic.http_api import make_api
+    from cosmic.sqlalchemy.outbox import OutboxRelay
+
+    out_of_stock_handler = FakeOutOfStockHandler()
+    messagebus = MessageBus()
+    messagebus.add_handler(OutOfStock, out_of_stock_handler)
+
+    app = make_api(test_db_engine, messagebus, use_outbox=True)
+
+    async with AsyncClient(app=app, base_url="http://test") as client:
+        api = APITestTools(client, "http://test", out_of_stock_handler)
+
+        response = await post_to_add_batch(api, "BATCH1", "PRODUCT1", 10, "2011-01-01")
+        assert response.status_code == 201
+
+        data = {"orderid": "ORDER1", "sku": "PRODUCT1", "qty": 20}
+        response = await client.post("/allocate/", json=data)
+        assert response.status_code == 400
+
+    assert not out_of_stock_handler.events_registered
+
+    OutboxRelay(lambda: Session(test_db_engine), messagebus).run_once()
+
+    assert out_of_stock_handler.events_registered == [OutOfStock(SKU("PRODUCT1"))]
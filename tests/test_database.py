@@ -0,0 +1,71 @@
+"""Tests for the engine and session factories."""
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool, StaticPool
+
+from cosmic.sqlalchemy.database import (
+    Database,
+    PoolSettings,
+    make_engine,
+    make_session_factory,
+)
+
+
+def test_file_databases_use_a_configured_pool(tmp_path: Path) -> None:
+    """Engines for database files should pool connections as configured."""
+    engine = make_engine(
+        f"sqlite:///{tmp_path}/cosmic.db", PoolSettings(size=3, max_overflow=2)
+    )
+
+    assert isinstance(engine.pool, QueuePool)
+    assert engine.pool.size() == 3
+    assert engine.pool._max_overflow == 2  # pylint: disable=protected-access
+
+
+def test_in_memory_databases_share_their_connection() -> None:
+    """In-memory databases should survive between sessions."""
+    database = Database.from_url("sqlite://")
+
+    assert isinstance(database.engine.pool, StaticPool)
+
+    with database.sessions() as session, session.begin():
+        session.execute(text("CREATE TABLE things (id INTEGER)"))
+        session.execute(text("INSERT INTO things VALUES (1)"))
+
+    with database.sessions() as session:
+        assert session.execute(text("SELECT id FROM things")).scalar() == 1
+
+
+def test_sqlite_transactions_can_begin_immediately(tmp_path: Path) -> None:
+    """SQLite sessions should hold the write lock from the start if asked to."""
+    url = f"sqlite:///{tmp_path}/cosmic.db"
+
+    for begin_immediate in [False, True]:
+        database = Database.from_url(
+            url, PoolSettings(sqlite_begin_immediate=begin_immediate)
+        )
+
+        with database.sessions() as session:
+            session.execute(text("SELECT 1"))
+            in_transaction = session.connection().connection.in_transaction
+
+        assert in_transaction == begin_immediate
+        database.dispose()
+
+
+def test_in_memory_transactions_do_not_begin_immediately() -> None:
+    """Sessions sharing an in-memory connection should not begin transactions on it."""
+    database = Database.from_url("sqlite://", PoolSettings(sqlite_begin_immediate=True))
+
+    with database.sessions() as session, database.sessions() as other:
+        session.execute(text("SELECT 1"))
+        other.execute(text("SELECT 1"))
+
+
+def test_session_factory_can_keep_objects_loaded() -> None:
+    """Sessions should honour `expire_on_commit`."""
+    engine = make_engine("sqlite://")
+
+    assert make_session_factory(engine)().expire_on_commit
+    assert not make_session_factory(engine, expire_on_commit=False)().expire_on_commit
@@ -1,4 +1,5 @@
 """Tests for domain functionality."""
+from dataclasses import FrozenInstanceError
 from datetime import date
 
 import pytest
@@ -6,10 +7,13 @@ import pytest
 from cosmic.domain.batch import (
     Batch,
     BatchReference,
+    InconsistentBatch,
     NotEnoughProductsOnBatch,
     allocate,
 )
+from cosmic.domain.events import OutOfStock
 from cosmic.domain.order import SKU, OrderLine, OrderReference
+from cosmic.domain.product import AlreadyAllocated, Product
 
 
 def test_allocating_to_a_batch_reduces_the_available_quantity() -> None:
@@ -103,6 +107,36 @@ def test_allocation_is_idempotent() -> None:
     assert batch.available() == 18
 
 
+def test_deallocating_restores_the_available_quantity() -> None:
+    """Deallocating an allocated line should give its quantity back."""
+    batch = Batch(
+        BatchReference("batch001"), SKU("SMALL-TABLE"), 20, eta=date(1917, 10, 1)
+    )
+    line1 = OrderLine(OrderReference("order001"), SKU("SMALL-TABLE"), 2)
+    line2 = OrderLine(OrderReference("order002"), SKU("SMALL-TABLE"), 5)
+
+    batch.allocate(line1)
+    batch.allocate(line2)
+    assert batch.available() == 13
+
+    batch.deallocate(line1)
+    assert batch.available() == 15
+
+    batch.deallocate(line1)
+    assert batch.available() == 15
+
+
+def test_batches_check_their_allocated_quantity() -> None:
+    """Batches should notice a running total that does not match their lines."""
+    batch = Batch(
+        BatchReference("batch001"), SKU("SMALL-TABLE"), 20, eta=date(1917, 10, 1)
+    )
+    batch._allocated_quantity = 3  # pylint: disable=protected-access
+
+    with pytest.raises(InconsistentBatch):
+        batch.allocate(OrderLine(OrderReference("order001"), SKU("SMALL-TABLE"), 2))
+
+
 def test_prefers_warehouse_batches_to_shipments() -> None:
     """allocate() should prefer batches that already arrived on a warehouse."""
     in_stock_batch = Batch(
@@ -177,3 +211,134 @@ def test_allocate_returns_none_if_cannot_allocate():
     order_line = OrderLine(OrderReference("order001"), SKU("RED-CHAIR"), 2)
 
     assert allocate(order_line, [batch]) is None
+
+
+def test_product_keeps_batches_ordered_by_eta() -> None:
+    """Product.add_batch should keep the batches ordered by ETA."""
+    medium = Batch(BatchReference("medium"), SKU("LAVA-LAMP"), 10, date(1917, 10, 2))
+    earliest = Batch(BatchReference("early"), SKU("LAVA-LAMP"), 10, date(1917, 10, 1))
+    latest = Batch(BatchReference("late"), SKU("LAVA-LAMP"), 10, date(1917, 10, 3))
+
+    product = Product(SKU("LAVA-LAMP"), [latest])
+    product.add_batch(earliest)
+    product.add_batch(medium)
+
+    assert product.batches == [earliest, medium, latest]
+    assert product.batches_in_stock == [earliest, medium, latest]
+
+
+def test_product_skips_exhausted_batches() -> None:
+    """Product.allocate should move on once the earliest batch runs out."""
+    earliest = Batch(BatchReference("early"), SKU("LAVA-LAMP"), 10, date(1917, 10, 1))
+    latest = Batch(BatchReference("late"), SKU("LAVA-LAMP"), 10, date(1917, 10, 2))
+
+    product = Product(SKU("LAVA-LAMP"), [latest, earliest])
+
+    line1 = OrderLine(OrderReference("order1"), SKU("LAVA-LAMP"), 10)
+    line2 = OrderLine(OrderReference("order2"), SKU("LAVA-LAMP"), 3)
+
+    assert product.allocate(line1) == earliest.reference
+    assert product.batches_in_stock == [latest]
+    assert product.allocate(line2) == latest.reference
+    assert latest.available() == 7
+
+
+def test_order_lines_hash_by_value() -> None:
+    """Equal order lines should hash equally, as batches keep them in sets."""
+    line = OrderLine(OrderReference("order1"), SKU("LAVA-LAMP"), 10)
+
+    assert hash(line) == hash(OrderLine(OrderReference("order1"), SKU("LAVA-LAMP"), 10))
+
+
+def test_events_are_compact_and_immutable() -> None:
+    """Events should not carry an instance dictionary nor change."""
+    event = OutOfStock(SKU("LAVA-LAMP"))
+
+    assert not hasattr(event, "__dict__")
+
+    with pytest.raises(FrozenInstanceError):
+        event.sku = SKU("OTHER-LAMP")  # type: ignore
+
+
+def test_product_deallocates_orders_back_into_stock() -> None:
+    """Product.deallocate should free the line of an order from its batch."""
+    earliest = Batch(BatchReference("early"), SKU("LAVA-LAMP"), 10, date(1917, 10, 1))
+    latest = Batch(BatchReference("late"), SKU("LAVA-LAMP"), 10, date(1917, 10, 2))
+
+    product = Product(SKU("LAVA-LAMP"), [latest, earliest])
+    line = OrderLine(OrderReference("order1"), SKU("LAVA-LAMP"), 10)
+    product.allocate(line)
+    version = product.version_number
+
+    assert product.allocation_for(OrderReference("order1")) == earliest.reference
+    assert product.deallocate(OrderReference("order1")) == line
+    assert product.allocation_for(OrderReference("order1")) is None
+    assert product.batches_in_stock == [earliest, latest]
+    assert product.version_number == version + 1
+    assert earliest.available() == 10
+
+
+def test_product_indexes_previously_allocated_orders() -> None:
+    """Product should find orders that were allocated before it was built."""
+    batch = Batch(BatchReference("batch"), SKU("LAVA-LAMP"), 10, date(1917, 10, 1))
+    line = OrderLine(OrderReference("order1"), SKU("LAVA-LAMP"), 3)
+    batch.allocate(line)
+
+    product = Product(SKU("LAVA-LAMP"), [batch])
+
+    assert product.deallocate(OrderReference("order2")) is None
+    assert product.deallocate(OrderReference("order1")) == line
+    assert batch.available() == 10
+
+
+def test_product_allocation_is_idempotent() -> None:
+    """Product.allocate should not change anything for an allocated line."""
+    batch = Batch(BatchReference("batch"), SKU("LAVA-LAMP"), 10, date(1917, 10, 1))
+    product = Product(SKU("LAVA-LAMP"), [batch])
+    line = OrderLine(OrderReference("order1"), SKU("LAVA-LAMP"), 3)
+    product.allocate(line)
+    version = product.version_number
+    events = len(product.events)
+
+    assert product.allocate(line) == batch.reference
+    assert product.version_number == version
+    assert len(product.events) == events
+    assert batch.available() == 7
+
+
+def test_product_looks_up_allocations_through_a_source() -> None:
+    """Product should ask its source for lines, remembering its own changes."""
+    batch = Batch(BatchReference("batch"), SKU("LAVA-LAMP"), 10, date(1917, 10, 1))
+    line = OrderLine(OrderReference("order1"), SKU("LAVA-LAMP"), 3)
+    batch.allocate(line)
+    lookups: list[OrderReference] = []
+
+    def source(order: OrderReference) -> tuple[OrderLine, BatchReference] | None:
+        lookups.append(order)
+        return (line, batch.reference) if order == line.order else None
+
+    product = Product(SKU("LAVA-LAMP"), [batch])
+    product.look_up_allocations_with(source)
+    other = OrderLine(OrderReference("order2"), SKU("LAVA-LAMP"), 2)
+
+    assert product.allocate(line) == batch.reference
+    assert product.allocate(other) == batch.reference
+    assert product.deallocate(OrderReference("order1")) == line
+    assert product.allocation_for(OrderReference("order1")) is None
+    assert product.allocation_for(OrderReference("order2")) == batch.reference
+    assert lookups == [OrderReference("order1"), OrderReference("order2")]
+    assert batch.available() == 8
+
+
+def test_product_rejects_another_line_of_an_allocated_order() -> None:
+    """Product.allocate should not lose the line an order already has allocated."""
+    batch = Batch(BatchReference("batch"), SKU("LAVA-LAMP"), 10, date(1917, 10, 1))
+    product = Product(SKU("LAVA-LAMP"), [batch])
+    line = OrderLine(OrderReference("order1"), SKU("LAVA-LAMP"), 3)
+    product.allocate(line)
+
+    with pytest.raises(AlreadyAllocated, match="Order order1 already has 3"):
+        product.allocate(OrderLine(OrderReference("order1"), SKU("LAVA-LAMP"), 5))
+
+    assert product.deallocate(OrderReference("order1")) == line
+    assert batch.available() == 10
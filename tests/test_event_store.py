@@ -0,0 +1,132 @@
+"""Tests for the event-sourced storage of Products."""
+from datetime import date
+
+import pytest
+
+from cosmic.domain.batch import BatchCandidate
+from cosmic.domain.order import SKU, OrderLine, OrderReference
+from cosmic.domain.product import ConcurrentUpdate
+from cosmic.service_layer import services
+from cosmic.sqlalchemy.event_store import (
+    EventSourcedUnitOfWork,
+    UntrackedChanges,
+    product_from_snapshot,
+    snapshot_of,
+)
+from cosmic.sqlalchemy.unit_of_work import SessionFactory
+
+
+def line(order: str, quantity: int = 1) -> OrderLine:
+    """Make an order line of RED-LAMP."""
+    return OrderLine(OrderReference(order), SKU("RED-LAMP"), quantity)
+
+
+def add_batches(session_factory: SessionFactory, snapshot_every: int = 100) -> None:
+    """Add two batches of RED-LAMP."""
+    for reference, quantity, eta in [("b1", 3, 1), ("b2", 10, 2)]:
+        services.add_batch(
+            BatchCandidate(reference, "RED-LAMP", quantity, date(2010, 1, eta)),
+            EventSourcedUnitOfWork(session_factory, snapshot_every),
+        )
+
+
+def test_products_are_rebuilt_from_their_events(
+    session_factory: SessionFactory,
+) -> None:
+    """A Product should be loaded as the changes appended to it left it."""
+    add_batches(session_factory)
+
+    def make_uow() -> EventSourcedUnitOfWork:
+        return EventSourcedUnitOfWork(session_factory)
+
+    assert services.allocate(line("o1", 2), make_uow()) == "b1"
+    assert services.allocate(line("o2", 2), make_uow()) == "b2"
+    assert services.deallocate("o1", "RED-LAMP", make_uow()) == "b1"
+
+    with make_uow() as uow:
+        product = uow.products.get("RED-LAMP")
+
+        assert product is not None
+        assert product.version_number == 5
+        assert uow.products.get_version("RED-LAMP") == 5
+        assert [batch.available() for batch in product.batches] == [3, 8]
+        assert product.allocation_for(OrderReference("o2")) == "b2"
+        assert product.allocation_for(OrderReference("o1")) is None
+
+        assert uow.products.get("NO-LAMP") is None
+        assert uow.products.get_version("NO-LAMP") is None
+
+
+def test_snapshots_are_taken_periodically(session_factory: SessionFactory) -> None:
+    """Products should be snapshotted every few versions and loaded from them."""
+    add_batches(session_factory, snapshot_every=3)
+
+    for i in range(3):
+        services.allocate(line(f"o{i}"), EventSourcedUnitOfWork(session_factory, 3))
+
+    with session_factory() as session:
+        [[snapshot_version]] = session.execute(
+            "SELECT version_number FROM product_snapshots WHERE sku = 'RED-LAMP'"
+        )
+        [[events]] = session.execute("SELECT COUNT(*) FROM product_events")
+
+    assert snapshot_version == 3
+    assert events == 5
+
+    with EventSourcedUnitOfWork(session_factory, 3) as uow:
+        product = uow.products.get("RED-LAMP")
+
+        assert product is not None
+        assert product.version_number == 5
+        assert [batch.available() for batch in product.batches] == [0, 10]
+
+
+def test_snapshots_keep_the_state_of_products(session_factory: SessionFactory) -> None:
+    """A Product rebuilt from its snapshot should have the same batches and lines."""
+    add_batches(session_factory)
+    services.allocate(line("o1", 2), EventSourcedUnitOfWork(session_factory))
+
+    with EventSourcedUnitOfWork(session_factory) as uow:
+        product = uow.products.get("RED-LAMP")
+        assert product is not None
+
+    rebuilt = product_from_snapshot("RED-LAMP", 3, snapshot_of(product))
+
+    assert rebuilt.version_number == 3
+    assert [
+        (batch.reference, batch.eta, batch.available()) for batch in rebuilt.batches
+    ] == [(batch.reference, batch.eta, batch.available()) for batch in product.batches]
+    assert rebuilt.allocation_for(OrderReference("o1")) == "b1"
+
+
+def test_concurrent_updates_are_rejected(session_factory: SessionFactory) -> None:
+    """Appending a version of a Product someone else appended should fail."""
+    add_batches(session_factory)
+
+    with EventSourcedUnitOfWork(session_factory) as uow1, EventSourcedUnitOfWork(
+        session_factory
+    ) as uow2:
+        product1 = uow1.products.get("RED-LAMP")
+        product2 = uow2.products.get("RED-LAMP")
+        assert product1 is not None and product2 is not None
+
+        product1.allocate(line("o1"))
+        product2.allocate(line("o2"))
+        uow1.commit()
+
+        with pytest.raises(ConcurrentUpdate):
+            uow2.commit()
+
+
+def test_untracked_changes_are_not_stored(session_factory: SessionFactory) -> None:
+    """Changing a Product without raising events should fail to commit."""
+    add_batches(session_factory)
+
+    with EventSourcedUnitOfWork(session_factory) as uow:
+        product = uow.products.get("RED-LAMP")
+        assert product is not None
+
+        product.version_number += 1
+
+        with pytest.raises(UntrackedChanges):
+            uow.commit()
@@ -0,0 +1,60 @@
+"""Tests for the bulk import of batches."""
+from datetime import date
+
+import pytest
+
+from cosmic.domain.batch import BatchCandidate
+from cosmic.domain.events import BatchAdded
+from cosmic.importer import FeedFormat, InvalidRow, parse_batches
+from cosmic.messagebus import MessageBus
+from cosmic.sqlalchemy.bulk import BatchImporter, ImportResult
+from cosmic.sqlalchemy.unit_of_work import SessionFactory, SQLAlchemyUnitOfWork
+
+
+def test_feeds_are_parsed_lazily() -> None:
+    """Batches should be parsed from CSV and NDJSON lines as they are read."""
+    csv_lines = iter(["ref,sku,qty,eta", "b1,RED-CHAIR,10,2011-01-01", "oops"])
+    batches = parse_batches(csv_lines, FeedFormat.CSV)
+
+    assert next(batches) == BatchCandidate("b1", "RED-CHAIR", 10, date(2011, 1, 1))
+
+    with pytest.raises(InvalidRow):
+        next(batches)
+
+    ndjson_lines = [
+        '{"ref": "b2", "sku": "RED-CHAIR", "qty": 5, "eta": "2011-01-02"}',
+        "",
+    ]
+
+    assert list(parse_batches(ndjson_lines, FeedFormat.NDJSON)) == [
+        BatchCandidate("b2", "RED-CHAIR", 5, date(2011, 1, 2))
+    ]
+
+
+def test_importer_adds_batches_in_chunks(session_factory: SessionFactory) -> None:
+    """The importer should add new batches and skip the ones that exist."""
+    handled: list[BatchAdded] = []
+    messagebus = MessageBus()
+    messagebus.add_handler(BatchAdded, handled.append)
+
+    candidates = [
+        BatchCandidate(f"b{i}", f"SKU-{i % 3}", 10, date(2011, 1, i + 1))
+        for i in range(10)
+    ]
+    importer = BatchImporter(session_factory, messagebus, chunk_size=4)
+
+    assert importer.import_batches(candidates[:6]) == ImportResult(imported=6)
+    assert importer.import_batches(candidates) == ImportResult(imported=4, skipped=6)
+    assert len(handled) == 10
+
+    with SQLAlchemyUnitOfWork(session_factory) as uow:
+        product = uow.products.get("SKU-0")
+        assert product is not None
+        assert [batch.reference for batch in product.batches] == [
+            "b0",
+            "b3",
+            "b6",
+            "b9",
+        ]
+        # One version per batch added to the product.
+        assert product.version_number == 4
@@ -0,0 +1,35 @@
+"""Tests for what importing parts of the package loads."""
+import subprocess
+import sys
+
+import pytest
+
+BACKENDS = ["asyncio", "cosmic.email", "fastapi", "numpy", "pydantic", "sqlalchemy"]
+
+
+def loaded_modules(module: str) -> set[str]:
+    """Import a module in a new interpreter, and get which modules it loaded."""
+    output = subprocess.run(
+        [sys.executable, "-c", f"import sys, {module}; print(*sys.modules)"],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return set(output.split())
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "cosmic.domain.product",
+        "cosmic.messagebus",
+        "cosmic.service_layer.services",
+        "cosmic.service_layer.sharding",
+        "cosmic.memory.unit_of_work",
+        "cosmic.snapshot",
+        "cosmic.importer",
+    ],
+)
+def test_backends_are_not_imported_eagerly(module: str) -> None:
+    """Modules that do not need a backend should not import it."""
+    assert loaded_modules(module).isdisjoint(BACKENDS)
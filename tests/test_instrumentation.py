@@ -0,0 +1,80 @@
+"""Tests for the instrumentation hooks."""
+# pylint: disable=redefined-outer-name
+from datetime import date
+from typing import Iterator
+
+import pytest
+
+from cosmic import instrumentation
+from cosmic.domain.events import OutOfStock
+from cosmic.domain.order import SKU, OrderLine, OrderReference
+from cosmic.instrumentation import InMemoryCollector
+from cosmic.messagebus import MessageBus
+from cosmic.service_layer import services
+from cosmic.service_layer.unit_of_work import TrackingUnitOfWork
+from cosmic.sqlalchemy.unit_of_work import SessionFactory, SQLAlchemyUnitOfWork
+
+
+@pytest.fixture
+def collector() -> Iterator[InMemoryCollector]:
+    """Register an in-memory collector for the duration of a test."""
+    collector = InMemoryCollector()
+    instrumentation.set_collector(collector)
+    yield collector
+    instrumentation.set_collector(None)
+
+
+def test_hooks_do_nothing_without_a_collector() -> None:
+    """Spans and counters should be no-ops when no collector is registered."""
+    with instrumentation.span("nothing"):
+        instrumentation.count("nothing")
+
+
+def test_allocation_is_instrumented(
+    collector: InMemoryCollector, session_factory: SessionFactory
+) -> None:
+    """Allocating should report the time spent on each step."""
+    messagebus = MessageBus()
+    messagebus.add_handler(OutOfStock, lambda _: None)
+
+    def make_uow() -> TrackingUnitOfWork:
+        return TrackingUnitOfWork(SQLAlchemyUnitOfWork(session_factory), messagebus)
+
+    services.add_batch(
+        services.BatchCandidate("b1", "SHY-OTTOMAN", 10, date(2010, 1, 1)), make_uow()
+    )
+    services.allocate(
+        OrderLine(OrderReference("o1"), SKU("SHY-OTTOMAN"), 3), make_uow()
+    )
+
+    with pytest.raises(services.OutOfStock):
+        services.allocate(
+            OrderLine(OrderReference("o2"), SKU("SHY-OTTOMAN"), 30), make_uow()
+        )
+
+    totals = collector.totals()
+
+    for name in [
+        "uow.enter",
+        "uow.commit",
+        "uow.rollback",
+        "repository.get",
+        "product.allocate",
+        "messagebus.handle",
+    ]:
+        assert totals[name] > 0, name
+
+    assert len(collector.durations("product.allocate")) == 2
+    assert collector.counters["product.out_of_stock"] == 1
+
+
+def test_spans_record_their_parent(collector: InMemoryCollector) -> None:
+    """Nested spans should know which span they ran in."""
+    with instrumentation.span("outer"):
+        with instrumentation.span("inner"):
+            pass
+
+    assert [(record.name, record.parent) for record in collector.spans] == [
+        ("inner", "outer"),
+        ("outer", None),
+    ]
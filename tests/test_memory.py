@@ -0,0 +1,211 @@
+"""Tests for the in-memory repository and Unit of Work."""
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from cosmic.domain.batch import BatchCandidate
+from cosmic.domain.order import SKU, OrderLine, OrderReference
+from cosmic.domain.product import ConcurrentUpdate
+from cosmic.memory.journal import CorruptJournal
+from cosmic.memory.repository import ProductStore
+from cosmic.memory.unit_of_work import InMemoryUnitOfWork
+from cosmic.service_layer import services
+
+
+def add_batch(store: ProductStore, reference: str, quantity: int = 10) -> None:
+    """Add a batch of SMALL-TABLE to a store."""
+    services.add_batch(
+        BatchCandidate(reference, "SMALL-TABLE", quantity, date(2010, 1, 1)),
+        InMemoryUnitOfWork(store),
+    )
+
+
+def line(order: str, quantity: int = 1) -> OrderLine:
+    """Make an order line of SMALL-TABLE."""
+    return OrderLine(OrderReference(order), SKU("SMALL-TABLE"), quantity)
+
+
+def test_changes_are_only_visible_once_committed() -> None:
+    """Changes should be made to copies, which replace the stored Products on commit."""
+    store = ProductStore()
+    add_batch(store, "b1")
+
+    with InMemoryUnitOfWork(store) as uow:
+        product = uow.products.get("SMALL-TABLE")
+        assert product is not None
+        product.allocate(line("o1"))
+
+        stored = store.get("SMALL-TABLE")
+        assert stored is not None
+        assert stored.batches[0].available() == 10
+
+        uow.commit()
+
+    stored = store.get("SMALL-TABLE")
+    assert stored is not None
+    assert stored.batches[0].available() == 9
+
+
+def test_rolls_back_uncommitted_work() -> None:
+    """Leaving without committing should leave the store as it was."""
+    store = ProductStore()
+    add_batch(store, "b1")
+
+    with InMemoryUnitOfWork(store) as uow:
+        product = uow.products.get("SMALL-TABLE")
+        assert product is not None
+        product.allocate(line("o1"))
+
+    stored = store.get("SMALL-TABLE")
+    assert stored is not None
+    assert stored.version_number == 1
+    assert stored.batches[0].available() == 10
+
+
+def test_concurrent_updates_are_rejected() -> None:
+    """Committing a Product changed by someone else since it was got should fail."""
+    store = ProductStore()
+    add_batch(store, "b1")
+
+    with InMemoryUnitOfWork(store) as uow1, InMemoryUnitOfWork(store) as uow2:
+        product1 = uow1.products.get("SMALL-TABLE")
+        product2 = uow2.products.get("SMALL-TABLE")
+        assert product1 is not None and product2 is not None
+
+        product1.allocate(line("o1"))
+        product2.allocate(line("o2"))
+        uow1.commit()
+
+        with pytest.raises(ConcurrentUpdate):
+            uow2.commit()
+
+    stored = store.get("SMALL-TABLE")
+    assert stored is not None
+    assert stored.allocation_for(OrderReference("o1")) == "b1"
+    assert stored.allocation_for(OrderReference("o2")) is None
+
+
+def test_copies_share_the_batches_they_do_not_change() -> None:
+    """Units of work should only copy the batches they change."""
+    store = ProductStore()
+    add_batch(store, "b1", 1)
+    add_batch(store, "b2")
+    services.allocate(line("o1"), InMemoryUnitOfWork(store))
+    stored = store.get("SMALL-TABLE")
+    assert stored is not None
+
+    with InMemoryUnitOfWork(store) as uow:
+        product = uow.products.get("SMALL-TABLE")
+        assert product is not None
+
+        assert product.deallocate(OrderReference("o1")) == line("o1")
+        assert product.batches[0] is not stored.batches[0]
+        assert product.batches[1] is stored.batches[1]
+        assert stored.allocation_for(OrderReference("o1")) == "b1"
+        uow.commit()
+
+    with InMemoryUnitOfWork(store) as uow:
+        product = uow.products.get("SMALL-TABLE")
+        assert product is not None
+        assert product.allocation_for(OrderReference("o1")) is None
+        assert [batch.available() for batch in product.batches] == [1, 10]
+
+
+def test_copies_of_replaced_products_conflict() -> None:
+    """Looking lines up in a copy of a Product committed by someone else should fail."""
+    store = ProductStore()
+    add_batch(store, "b1")
+
+    with InMemoryUnitOfWork(store) as uow1, InMemoryUnitOfWork(store) as uow2:
+        product1 = uow1.products.get("SMALL-TABLE")
+        product2 = uow2.products.get("SMALL-TABLE")
+        assert product1 is not None and product2 is not None
+
+        product1.allocate(line("o1"))
+        uow1.commit()
+
+        with pytest.raises(ConcurrentUpdate):
+            product2.allocate(line("o2"))
+
+
+def test_services_allocate(tmp_path: Path) -> None:
+    """The service layer should work on top of the in-memory Unit of Work."""
+    store = ProductStore.open(tmp_path / "journal")
+    add_batch(store, "b1", 3)
+    add_batch(store, "b2", 10)
+
+    assert services.allocate(line("o1", 5), InMemoryUnitOfWork(store)) == "b2"
+    assert services.deallocate("o1", "SMALL-TABLE", InMemoryUnitOfWork(store)) == "b2"
+
+    with pytest.raises(services.InvalidSku):
+        services.allocate(
+            OrderLine(OrderReference("o1"), SKU("NO-TABLE"), 1),
+            InMemoryUnitOfWork(store),
+        )
+
+    store.close()
+
+
+def test_replays_the_journal(tmp_path: Path) -> None:
+    """A store opened from a journal should have the Products that were committed."""
+    store = ProductStore.open(tmp_path / "journal")
+    add_batch(store, "b1", 3)
+    add_batch(store, "b2", 10)
+    services.allocate(line("o1", 2), InMemoryUnitOfWork(store))
+    services.allocate(line("o2", 2), InMemoryUnitOfWork(store))
+    services.deallocate("o1", "SMALL-TABLE", InMemoryUnitOfWork(store))
+    store.close()
+
+    committed = store.get("SMALL-TABLE")
+    reopened = ProductStore.open(tmp_path / "journal")
+    product = reopened.get("SMALL-TABLE")
+
+    assert committed is not None and product is not None
+    assert product.version_number == committed.version_number == 5
+    assert [batch.available() for batch in product.batches] == [
+        batch.available() for batch in committed.batches
+    ]
+    assert product.allocation_for(OrderReference("o2")) == committed.allocation_for(
+        OrderReference("o2")
+    )
+    assert product.allocation_for(OrderReference("o1")) is None
+
+    reopened.close()
+
+
+def test_drops_a_torn_commit(tmp_path: Path) -> None:
+    """A commit cut short by a crash should be dropped from the journal."""
+    path = tmp_path / "journal"
+    store = ProductStore.open(path, sync=False)
+    add_batch(store, "b1")
+    store.close()
+
+    with open(path, "a", encoding="utf-8") as journal:
+        journal.write('[{"sku": "SMALL-TABLE", "vers')
+
+    store = ProductStore.open(path, sync=False)
+    services.allocate(line("o1"), InMemoryUnitOfWork(store))
+    store.close()
+
+    product = ProductStore.open(path).get("SMALL-TABLE")
+
+    assert product is not None
+    assert product.allocation_for(OrderReference("o1")) == "b1"
+
+
+def test_refuses_a_corrupt_commit(tmp_path: Path) -> None:
+    """A commit that was written whole but cannot be read should not be cut off."""
+    path = tmp_path / "journal"
+    store = ProductStore.open(path, sync=False)
+    add_batch(store, "b1")
+    add_batch(store, "b2")
+    store.close()
+
+    first, second = path.read_bytes().splitlines(keepends=True)
+    path.write_bytes(b"x" * (len(first) - 1) + b"\n" + second)
+
+    with pytest.raises(CorruptJournal, match="Commit 1"):
+        ProductStore.open(path, sync=False)
+
+    assert path.read_bytes().endswith(second)
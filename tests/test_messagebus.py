@@ -0,0 +1,272 @@
+"""Tests for the message buses."""
+import asyncio
+import queue
+import threading
+import time
+
+import pytest
+
+from cosmic.domain.batch import BatchReference
+from cosmic.domain.events import Deallocated, Event, OutOfStock
+from cosmic.domain.order import SKU, OrderReference
+from cosmic.messagebus import MessageBus, MessageBusClosed, QueuedMessageBus
+
+
+def test_queued_bus_handles_events_on_worker_threads() -> None:
+    """QueuedMessageBus should hand events over to its worker threads."""
+    threads: list[threading.Thread] = []
+
+    with QueuedMessageBus(workers=2) as messagebus:
+        messagebus.add_handler(
+            OutOfStock, lambda _: threads.append(threading.current_thread())
+        )
+        messagebus.handle(OutOfStock(SKU("SKU1")))
+        messagebus.flush()
+
+    assert len(threads) == 1
+    assert threading.current_thread() not in threads
+
+
+def test_queued_bus_isolates_handler_failures() -> None:
+    """A failing handler should not keep the other handlers from running."""
+    handled: list[OutOfStock] = []
+
+    def failing_handler(_: OutOfStock) -> None:
+        raise RuntimeError("Handler failed.")
+
+    with QueuedMessageBus(workers=1) as messagebus:
+        messagebus.add_handler(OutOfStock, failing_handler)
+        messagebus.add_handler(OutOfStock, handled.append)
+        messagebus.handle(OutOfStock(SKU("SKU1")))
+        messagebus.handle(OutOfStock(SKU("SKU2")))
+
+    assert handled == [OutOfStock(SKU("SKU1")), OutOfStock(SKU("SKU2"))]
+
+
+def test_queued_bus_applies_backpressure() -> None:
+    """QueuedMessageBus should refuse events while its queue stays full."""
+    started, release = threading.Event(), threading.Event()
+
+    def blocking_handler(_: OutOfStock) -> None:
+        started.set()
+        release.wait()
+
+    messagebus = QueuedMessageBus(workers=1, max_queue_size=1, put_timeout=0.01)
+    messagebus.add_handler(OutOfStock, blocking_handler)
+
+    try:
+        messagebus.handle(OutOfStock(SKU("SKU1")))
+        started.wait()
+        messagebus.handle(OutOfStock(SKU("SKU2")))  # Waits on the queue.
+
+        with pytest.raises(queue.Full):
+            messagebus.handle(OutOfStock(SKU("SKU3")))
+    finally:
+        release.set()
+        messagebus.shutdown()
+
+
+def test_queued_bus_producers_wait_for_room_without_the_lock() -> None:
+    """A producer waiting on a full queue should not keep others from the lock."""
+    started, release = threading.Event(), threading.Event()
+
+    def blocking_handler(_: OutOfStock) -> None:
+        started.set()
+        release.wait()
+
+    messagebus = QueuedMessageBus(workers=1, max_queue_size=1)
+    messagebus.add_handler(OutOfStock, blocking_handler)
+    messagebus.handle(OutOfStock(SKU("SKU1")))
+    started.wait()
+    messagebus.handle(OutOfStock(SKU("SKU2")))
+    producer = threading.Thread(
+        target=messagebus.handle, args=(OutOfStock(SKU("SKU3")),)
+    )
+    producer.start()
+
+    time.sleep(0.1)  # The producer waits on the queue.
+
+    try:
+        assert producer.is_alive()
+        # pylint: disable=protected-access
+        assert messagebus._lock.acquire(timeout=1)
+        messagebus._lock.release()
+    finally:
+        release.set()
+        producer.join()
+        messagebus.shutdown()
+
+
+def test_queued_bus_drains_on_shutdown() -> None:
+    """QueuedMessageBus should handle queued events before shutting down."""
+    handled: list[OutOfStock] = []
+
+    messagebus = QueuedMessageBus(workers=1)
+    messagebus.add_handler(OutOfStock, handled.append)
+
+    for i in range(10):
+        messagebus.handle(OutOfStock(SKU(f"SKU{i}")))
+
+    messagebus.shutdown()
+
+    assert len(handled) == 10
+
+    with pytest.raises(MessageBusClosed):
+        messagebus.handle(OutOfStock(SKU("SKU10")))
+
+
+def test_queued_bus_handles_events_queued_while_shutting_down() -> None:
+    """An event accepted before the bus shut down should still be handled."""
+    handled: list[OutOfStock] = []
+    event = OutOfStock(SKU("SKU1"))
+    putting = threading.Event()
+
+    messagebus = QueuedMessageBus(workers=1)
+    messagebus.add_handler(OutOfStock, handled.append)
+    # pylint: disable=protected-access
+    put = messagebus._queue.put
+
+    def slow_put(
+        item: Event | None, block: bool = True, timeout: float | None = None
+    ) -> None:
+        if item is event:
+            putting.set()
+            time.sleep(0.1)
+        put(item, block, timeout)
+
+    messagebus._queue.put = slow_put  # type: ignore[method-assign]
+    producer = threading.Thread(target=messagebus.handle, args=(event,))
+    producer.start()
+    putting.wait()
+    messagebus.shutdown()
+    producer.join()
+
+    assert handled == [event]
+
+
+async def test_async_handlers_run_concurrently() -> None:
+    """Handlers of one event should overlap when handled asynchronously."""
+    first_started = asyncio.Event()
+    handled: list[str] = []
+
+    async def first(_: OutOfStock) -> None:
+        first_started.set()
+        await asyncio.sleep(0.01)
+        handled.append("first")
+
+    async def second(_: OutOfStock) -> None:
+        # Only finishes if the first handler runs at the same time.
+        await asyncio.wait_for(first_started.wait(), 1)
+        handled.append("second")
+
+    def blocking(_: OutOfStock) -> None:
+        handled.append(threading.current_thread().name)
+
+    messagebus = MessageBus()
+    messagebus.add_handler(OutOfStock, second)
+    messagebus.add_handler(OutOfStock, first)
+    messagebus.add_handler(OutOfStock, blocking)
+
+    await messagebus.handle_async(OutOfStock(SKU("SKU1")))
+
+    assert {"first", "second"} <= set(handled)
+    assert threading.current_thread().name not in handled
+
+
+async def test_async_handlers_respect_the_concurrency_limit() -> None:
+    """No more than max_concurrency handlers should run at once."""
+    running, peak = 0, 0
+
+    async def handler(_: OutOfStock) -> None:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+
+    messagebus = MessageBus(max_concurrency=2)
+    for _ in range(5):
+        messagebus.add_handler(OutOfStock, handler)
+
+    await messagebus.handle_async(OutOfStock(SKU("SKU1")))
+
+    assert peak == 2
+
+
+async def test_slow_handlers_time_out() -> None:
+    """Handlers that take longer than their timeout should be given up on."""
+    handled: list[OutOfStock] = []
+
+    async def slow(_: OutOfStock) -> None:
+        await asyncio.sleep(10)
+
+    messagebus = MessageBus(handler_timeout=10)
+    messagebus.add_handler(OutOfStock, slow, timeout=0.01)
+    messagebus.add_handler(OutOfStock, handled.append)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await messagebus.handle_async(OutOfStock(SKU("SKU1")))
+
+    assert handled == [OutOfStock(SKU("SKU1"))]
+
+
+def test_sync_handle_runs_handlers_one_after_the_other() -> None:
+    """MessageBus.handle should run plain handlers in order, without timeouts."""
+    handled: list[tuple[str, OutOfStock]] = []
+
+    def slow(event: OutOfStock) -> None:
+        time.sleep(0.05)
+        handled.append(("slow", event))
+
+    def fast(event: OutOfStock) -> None:
+        handled.append(("fast", event))
+
+    messagebus = MessageBus(handler_timeout=0.01)
+    messagebus.add_handler(OutOfStock, slow, timeout=0.01)
+    messagebus.add_handler(OutOfStock, fast)
+    messagebus.handle(OutOfStock(SKU("SKU1")))
+
+    assert handled == [
+        ("slow", OutOfStock(SKU("SKU1"))),
+        ("fast", OutOfStock(SKU("SKU1"))),
+    ]
+
+
+async def test_timeouts_are_per_event_type() -> None:
+    """A handler added for two events should only time out where it was asked to."""
+    handled: list[Event] = []
+
+    def slow(event: Event) -> None:
+        time.sleep(0.05)
+        handled.append(event)
+
+    messagebus = MessageBus()
+    messagebus.add_handler(OutOfStock, slow, timeout=0.01)
+    messagebus.add_handler(Deallocated, slow)
+    deallocated = Deallocated(
+        OrderReference("o1"), SKU("SKU1"), 1, BatchReference("b1")
+    )
+    await messagebus.handle_async(deallocated)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await messagebus.handle_async(OutOfStock(SKU("SKU1")))
+
+    assert handled == [deallocated]
+
+
+def test_sync_handle_runs_coroutine_handlers() -> None:
+    """MessageBus.handle should also run coroutine handlers."""
+    handled: list[OutOfStock] = []
+
+    async def handler(event: OutOfStock) -> None:
+        handled.append(event)
+
+    messagebus = MessageBus()
+    messagebus.add_handler(OutOfStock, handler)
+    messagebus.handle(OutOfStock(SKU("SKU1")))
+
+    with QueuedMessageBus(workers=1) as queued:
+        queued.add_handler(OutOfStock, handler)
+        queued.handle(OutOfStock(SKU("SKU2")))
+
+    assert handled == [OutOfStock(SKU("SKU1")), OutOfStock(SKU("SKU2"))]
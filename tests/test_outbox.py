@@ -0,0 +1,109 @@
+"""Tests for the transactional outbox."""
+from datetime import date
+
+from cosmic.domain.batch import Batch, BatchCandidate, BatchReference
+from cosmic.domain.events import (
+    AllocationRequired,
+    BatchAdded,
+    BatchCreated,
+    OutOfStock,
+)
+from cosmic.domain.order import SKU, OrderCandidate, OrderLine, OrderReference
+from cosmic.domain.product import Product
+from cosmic.messagebus import MessageBus
+from cosmic.serialization import event_from_dict, event_name, event_to_dict
+from cosmic.sqlalchemy.outbox import OutboxRelay, OutboxUnitOfWork
+from cosmic.sqlalchemy.unit_of_work import SessionFactory, SQLAlchemyUnitOfWork
+
+
+def test_events_survive_serialization() -> None:
+    """Events should be rebuilt from their serialized form."""
+    events = [
+        OutOfStock(SKU("SKU1")),
+        BatchCreated(BatchCandidate("batch1", "SKU1", 10, date(2010, 1, 1))),
+        AllocationRequired(OrderCandidate("order1", "SKU1", 3)),
+        BatchAdded(BatchReference("batch1"), SKU("SKU1"), 10, date(2010, 1, 1)),
+    ]
+
+    for event in events:
+        assert event_from_dict(event_name(event), event_to_dict(event)) == event
+
+
+def allocate_out_of_stock(session_factory: SessionFactory, commit: bool) -> None:
+    """Raise an OutOfStock event through an OutboxUnitOfWork."""
+    sku = SKU("TINY-TEAPOT")
+
+    with OutboxUnitOfWork(SQLAlchemyUnitOfWork(session_factory)) as uow:
+        product = Product(sku, [])
+        product.add_batch(Batch(BatchReference("b1"), sku, 1, date(2010, 1, 1)))
+        uow.products.add(product)
+        product.allocate(OrderLine(OrderReference("o1"), sku, 10))
+        if commit:
+            uow.commit()
+
+
+def test_outbox_events_are_dispatched_by_the_relay(
+    session_factory: SessionFactory,
+) -> None:
+    """Committed events should be dispatched once by the relay."""
+    handled: list[OutOfStock] = []
+    messagebus = MessageBus()
+    messagebus.add_handler(OutOfStock, handled.append)
+
+    allocate_out_of_stock(session_factory, commit=True)
+    assert not handled
+
+    relay = OutboxRelay(session_factory, messagebus)
+
+    # The batch that was added is reported as well.
+    assert relay.run_once() == 2
+    assert handled == [OutOfStock(SKU("TINY-TEAPOT"))]
+
+    assert relay.run_once() == 0
+    assert len(handled) == 1
+
+
+def test_outbox_events_are_rolled_back_with_their_changes(
+    session_factory: SessionFactory,
+) -> None:
+    """Events from uncommitted work should not reach the outbox."""
+    handled: list[OutOfStock] = []
+    messagebus = MessageBus()
+    messagebus.add_handler(OutOfStock, handled.append)
+
+    allocate_out_of_stock(session_factory, commit=False)
+
+    assert OutboxRelay(session_factory, messagebus).run_once() == 0
+    assert not handled
+
+
+def test_failing_events_do_not_hold_the_outbox_back(
+    session_factory: SessionFactory,
+) -> None:
+    """An event that keeps failing should end up left alone, after being retried."""
+    handled: list[OutOfStock] = []
+    attempts: list[BatchAdded] = []
+
+    def fail(event: BatchAdded) -> None:
+        attempts.append(event)
+        raise RuntimeError("Handler failed")
+
+    messagebus = MessageBus()
+    messagebus.add_handler(BatchAdded, fail)
+    messagebus.add_handler(OutOfStock, handled.append)
+    allocate_out_of_stock(session_factory, commit=True)
+    relay = OutboxRelay(session_factory, messagebus, max_attempts=2)
+
+    assert relay.run_once() == 2
+    assert handled == [OutOfStock(SKU("TINY-TEAPOT"))]
+
+    assert relay.run_once() == 1
+    assert relay.run_once() == 0
+    assert len(attempts) == 2
+
+    with session_factory() as session:
+        [[event_type, failures]] = session.execute(
+            "SELECT event_type, attempts FROM outbox"
+        )
+
+    assert (event_type, failures) == ("BatchAdded", 2)
@@ -0,0 +1,164 @@
+"""Tests for the repository wrappers."""
+from dataclasses import dataclass, field
+
+import pytest
+
+from cosmic.domain.order import SKU
+from cosmic.domain.product import InvalidSku, Product
+from cosmic.repository import (
+    CachingProductRepository,
+    ProductCache,
+    SkuCheckingProductRepository,
+    SkuIndex,
+)
+
+
+@dataclass
+class FakeVersionedRepository:
+    """Fake repository that counts how many Products it loads."""
+
+    _products: dict[str, Product] = field(default_factory=dict)
+    loads: int = 0
+
+    def add(self, product: Product) -> None:
+        """Add a Product to the repository."""
+        self._products[product.sku] = product
+
+    def get(self, sku: str) -> Product | None:
+        """Load a copy of a Product."""
+        self.loads += 1
+        product = self._products.get(sku)
+        if product is None:
+            return None
+        return Product(product.sku, [], product.version_number)
+
+    def get_version(self, sku: str) -> int | None:
+        """Get the version of a Product."""
+        product = self._products.get(sku)
+        return product.version_number if product else None
+
+
+def use_product(repository: FakeVersionedRepository, cache: ProductCache, sku: str):
+    """Get a Product through a caching repository and commit it."""
+    caching = CachingProductRepository(repository, cache)
+    product = caching.get(sku)
+    caching.mark_committed()
+    caching.release()
+    return product
+
+
+def test_cache_reuses_fresh_products() -> None:
+    """Products whose version did not change should be reused."""
+    repository = FakeVersionedRepository()
+    repository.add(Product(SKU("SKU1"), [], version_number=3))
+    cache = ProductCache()
+
+    first = use_product(repository, cache, "SKU1")
+    second = use_product(repository, cache, "SKU1")
+
+    assert first is second
+    assert repository.loads == 1
+    assert (cache.hits, cache.misses, cache.stale) == (1, 1, 0)
+
+
+def test_cache_reloads_stale_products() -> None:
+    """Products whose version changed should be loaded again."""
+    repository = FakeVersionedRepository()
+    stored = Product(SKU("SKU1"), [], version_number=3)
+    repository.add(stored)
+    cache = ProductCache()
+
+    first = use_product(repository, cache, "SKU1")
+    stored.version_number += 1
+    second = use_product(repository, cache, "SKU1")
+
+    assert first is not second
+    assert repository.loads == 2
+    assert (cache.hits, cache.misses, cache.stale) == (0, 2, 1)
+
+
+def test_cache_does_not_keep_uncommitted_products() -> None:
+    """Products changed after the last commit should not be cached."""
+    repository = FakeVersionedRepository()
+    repository.add(Product(SKU("SKU1"), []))
+    cache = ProductCache()
+
+    caching = CachingProductRepository(repository, cache)
+    product = caching.get("SKU1")
+    assert product is not None
+    product.version_number += 1
+    caching.release()
+
+    assert not cache
+
+
+def test_cache_evicts_least_recently_used_products() -> None:
+    """ProductCache should keep at most max_size Products."""
+    cache = ProductCache(max_size=2)
+
+    for sku in ["SKU1", "SKU2", "SKU3"]:
+        cache.put(Product(SKU(sku), []))
+
+    assert len(cache) == 2
+    assert cache.take("SKU1") is None
+    assert cache.take("SKU3") is not None
+
+
+@dataclass
+class FakeClock:
+    """A clock that only moves when told to."""
+
+    now: float = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_missing_skus_are_not_looked_up_again_until_they_expire() -> None:
+    """SKUs that were not found should only be looked up again after the TTL."""
+    repository = FakeVersionedRepository()
+    clock = FakeClock()
+    checking = SkuCheckingProductRepository(repository, SkuIndex(ttl=10, clock=clock))
+
+    assert checking.get("SKU1") is None
+    assert checking.get("SKU1") is None
+    assert repository.loads == 1
+
+    # Added by another process.
+    repository.add(Product(SKU("SKU1"), []))
+    clock.now = 10
+
+    assert checking.get("SKU1") is not None
+    assert repository.loads == 2
+
+
+def test_added_skus_are_no_longer_missing() -> None:
+    """Adding a Product should forget that its SKU was missing."""
+    repository = FakeVersionedRepository()
+    index = SkuIndex(max_missing=2)
+    checking = SkuCheckingProductRepository(repository, index)
+
+    for sku in ["SKU1", "SKU2", "SKU3"]:
+        checking.get(sku)
+
+    assert not index.is_missing("SKU1")
+    assert index.is_missing("SKU2")
+
+    checking.add(Product(SKU("SKU2"), []))
+
+    assert not index.is_missing("SKU2")
+    assert checking.get("SKU2") is not None
+
+
+def test_known_skus_are_never_missing() -> None:
+    """SKUs known to exist should not be remembered as missing."""
+    index = SkuIndex()
+    index.add(["SKU1"])
+    index.mark_missing("SKU1")
+    index.mark_missing("SKU2")
+
+    assert not index.is_missing("SKU1")
+    index.check("SKU1")
+
+    with pytest.raises(InvalidSku, match="Invalid sku SKU2"):
+        index.check("SKU2")
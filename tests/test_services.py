@@ -6,7 +6,7 @@ import pytest
 
 from cosmic.domain.batch import Batch, BatchReference
 from cosmic.domain.order import SKU, OrderLine, OrderReference
-from cosmic.domain.product import Product
+from cosmic.domain.product import ConcurrentUpdate, Product
 from cosmic.service_layer import services
 from cosmic.service_layer.unit_of_work import UnitOfWork
 
@@ -81,6 +81,26 @@ class FakeUnitOfWork(UnitOfWork):
         return self.commit_count > 0
 
 
+@dataclass
+class ConflictingUnitOfWork(FakeUnitOfWork):
+    """Fake Unit of Work whose first commits conflict with concurrent updates."""
+
+    conflicts: int = 0
+
+    def commit(self):
+        """Record a commit, or fail while there are conflicts left."""
+        if self.conflicts:
+            self.conflicts -= 1
+            raise ConcurrentUpdate("Product was changed concurrently.")
+        super().commit()
+
+
+@pytest.fixture
+def no_retry_delay(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Do not wait between retries."""
+    monkeypatch.setattr(services, "RETRY_BASE_DELAY", 0)
+
+
 def test_returns_allocation() -> None:
     """services.allocate should return the batch reference."""
     uow = FakeUnitOfWork()
@@ -141,3 +161,150 @@ def test_add_batch() -> None:
     assert len(product.batches) == 1
     assert product.batches[0].reference == BatchReference("b1")
     assert uow.committed
+
+
+def test_allocate_retries_on_concurrent_updates(no_retry_delay: None) -> None:
+    """services.allocate should retry allocations that conflicted."""
+    uow = ConflictingUnitOfWork()
+
+    services.add_batch(
+        services.BatchCandidate("b1", "RUSTY-SOAPDISH", 100, date(2010, 1, 1)), uow
+    )
+
+    uow.conflicts = 2
+    line = OrderLine(OrderReference("o1"), SKU("RUSTY-SOAPDISH"), 10)
+
+    assert services.allocate(line, uow) == "b1"
+    assert uow.commit_count == 2
+
+
+def test_allocate_gives_up_after_max_attempts(no_retry_delay: None) -> None:
+    """services.allocate should raise if every attempt conflicted."""
+    uow = ConflictingUnitOfWork()
+
+    services.add_batch(
+        services.BatchCandidate("b1", "RUSTY-SOAPDISH", 100, date(2010, 1, 1)), uow
+    )
+
+    uow.conflicts = 3
+    line = OrderLine(OrderReference("o1"), SKU("RUSTY-SOAPDISH"), 10)
+
+    with pytest.raises(ConcurrentUpdate):
+        services.allocate(line, uow, max_attempts=3)
+
+    assert uow.commit_count == 1
+
+
+def test_allocate_many_reports_results_per_line() -> None:
+    """services.allocate_many should allocate lines and report failures per line."""
+    uow = FakeUnitOfWork()
+
+    services.add_batch(
+        services.BatchCandidate("b1", "BLUE-VASE", 10, date(2010, 1, 1)), uow
+    )
+    services.add_batch(
+        services.BatchCandidate("b2", "RED-VASE", 10, date(2010, 1, 1)), uow
+    )
+
+    lines = [
+        OrderLine(OrderReference("o1"), SKU("BLUE-VASE"), 6),
+        OrderLine(OrderReference("o2"), SKU("RED-VASE"), 6),
+        OrderLine(OrderReference("o3"), SKU("BLUE-VASE"), 6),
+        OrderLine(OrderReference("o4"), SKU("GREEN-VASE"), 1),
+        OrderLine(OrderReference("o1"), SKU("BLUE-VASE"), 2),
+    ]
+
+    results = services.allocate_many(lines, uow)
+
+    assert [result.line for result in results] == lines
+    assert [result.batchref for result in results] == ["b1", "b2", None, None, None]
+    assert isinstance(results[2].error, services.OutOfStock)
+    assert isinstance(results[3].error, services.InvalidSku)
+    assert isinstance(results[4].error, services.AlreadyAllocated)
+
+
+def test_allocate_many_commits_once_per_chunk() -> None:
+    """services.allocate_many should commit once for every chunk of lines."""
+    uow = FakeUnitOfWork()
+
+    services.add_batch(
+        services.BatchCandidate("b1", "BLUE-VASE", 100, date(2010, 1, 1)), uow
+    )
+
+    lines = [OrderLine(OrderReference(f"o{i}"), SKU("BLUE-VASE"), 1) for i in range(5)]
+
+    services.allocate_many(lines, uow, chunk_size=2)
+
+    assert uow.commit_count == 1 + 3
+
+
+def test_allocate_many_reports_conflicts_per_line(no_retry_delay: None) -> None:
+    """services.allocate_many should report the lines of conflicting chunks."""
+    uow = ConflictingUnitOfWork()
+    services.add_batch(
+        services.BatchCandidate("b1", "BLUE-VASE", 100, date(2010, 1, 1)), uow
+    )
+    uow.conflicts = 1
+    lines = [OrderLine(OrderReference(f"o{i}"), SKU("BLUE-VASE"), 1) for i in range(4)]
+
+    results = services.allocate_many(lines, uow, chunk_size=2, max_attempts=1)
+
+    assert [result.line for result in results] == lines
+    assert [result.batchref for result in results] == [None, None, "b1", "b1"]
+    assert isinstance(results[0].error, ConcurrentUpdate)
+    assert isinstance(results[1].error, ConcurrentUpdate)
+    assert uow.commit_count == 2
+
+
+def test_deallocate_frees_the_order_line() -> None:
+    """services.deallocate should deallocate the line of an order."""
+    uow = FakeUnitOfWork()
+
+    services.add_batch(
+        services.BatchCandidate("b1", "SHAGGY-RUG", 10, date(2010, 1, 1)), uow
+    )
+    services.allocate(OrderLine(OrderReference("o1"), SKU("SHAGGY-RUG"), 10), uow)
+
+    assert services.deallocate("o1", "SHAGGY-RUG", uow) == "b1"
+    assert uow.commit_count == 3
+
+    with pytest.raises(services.NotAllocated, match="Order o1 has no allocation"):
+        services.deallocate("o1", "SHAGGY-RUG", uow)
+
+    with pytest.raises(services.InvalidSku):
+        services.deallocate("o1", "NO-RUG", uow)
+
+
+def test_reallocate_replaces_the_order_line() -> None:
+    """services.reallocate should move an order to a batch that fits its new line."""
+    uow = FakeUnitOfWork()
+
+    services.add_batch(
+        services.BatchCandidate("b1", "SHAGGY-RUG", 10, date(2010, 1, 1)), uow
+    )
+    services.add_batch(
+        services.BatchCandidate("b2", "SHAGGY-RUG", 20, date(2010, 1, 2)), uow
+    )
+    services.allocate(OrderLine(OrderReference("o1"), SKU("SHAGGY-RUG"), 5), uow)
+
+    line = OrderLine(OrderReference("o1"), SKU("SHAGGY-RUG"), 15)
+
+    assert services.reallocate(line, uow) == "b2"
+
+    product = uow.products.get("SHAGGY-RUG")
+    assert product is not None
+    assert [batch.available() for batch in product.batches] == [10, 5]
+
+
+def test_reallocate_requires_an_existing_allocation() -> None:
+    """services.reallocate should not allocate orders that were never allocated."""
+    uow = FakeUnitOfWork()
+
+    services.add_batch(
+        services.BatchCandidate("b1", "SHAGGY-RUG", 10, date(2010, 1, 1)), uow
+    )
+
+    with pytest.raises(services.NotAllocated):
+        services.reallocate(OrderLine(OrderReference("o1"), SKU("SHAGGY-RUG"), 5), uow)
+
+    assert uow.commit_count == 1
@@ -0,0 +1,121 @@
+"""Tests for the sharded allocator."""
+# pylint: disable=redefined-outer-name
+from concurrent.futures import Future, wait
+from datetime import date
+from pathlib import Path
+from threading import Thread
+from typing import Iterator
+
+import pytest
+
+from cosmic.domain.events import AllocationRequired
+from cosmic.domain.order import SKU, OrderCandidate, OrderLine, OrderReference
+from cosmic.memory.repository import ProductStore
+from cosmic.memory.unit_of_work import InMemoryUnitOfWork
+from cosmic.service_layer import services
+from cosmic.service_layer.sharding import AllocatorClosed, ShardedAllocator, shard_of
+from cosmic.sqlalchemy.database import Database
+from cosmic.sqlalchemy.unit_of_work import SessionFactory, SQLAlchemyUnitOfWork
+
+
+@pytest.fixture
+def session_factory(start_mappings: None, tmp_path: Path) -> Iterator[SessionFactory]:
+    """Get sessions on a database file, which workers can use concurrently."""
+    from cosmic.sqlalchemy.mappings import create_schema
+
+    database = Database.from_url(f"sqlite:///{tmp_path}/cosmic.db")
+    create_schema(database.engine)
+    yield database.sessions
+    database.dispose()
+
+
+def test_shards_are_stable() -> None:
+    """A SKU should always belong to the same shard."""
+    assert shard_of("RED-CHAIR", 8) == shard_of("RED-CHAIR", 8)
+    assert {shard_of(f"SKU-{i}", 4) for i in range(100)} == {0, 1, 2, 3}
+
+
+def test_allocator_allocates_lines_of_every_sku(
+    session_factory: SessionFactory,
+) -> None:
+    """The allocator should allocate every line and report failures per line."""
+    skus = [SKU(f"LAMP-{i}") for i in range(6)]
+
+    for sku in skus:
+        services.add_batch(
+            services.BatchCandidate(f"{sku}-batch", sku, 10, date(2010, 1, 1)),
+            SQLAlchemyUnitOfWork(session_factory),
+        )
+
+    with ShardedAllocator(
+        lambda: SQLAlchemyUnitOfWork(session_factory), shards=3
+    ) as allocator:
+        futures = [
+            allocator.submit(OrderLine(OrderReference(f"o{i}"), sku, 1))
+            for sku in skus
+            for i in range(10)
+        ]
+        out_of_stock = allocator.submit(OrderLine(OrderReference("o10"), skus[0], 1))
+        invalid = allocator.submit(OrderLine(OrderReference("o1"), SKU("NOPE"), 1))
+
+        wait(futures)
+
+        assert [future.result() for future in futures] == [
+            f"{sku}-batch" for sku in skus for _ in range(10)
+        ]
+
+        with pytest.raises(services.OutOfStock):
+            out_of_stock.result()
+
+        with pytest.raises(services.InvalidSku):
+            invalid.result()
+
+    with pytest.raises(AllocatorClosed):
+        allocator.submit(OrderLine(OrderReference("o11"), skus[0], 1))
+
+
+def test_allocator_handles_allocation_required_events(
+    session_factory: SessionFactory,
+) -> None:
+    """The allocator should allocate lines from AllocationRequired events."""
+    services.add_batch(
+        services.BatchCandidate("b1", "BIG-LAMP", 10, date(2010, 1, 1)),
+        SQLAlchemyUnitOfWork(session_factory),
+    )
+
+    with ShardedAllocator(lambda: SQLAlchemyUnitOfWork(session_factory)) as allocator:
+        allocator.handle(AllocationRequired(OrderCandidate("o1", "BIG-LAMP", 4)))
+
+    with SQLAlchemyUnitOfWork(session_factory) as uow:
+        product = uow.products.get("BIG-LAMP")
+        assert product is not None
+        assert product.batches[0].available() == 6
+
+
+def test_lines_submitted_while_shutting_down_are_allocated_or_rejected() -> None:
+    """Every line submitted while the allocator shuts down should get a result."""
+    store = ProductStore()
+    services.add_batch(
+        services.BatchCandidate("b1", "BIG-LAMP", 1000, date(2010, 1, 1)),
+        InMemoryUnitOfWork(store),
+    )
+    allocator = ShardedAllocator(lambda: InMemoryUnitOfWork(store), shards=2)
+    futures: "list[Future[str]]" = []
+
+    def submit() -> None:
+        for i in range(200):
+            try:
+                futures.append(
+                    allocator.submit(
+                        OrderLine(OrderReference(f"o{i}"), SKU("BIG-LAMP"), 1)
+                    )
+                )
+            except AllocatorClosed:
+                return
+
+    submitter = Thread(target=submit)
+    submitter.start()
+    allocator.shutdown()
+    submitter.join()
+
+    assert all(future.done() for future in futures)
@@ -0,0 +1,69 @@
+"""Tests for the allocation simulator."""
+import random
+from datetime import date, timedelta
+
+import pytest
+
+from cosmic.domain.batch import Batch, BatchReference, allocate
+from cosmic.domain.order import SKU, OrderLine, OrderReference
+
+pytest.importorskip("numpy")
+
+# pylint: disable=wrong-import-position
+from cosmic.simulation import OUT_OF_STOCK, simulate  # noqa: E402
+
+
+def test_allocates_to_the_earliest_batch_that_fits() -> None:
+    """Lines should skip batches without enough stock, and later ones use them."""
+    result = simulate(
+        ["LAMP", "LAMP", "CHAIR"],
+        [5, 10, 1],
+        [date(2010, 1, 2), date(2010, 1, 1), date(2010, 1, 1)],
+        ["LAMP", "LAMP", "CHAIR", "LAMP", "LAMP", "CHAIR"],
+        [8, 4, 1, 3, 2, 1],
+    )
+
+    assert result.batches.tolist() == [1, 0, 2, OUT_OF_STOCK, 1, OUT_OF_STOCK]
+    assert result.available.tolist() == [1, 0, 0]
+
+
+@pytest.mark.parametrize("window_size", [1024, 7])
+@pytest.mark.parametrize("seed", range(5))
+def test_matches_the_domain(
+    seed: int, window_size: int, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """The simulator should allocate every line where the domain would."""
+    monkeypatch.setattr("cosmic.simulation.WINDOW_SIZE", window_size)
+    rng = random.Random(seed)
+    skus = [f"SKU-{i}" for i in range(5)]
+    batches = [
+        Batch(
+            BatchReference(f"b{i}"),
+            SKU(rng.choice(skus)),
+            rng.randint(0, 50),
+            date(2010, 1, 1) + timedelta(days=rng.randint(0, 10)),
+        )
+        for i in range(40)
+    ]
+    lines = [
+        OrderLine(OrderReference(f"o{i}"), SKU(rng.choice(skus)), rng.randint(1, 12))
+        for i in range(3000)
+    ]
+
+    result = simulate(
+        [batch.sku for batch in batches],
+        [batch.available() for batch in batches],
+        [batch.eta for batch in batches],
+        [line.sku for line in lines],
+        [line.quantity for line in lines],
+    )
+
+    positions = {batch.reference: i for i, batch in enumerate(batches)}
+    expected = []
+
+    for line in lines:
+        batchref = allocate(line, batches)
+        expected.append(OUT_OF_STOCK if batchref is None else positions[batchref])
+
+    assert result.batches.tolist() == expected
+    assert result.available.tolist() == [batch.available() for batch in batches]
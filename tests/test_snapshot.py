@@ -0,0 +1,144 @@
+"""Tests for the columnar snapshots of Products."""
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from cosmic.domain.batch import Batch, BatchCandidate, BatchReference
+from cosmic.domain.order import SKU, OrderLine, OrderReference
+from cosmic.domain.product import Product
+from cosmic.memory.repository import ProductStore
+from cosmic.memory.unit_of_work import InMemoryUnitOfWork
+from cosmic.service_layer import services
+from cosmic.snapshot import (
+    ReadOnlyRepository,
+    Snapshot,
+    SnapshotProductRepository,
+    write_snapshot,
+)
+from cosmic.sqlalchemy.export import iter_products
+from cosmic.sqlalchemy.unit_of_work import SessionFactory, SQLAlchemyUnitOfWork
+
+
+def state(product: Product) -> list[tuple[str, date, int, set[OrderLine]]]:
+    """Get the batches of a Product and what is allocated to them."""
+    return [
+        (batch.reference, batch.eta, batch.available(), set(batch.allocated_lines))
+        for batch in product.batches
+    ]
+
+
+def test_exported_products_are_rebuilt(
+    session_factory: SessionFactory, tmp_path: Path
+) -> None:
+    """Products exported from the database should be rebuilt from the snapshot."""
+
+    def make_uow() -> SQLAlchemyUnitOfWork:
+        return SQLAlchemyUnitOfWork(session_factory)
+
+    for reference, sku, eta in [
+        ("b1", "WHITE-SOFA", 2),
+        ("b2", "WHITE-SOFA", 1),
+        ("b3", "BLACK-SOFA", 1),
+        ("b4", "EMPTY-SOFA", 1),
+    ]:
+        services.add_batch(
+            BatchCandidate(reference, sku, 10, date(2010, 1, eta)), make_uow()
+        )
+
+    for order, sku, quantity in [("o1", "WHITE-SOFA", 10), ("o2", "WHITE-SOFA", 3)]:
+        services.allocate(
+            OrderLine(OrderReference(order), SKU(sku), quantity), make_uow()
+        )
+
+    assert write_snapshot(tmp_path, iter_products(session_factory, chunk_size=2)) == 3
+
+    snapshot = Snapshot.open(tmp_path)
+    repository = SnapshotProductRepository(snapshot)
+
+    assert list(snapshot.skus()) == ["BLACK-SOFA", "EMPTY-SOFA", "WHITE-SOFA"]
+
+    with make_uow() as uow:
+        for sku in snapshot.skus():
+            expected = uow.products.get(sku)
+            product = repository.get(sku)
+
+            assert expected is not None and product is not None
+            assert state(product) == state(expected)
+            assert product.version_number == expected.version_number
+            assert repository.get_version(sku) == expected.version_number
+
+    assert repository.get("NO-SOFA") is None
+    assert repository.get_version("NO-SOFA") is None
+
+    with pytest.raises(ReadOnlyRepository):
+        repository.add(Product(SKU("NO-SOFA"), []))
+
+    snapshot.close()
+
+
+def test_products_are_exported_in_code_point_order(
+    session_factory: SessionFactory,
+) -> None:
+    """Products should be exported sorted by SKU the way Python sorts strings."""
+    skus = ["b-sofa", "A-SOFA", "C-SOFA", "a-sofa", "Ä-SOFA"]
+
+    for i, sku in enumerate(skus):
+        services.add_batch(
+            BatchCandidate(f"b{i}", sku, 10, date(2010, 1, 1)),
+            SQLAlchemyUnitOfWork(session_factory),
+        )
+
+    exported = [product.sku for product in iter_products(session_factory, chunk_size=2)]
+
+    assert exported == sorted(skus)
+
+
+def test_products_must_be_sorted(tmp_path: Path) -> None:
+    """Writing Products out of order should fail, as they could not be found."""
+    with pytest.raises(ValueError, match="out of order"):
+        write_snapshot(tmp_path, [Product(SKU("B"), []), Product(SKU("A"), [])])
+
+
+def test_snapshots_are_never_overwritten(tmp_path: Path) -> None:
+    """Writing over a snapshot should fail, leaving it readable where it is mapped."""
+    batch = Batch(BatchReference("b1"), SKU("RED-SOFA"), 10, date(2010, 1, 1))
+    write_snapshot(tmp_path / "snapshot", [Product(SKU("RED-SOFA"), [batch], 3)])
+    snapshot = Snapshot.open(tmp_path / "snapshot")
+
+    with pytest.raises(FileExistsError):
+        write_snapshot(tmp_path / "snapshot", [Product(SKU("BLUE-SOFA"), [])])
+
+    with pytest.raises(ValueError):
+        write_snapshot(
+            tmp_path / "other", [Product(SKU("B"), []), Product(SKU("A"), [])]
+        )
+
+    assert snapshot.version("RED-SOFA") == 3
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["snapshot"]
+    snapshot.close()
+
+
+def test_stores_start_from_snapshots(tmp_path: Path) -> None:
+    """A store should build Products from its snapshot, and journal the changes."""
+    batch = Batch(BatchReference("b1"), SKU("RED-SOFA"), 10, date(2010, 1, 1))
+    batch.allocate(OrderLine(OrderReference("o1"), SKU("RED-SOFA"), 4))
+    write_snapshot(tmp_path / "snapshot", [Product(SKU("RED-SOFA"), [batch], 7)])
+
+    snapshot = Snapshot.open(tmp_path / "snapshot")
+    store = ProductStore.open(tmp_path / "journal", snapshot=snapshot)
+    line = OrderLine(OrderReference("o2"), SKU("RED-SOFA"), 5)
+    services.allocate(line, InMemoryUnitOfWork(store))
+    store.close()
+
+    reopened = ProductStore.open(tmp_path / "journal", snapshot=snapshot)
+    product = reopened.get("RED-SOFA")
+
+    assert product is not None
+    assert product.version_number == 8
+    assert product.batches[0].available() == 1
+    assert product.allocation_for(OrderReference("o1")) == "b1"
+    assert product.allocation_for(OrderReference("o2")) == "b1"
+
+    reopened.close()
+    snapshot.close()
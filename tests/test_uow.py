@@ -1,11 +1,21 @@
 """Tests for the Unit of Work implementation."""
+from contextlib import contextmanager
 from datetime import date
+from typing import Iterator
 
 import pytest
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from cosmic.domain.batch import BatchCandidate, BatchReference
+from cosmic.domain.batch import Batch, BatchCandidate, BatchReference
 from cosmic.domain.order import SKU, OrderLine, OrderReference
+from cosmic.domain.product import ConcurrentUpdate, Product
+from cosmic.repository import ProductCache, SkuIndex
+from cosmic.service_layer import services
+from cosmic.sqlalchemy.mappings import batches_reference_index, violates
+from cosmic.sqlalchemy.repository import LoadStrategy, SQLAlchemyProductRepository
 from cosmic.sqlalchemy.unit_of_work import SessionFactory, SQLAlchemyUnitOfWork
 
 
@@ -50,6 +60,24 @@ def get_allocated_batch_ref(
     return BatchReference(batchref)
 
 
+@contextmanager
+def count_selects(engine: Engine) -> Iterator[list[str]]:
+    """Collect the SELECT statements issued on an engine."""
+    statements: list[str] = []
+
+    def before_cursor_execute(  # pylint: disable=too-many-arguments
+        _conn, _cursor, statement, _parameters, _context, _executemany
+    ) -> None:
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
 def test_uow_can_retrieve_a_batch_and_allocate_to_it(
     session_factory: SessionFactory,
 ) -> None:
@@ -73,6 +101,188 @@ def test_uow_can_retrieve_a_batch_and_allocate_to_it(
     assert batchref == "batch1"
 
 
+def test_uow_persists_the_allocated_quantity(
+    session_factory: SessionFactory,
+) -> None:
+    """UoW should persist the running allocated quantity of a batch."""
+    session = session_factory()
+
+    insert_batch(
+        session, BatchCandidate("batch1", "SHINY-ANVIL", 100, date(2010, 1, 1))
+    )
+
+    session.commit()
+
+    with SQLAlchemyUnitOfWork(session_factory) as uow:
+        product = uow.products.get(sku="SHINY-ANVIL")
+        assert product is not None
+        product.allocate(OrderLine(OrderReference("o1"), SKU("SHINY-ANVIL"), 10))
+        product.allocate(OrderLine(OrderReference("o2"), SKU("SHINY-ANVIL"), 15))
+        uow.commit()
+
+    [[allocated_quantity]] = session.execute(
+        "SELECT allocated_quantity FROM batches WHERE reference=:ref",
+        {"ref": "batch1"},
+    )
+    assert allocated_quantity == 25
+
+    with SQLAlchemyUnitOfWork(session_factory) as uow:
+        product = uow.products.get(sku="SHINY-ANVIL")
+        assert product is not None
+        assert product.batches[0].available() == 75
+
+
+@pytest.mark.parametrize(
+    "strategy, expected_selects",
+    # Each includes looking up whether the order was already allocated.
+    [
+        (LoadStrategy.SELECTIN, 4),
+        (LoadStrategy.JOINED, 2),
+        (LoadStrategy.COUNTERS, 4),
+    ],
+)
+@pytest.mark.parametrize("batch_count", [2, 8])
+def test_allocation_issues_a_fixed_number_of_selects(
+    test_db_engine: Engine,
+    session_factory: SessionFactory,
+    strategy: LoadStrategy,
+    expected_selects: int,
+    batch_count: int,
+) -> None:
+    """Loading and allocating on a Product should not issue one query per batch."""
+    sku = SKU("CHUNKY-CHESS-SET")
+
+    with SQLAlchemyUnitOfWork(session_factory) as uow:
+        uow.products.add(Product(sku, []))
+        product = uow.products.get(sku)
+        assert product is not None
+        for i in range(batch_count):
+            product.add_batch(
+                Batch(BatchReference(f"batch{i}"), sku, 10, date(2010, 1, i + 1))
+            )
+            product.allocate(OrderLine(OrderReference(f"o{i}"), sku, 10))
+        product.add_batch(Batch(BatchReference("spare"), sku, 10, date(2011, 1, 1)))
+        uow.commit()
+
+    with count_selects(test_db_engine) as selects:
+        with SQLAlchemyUnitOfWork(session_factory, strategy) as uow:
+            product = uow.products.get(sku)
+            assert product is not None
+            product.allocate(OrderLine(OrderReference("new-order"), sku, 1))
+            uow.commit()
+
+    assert len(selects) == expected_selects
+
+
+def test_repeated_allocations_do_not_load_allocated_lines(
+    test_db_engine: Engine, session_factory: SessionFactory
+) -> None:
+    """Allocating a line again should only look its order up, not load every line."""
+    sku = SKU("CHUNKY-CHESS-SET")
+
+    for reference in ["batch1", "batch2"]:
+        services.add_batch(
+            BatchCandidate(reference, sku, 10, date(2010, 1, 1)),
+            SQLAlchemyUnitOfWork(session_factory),
+        )
+
+    for other in range(5):
+        services.allocate(
+            OrderLine(OrderReference(f"other{other}"), sku, 1),
+            SQLAlchemyUnitOfWork(session_factory),
+        )
+
+    batchref = services.allocate(
+        OrderLine(OrderReference("o1"), sku, 1), SQLAlchemyUnitOfWork(session_factory)
+    )
+    line = OrderLine(OrderReference("o1"), sku, 1)
+
+    with count_selects(test_db_engine) as selects:
+        with SQLAlchemyUnitOfWork(session_factory, LoadStrategy.COUNTERS) as uow:
+            product = uow.products.get(sku)
+            assert product is not None
+            version = product.version_number
+
+            assert product.allocate(line) == batchref
+            assert product.version_number == version
+
+    # The Product, its batches and the order.
+    assert len(selects) == 3
+
+
+def test_uow_reuses_cached_products(
+    test_db_engine: Engine, session_factory: SessionFactory
+) -> None:
+    """UoW should not load the Products it has cached again."""
+    sku = SKU("COSY-RUG")
+    cache = ProductCache()
+
+    with SQLAlchemyUnitOfWork(session_factory, product_cache=cache) as uow:
+        added = Product(sku, [])
+        added.add_batch(Batch(BatchReference("b1"), sku, 100, date(2010, 1, 1)))
+        uow.products.add(added)
+        uow.commit()
+
+    with count_selects(test_db_engine) as selects:
+        with SQLAlchemyUnitOfWork(session_factory, product_cache=cache) as uow:
+            product = uow.products.get(sku)
+            assert product is not None
+            product.allocate(OrderLine(OrderReference("o1"), sku, 10))
+            uow.commit()
+
+    assert len(selects) == 2  # The version check and the lookup of the order.
+    assert cache.hits == 1
+
+    with SQLAlchemyUnitOfWork(session_factory) as uow:
+        product = uow.products.get(sku)
+        assert product is not None
+        product.allocate(OrderLine(OrderReference("o2"), sku, 10))
+        uow.commit()
+
+    with SQLAlchemyUnitOfWork(session_factory, product_cache=cache) as uow:
+        product = uow.products.get(sku)
+        assert product is not None
+        assert product.batches[0].available() == 80
+
+    assert cache.stale == 1
+
+
+def test_batch_references_are_unique(session_factory: SessionFactory) -> None:
+    """Two batches should not share a reference."""
+    sku = SKU("TWIN-LAMP")
+
+    with pytest.raises(IntegrityError) as error:
+        with SQLAlchemyUnitOfWork(session_factory) as uow:
+            product = Product(sku, [])
+            product.add_batch(Batch(BatchReference("b1"), sku, 1, date(2010, 1, 1)))
+            product.add_batch(Batch(BatchReference("b1"), sku, 1, date(2010, 1, 2)))
+            uow.products.add(product)
+            uow.commit()
+
+    assert violates(error.value, batches_reference_index)
+
+
+def test_products_added_concurrently_conflict(session_factory: SessionFactory) -> None:
+    """Adding a Product someone else added first should be a concurrent update."""
+    sku = SKU("TWIN-LAMP")
+
+    with SQLAlchemyUnitOfWork(session_factory) as uow1, SQLAlchemyUnitOfWork(
+        session_factory
+    ) as uow2:
+        for uow, reference in [(uow1, "b1"), (uow2, "b2")]:
+            assert uow.products.get(sku) is None
+            product = Product(sku, [])
+            product.add_batch(
+                Batch(BatchReference(reference), sku, 1, date(2010, 1, 1))
+            )
+            uow.products.add(product)
+
+        uow1.commit()
+
+        with pytest.raises(ConcurrentUpdate):
+            uow2.commit()
+
+
 def test_rolls_back_uncommitted_work_by_default(
     session_factory: SessionFactory,
 ) -> None:
@@ -111,6 +321,45 @@ def test_rolls_back_on_error(session_factory: SessionFactory) -> None:
     assert not rows
 
 
+def test_concurrent_updates_raise_a_conflict(session_factory: SessionFactory):
+    """Committing a Product changed since it was loaded should conflict."""
+    sku = SKU("PRODUCT1")
+    session = session_factory()
+
+    insert_batch(session, BatchCandidate("BATCH1", sku, 100, eta=date(2022, 1, 1)))
+    session.commit()
+
+    line1 = OrderLine(OrderReference("ORDER1"), sku, 1)
+    line2 = OrderLine(OrderReference("ORDER2"), sku, 1)
+
+    with (
+        SQLAlchemyUnitOfWork(session_factory) as uow1,
+        SQLAlchemyUnitOfWork(session_factory) as uow2,
+    ):
+        product1 = uow1.products.get(sku)
+        assert product1 is not None
+
+        product2 = uow2.products.get(sku)
+        assert product2 is not None
+
+        product1.allocate(line1)
+        product2.allocate(line2)
+
+        uow1.commit()
+
+        with pytest.raises(ConcurrentUpdate):
+            uow2.commit()
+
+    [[version]] = session.execute(
+        "SELECT version_number FROM products WHERE sku=:sku",
+        {"sku": sku},
+    )
+    assert version == 1
+
+    [[allocated]] = session.execute("SELECT count(*) FROM allocations")
+    assert allocated == 1
+
+
 @pytest.mark.skip("Requires postgres.")
 def test_concurrent_updates_to_version_are_not_allowed(
     postgres_session_factory: SessionFactory,
@@ -164,3 +413,61 @@ def test_concurrent_updates_to_version_are_not_allowed(
 
     with SQLAlchemyUnitOfWork(postgres_session_factory) as uow:
         uow.session.execute("select 1")
+
+
+def test_uow_persists_reallocations(session_factory: SessionFactory) -> None:
+    """UoW should move an order between batches, keeping allocations unique."""
+    for candidate in [
+        BatchCandidate("batch1", "OLD-CLOCK", 10, date(2010, 1, 1)),
+        BatchCandidate("batch2", "OLD-CLOCK", 20, date(2010, 1, 2)),
+    ]:
+        services.add_batch(candidate, SQLAlchemyUnitOfWork(session_factory))
+
+    def find_allocation(order: str) -> str | None:
+        with SQLAlchemyUnitOfWork(session_factory) as uow:
+            assert isinstance(uow.products, SQLAlchemyProductRepository)
+            return uow.products.find_allocation(OrderReference(order), "OLD-CLOCK")
+
+    services.allocate(
+        OrderLine(OrderReference("o1"), SKU("OLD-CLOCK"), 5),
+        SQLAlchemyUnitOfWork(session_factory),
+    )
+    assert find_allocation("o1") == "batch1"
+
+    for quantity, batchref in [(15, "batch2"), (8, "batch1"), (8, "batch1")]:
+        line = OrderLine(OrderReference("o1"), SKU("OLD-CLOCK"), quantity)
+        services.reallocate(line, SQLAlchemyUnitOfWork(session_factory))
+        assert find_allocation("o1") == batchref
+
+    assert find_allocation("o2") is None
+
+    services.deallocate("o1", "OLD-CLOCK", SQLAlchemyUnitOfWork(session_factory))
+
+    assert find_allocation("o1") is None
+
+
+def test_unknown_skus_are_rejected_without_queries(
+    test_db_engine: Engine, session_factory: SessionFactory
+) -> None:
+    """A SKU index should keep repeated unknown SKUs from reaching the database."""
+    index = SkuIndex()
+    line = OrderLine(OrderReference("o1"), SKU("GHOST-LAMP"), 1)
+
+    for expected_selects in [1, 0]:
+        with count_selects(test_db_engine) as statements:
+            with pytest.raises(services.InvalidSku):
+                services.allocate(
+                    line, SQLAlchemyUnitOfWork(session_factory, sku_index=index)
+                )
+
+        assert len(statements) == expected_selects
+
+    services.add_batch(
+        BatchCandidate("batch1", "GHOST-LAMP", 10, date(2010, 1, 1)),
+        SQLAlchemyUnitOfWork(session_factory, sku_index=index),
+    )
+
+    assert (
+        services.allocate(line, SQLAlchemyUnitOfWork(session_factory, sku_index=index))
+        == "batch1"
+    )
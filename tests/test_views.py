@@ -0,0 +1,83 @@
+"""Tests for the read model."""
+from datetime import date
+
+from cosmic.domain.batch import BatchReference
+from cosmic.domain.events import Allocated, BatchAdded, Deallocated
+from cosmic.domain.order import SKU, OrderLine, OrderReference
+from cosmic.messagebus import MessageBus
+from cosmic.service_layer import services
+from cosmic.service_layer.unit_of_work import TrackingUnitOfWork
+from cosmic.sqlalchemy import views
+from cosmic.sqlalchemy.unit_of_work import SessionFactory, SQLAlchemyUnitOfWork
+from cosmic.sqlalchemy.views import AllocationView, BatchStockView
+
+
+def test_views_follow_allocations(session_factory: SessionFactory) -> None:
+    """The read model should reflect batches, allocations and deallocations."""
+    messagebus = MessageBus()
+    views.register_handlers(messagebus, session_factory)
+
+    def make_uow() -> TrackingUnitOfWork:
+        return TrackingUnitOfWork(SQLAlchemyUnitOfWork(session_factory), messagebus)
+
+    services.add_batch(
+        services.BatchCandidate("b2", "FAT-CHAIR", 20, date(2010, 1, 2)), make_uow()
+    )
+    services.add_batch(
+        services.BatchCandidate("b1", "FAT-CHAIR", 10, date(2010, 1, 1)), make_uow()
+    )
+    services.add_batch(
+        services.BatchCandidate("b3", "THIN-CHAIR", 10, date(2010, 1, 1)), make_uow()
+    )
+    line = OrderLine(OrderReference("o1"), SKU("FAT-CHAIR"), 5)
+    services.allocate(line, make_uow())
+    other_line = OrderLine(OrderReference("o1"), SKU("THIN-CHAIR"), 2)
+    services.allocate(other_line, make_uow())
+
+    assert views.allocations(session_factory, "o1") == [
+        AllocationView("FAT-CHAIR", 5, "b1"),
+        AllocationView("THIN-CHAIR", 2, "b3"),
+    ]
+    assert views.stock(session_factory, "FAT-CHAIR") == [
+        BatchStockView("b1", date(2010, 1, 1), 10, 5),
+        BatchStockView("b2", date(2010, 1, 2), 20, 20),
+    ]
+
+    services.reallocate(
+        OrderLine(OrderReference("o1"), SKU("FAT-CHAIR"), 15),
+        make_uow(),
+    )
+    services.deallocate("o1", "THIN-CHAIR", make_uow())
+
+    assert views.allocations(session_factory, "o1") == [
+        AllocationView("FAT-CHAIR", 15, "b2"),
+    ]
+    assert [batch.available for batch in views.stock(session_factory, "FAT-CHAIR")] == [
+        10,
+        5,
+    ]
+    assert views.stock(session_factory, "THIN-CHAIR")[0].available == 10
+    assert views.allocations(session_factory, "o2") == []
+
+
+def test_views_handle_events_again(session_factory: SessionFactory) -> None:
+    """The read model should not change when an event is handled again."""
+    messagebus = MessageBus()
+    views.register_handlers(messagebus, session_factory)
+    added = BatchAdded(BatchReference("b1"), SKU("SOFA"), 10, date(2010, 1, 1))
+    allocated = Allocated(OrderReference("o1"), SKU("SOFA"), 4, BatchReference("b1"))
+    deallocated = Deallocated(
+        OrderReference("o1"), SKU("SOFA"), 4, BatchReference("b1")
+    )
+
+    for event in [added, added, allocated, allocated]:
+        messagebus.handle(event)
+
+    assert views.allocations(session_factory, "o1") == [AllocationView("SOFA", 4, "b1")]
+    assert views.stock(session_factory, "SOFA")[0].available == 6
+
+    messagebus.handle(deallocated)
+    messagebus.handle(deallocated)
+
+    assert views.allocations(session_factory, "o1") == []
+    assert views.stock(session_factory, "SOFA")[0].available == 10